@@ -0,0 +1,78 @@
+import threading
+
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from .datatypes import ShopUnitStatisticBucketResponse, ShopUnitStatisticResponse
+from .storage import ShopUnitDatabase, StorageDriver
+
+
+class AsyncDatabaseDriver:
+    """
+    Асинхронный драйвер для обработчиков FastAPI.
+    Методы синхронного хранилища выполняются в пуле потоков и не блокируют event loop,
+    поэтому запросы к MongoDB из разных HTTP-запросов выполняются параллельно.
+    Запись (импорт и удаление) выполняется под общей блокировкой:
+    изменения агрегатов считаются по состоянию базы до записи.
+    """
+    
+    def __init__(self, driver: StorageDriver) -> None:
+        """Инициализация обертки над синхронным драйвером"""
+        
+        self._driver = driver
+        self._write_lock = threading.Lock()
+        
+    async def import_batches(self, batches: List[List[ShopUnitDatabase]]) -> List[Optional[str]]:
+        """Проверка и запись последовательности импортов (см. StorageDriver.import_batches)"""
+        return await run_in_threadpool(self._locked, self._driver.import_batches, batches)
+        
+    async def delete_by_id(self, id: str) -> None:
+        """Удаление элемента по идентификатору"""
+        await run_in_threadpool(self._locked, self._driver.delete_by_id, id)
+        
+    async def get_version(self, id: str) -> int:
+        """Версия товара/категории для ETag"""
+        return await run_in_threadpool(self._driver.get_version, id)
+        
+    async def load_info(self, id: str) -> Tuple[ShopUnitDatabase, Dict[str, List[ShopUnitDatabase]], Dict[str, Optional[int]]]:
+        """Загрузка поддерева товара/категории для потокового ответа"""
+        return await run_in_threadpool(self._driver.load_info, id)
+        
+    async def load_infos(self, ids: List[str]) -> tuple:
+        """Загрузка элементов ids и их поддеревьев (см. StorageDriver.load_infos)"""
+        return await run_in_threadpool(self._driver.load_infos, ids)
+        
+    async def load_info_at(self, id: str, at: str) -> tuple:
+        """Загрузка поддерева товара/категории на момент at (см. StorageDriver.load_info_at)"""
+        return await run_in_threadpool(self._driver.load_info_at, id, at)
+        
+    async def load_info_page(
+            self, 
+            id: str, 
+            depth: Optional[int], 
+            children_limit: Optional[int], 
+            cursor: Optional[str]) -> tuple:
+        """Загрузка части поддерева товара/категории (см. StorageDriver.load_info_page)"""
+        return await run_in_threadpool(self._driver.load_info_page, id, depth, children_limit, cursor)
+        
+    async def get_sales(self, date: str) -> Iterable[dict]:
+        """Получение обновленных товаров за сутки от date"""
+        return await run_in_threadpool(self._driver.get_sales, date)
+        
+    async def get_statistic(self, id: str, start_date: str, end_date: str) -> ShopUnitStatisticResponse:
+        """Получение статистики товара/категории за промежуток времени"""
+        return await run_in_threadpool(self._driver.get_statistic, id, start_date, end_date)
+        
+    async def get_statistic_buckets(
+            self,
+            id: str,
+            start_date: str,
+            end_date: str,
+            granularity: str) -> ShopUnitStatisticBucketResponse:
+        """Получение статистики товара/категории по корзинам времени"""
+        return await run_in_threadpool(self._driver.get_statistic_buckets, id, start_date, end_date, granularity)
+        
+    def _locked(self, function, *args):
+        with self._write_lock:
+            return function(*args)
@@ -0,0 +1,127 @@
+import os
+import threading
+
+from collections import OrderedDict
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+from dotenv import dotenv_values
+
+# Ограничения кэша ответов /nodes/{id} по умолчанию
+NODES_CACHE_MAX_ENTRIES = 1024
+NODES_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+
+class ResponseCache:
+    """
+    LRU-кэш готовых ответов с ограничением по числу записей и по суммарному размеру.
+    Ответ хранится вместе с версией данных, считанной до его сборки,
+    и отдается только при совпадении версии (см. StorageDriver.get_version).
+    При изменении данных записи сбрасываются по ключам (invalidate), освобождая память.
+    """
+    
+    def __init__(self, max_entries: int = NODES_CACHE_MAX_ENTRIES, max_bytes: int = NODES_CACHE_MAX_BYTES) -> None:
+        """Инициализация пустого кэша"""
+        
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        
+        # Ключ -> (версия, ответ)
+        self._entries: OrderedDict[str, Tuple[int, bytes]] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        
+    def get(self, key: str, version: int) -> Optional[bytes]:
+        """Ответ из кэша для версии данных version или None"""
+        
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+            
+    def put(self, key: str, version: int, body: bytes) -> None:
+        """
+        Сохранение ответа, собранного по данным не старше версии version
+        (версия считывается до сборки ответа).
+        """
+        
+        with self._lock:
+            if len(body) > self.max_bytes:
+                return
+            self._remove(key)
+            self._entries[key] = (version, body)
+            self._bytes += len(body)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+                
+    def iterate_and_put(self, key: str, version: int, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """Передача частей ответа дальше с сохранением собранного ответа в кэш"""
+        
+        parts = []
+        size = 0
+        for chunk in chunks:
+            if size <= self.max_bytes:
+                parts.append(chunk)
+                size += len(chunk)
+            yield chunk
+            
+        if size <= self.max_bytes:
+            self.put(key, version, b"".join(parts))
+            
+    def invalidate(self, keys: Optional[Iterable[str]] = None) -> None:
+        """Сброс записей по ключам, при keys=None - всего кэша"""
+        
+        with self._lock:
+            if keys is None:
+                self.invalidations += len(self._entries)
+                self._entries.clear()
+                self._bytes = 0
+                return
+            for key in keys:
+                if self._remove(key):
+                    self.invalidations += 1
+                    
+    def stats(self) -> Dict[str, int]:
+        """Счетчики кэша"""
+        
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations}
+                
+    def _remove(self, key: str) -> bool:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        self._bytes -= len(entry[1])
+        return True
+
+
+def create_nodes_cache() -> ResponseCache:
+    """
+    Создание кэша ответов /nodes/{id} по настройкам NODES_CACHE_MAX_ENTRIES
+    и NODES_CACHE_MAX_BYTES (переменные окружения или /src/.env).
+    """
+    
+    config = dotenv_values("/src/.env")
+    
+    def get_setting(name: str, default: int) -> int:
+        return int(os.environ.get(name, config.get(name, default)))
+        
+    return ResponseCache(
+        max_entries=get_setting("NODES_CACHE_MAX_ENTRIES", NODES_CACHE_MAX_ENTRIES),
+        max_bytes=get_setting("NODES_CACHE_MAX_BYTES", NODES_CACHE_MAX_BYTES))
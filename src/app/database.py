@@ -1,33 +1,35 @@
 import pymongo
 import datetime
-import math
 
-from typing import List, Set, Tuple
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 from dotenv import dotenv_values
 
-from .datatypes import ShopUnitImport
-from .datatypes import ShopUnit
-from .datatypes import ShopUnitStatisticResponse, ShopUnitStatisticUnit
+from .indexes import AGGREGATES_INDEXES, CURRENT_INDEXES, HISTORY_INDEXES, ROLLUPS_INDEXES, ensure_indexes
+from .storage import PriceRollup, ShopUnitDatabase, StorageDriver, WRITE_CHUNK_SIZE
+from .storage import format_sales_date, get_ancestors_paths
 
-class ShopUnitDatabase(ShopUnitImport):
-    """
-    Формат хранения данных в бд. 
-    Аналогичен ShopUnitImport с полем updateDate.
-    """
-    updateDate: datetime.datetime
+# Поля актуальных записей, из которых собирается ShopUnitDatabase
+RECORD_PROJECTION = {"_id": 0, "ancestors": 0, "allAncestors": 0, "version": 0}
 
 
-class DatabaseDriver:
+class DatabaseDriver(StorageDriver):
     """
     Драйвер для MongoDB
     """
-
+    
     def __init__(self) -> None:
         """
         Инициализация драйвера MongoDB 
-        (создается client соединение и подключается к коллекции products_and_categories).
+        (создается client соединение и подключается к коллекциям:
+        products_and_categories - история всех записей,
+        products_and_categories_current - актуальная запись каждого элемента,
+        category_aggregates - агрегаты цен категорий,
+        category_price_rollups - сводки цен категорий по часам и дням,
+        counters - счетчик записей для версий элементов и отметки миграций).
         """
         
+        super().__init__()
+        
         config = dotenv_values("/src/.env")
         
         TESTING = config["TESTING"]
@@ -37,402 +39,591 @@ class DatabaseDriver:
             username=config["MONGODB_USERNAME"],
             password=config["MONGODB_PASSWORD"],
             port=27017)
-        
+            
         db = self._client["price_comparison_db"]
         
         if not TESTING:
-            self._collection: pymongo.collection.Collection = db["products_and_categories"]
+            self._history: pymongo.collection.Collection = db["products_and_categories"]
+            self._current: pymongo.collection.Collection = db["products_and_categories_current"]
+            self._aggregates: pymongo.collection.Collection = db["category_aggregates"]
+            self._rollups: pymongo.collection.Collection = db["category_price_rollups"]
+            self._counters: pymongo.collection.Collection = db["counters"]
         else:
-            self._collection: pymongo.collection.Collection = db["products_and_categories_test"]
+            self._history: pymongo.collection.Collection = db["products_and_categories_test"]
+            self._current: pymongo.collection.Collection = db["products_and_categories_current_test"]
+            self._aggregates: pymongo.collection.Collection = db["category_aggregates_test"]
+            self._rollups: pymongo.collection.Collection = db["category_price_rollups_test"]
+            self._counters: pymongo.collection.Collection = db["counters_test"]
+            
+        ensure_indexes(self._history, HISTORY_INDEXES)
+        ensure_indexes(self._current, CURRENT_INDEXES)
+        ensure_indexes(self._aggregates, AGGREGATES_INDEXES)
+        ensure_indexes(self._rollups, ROLLUPS_INDEXES)
+        
+        # Актуальные записи и агрегаты появились позже истории -
+        # для уже заполненной базы считаем их один раз при старте
+        if self._current.find_one() is None and self._history.find_one() is not None:
+            self.rebuild_current_collection()
+        if self._current.find_one({"ancestors": {"$exists": False}}) is not None:
+            self.rebuild_ancestors()
+        if self._aggregates.find_one() is None and self._current.find_one() is not None:
+            self.rebuild_category_aggregates()
+        # Сводки цен появились позже истории - для уже заполненной базы строим их
+        # по всей истории один раз, после чего в counters остается отметка миграции
+        if self._counters.find_one({"_id": "price_rollups"}) is None:
+            if self._rollups.find_one() is None and self._history.find_one() is not None:
+                self.replay_price_rollups(datetime.datetime.min)
+            self._counters.update_one({"_id": "price_rollups"}, {"$set": {"done": True}}, upsert=True)
             
     def clear_collection(self):
-        """Очистка коллекции"""
-        self._collection.delete_many({})
-        
-    def write_shop_unit_database_to_collection(self, shop_unit: ShopUnitDatabase) -> None:
-        """Запись объекта ShopUnitDatabase в базу."""
-        self._collection.insert_one(shop_unit.__dict__)
-        
-    def write_list_shop_unit_database_to_collection(self, shop_units: List[ShopUnitDatabase]) -> None:
-        """Запись списка объектов ShopUnitDatabase в базу."""
-        for shop_unit in shop_units:
-            self.write_shop_unit_database_to_collection(shop_unit)
+        """Очистка коллекций"""
+        self._history.delete_many({})
+        self._current.delete_many({})
+        self._aggregates.delete_many({})
+        self._rollups.delete_many({})
+        self.notify_changed(None)
+        
+    def insert_history_records(
+            self, 
+            shop_units: List[ShopUnitDatabase], 
+            chunk_size: int = WRITE_CHUNK_SIZE, 
+            ordered: bool = True) -> int:
+        """Запись объектов в историю пачками через insert_many"""
+        
+        inserted_count = 0
+        for i in range(0, len(shop_units), chunk_size):
+            result = self._history.insert_many(
+                [dict(shop_unit.__dict__) for shop_unit in shop_units[i:i + chunk_size]], 
+                ordered=ordered)
+            inserted_count += len(result.inserted_ids)
             
-    def check_ids_new_shop_units(self, new_ids_types: List[dict], new_parent_ids: List[str]) -> None:
+        return inserted_count
+        
+    def write_current_records(
+            self, 
+            shop_units: List[ShopUnitDatabase], 
+            records: Dict[str, ShopUnitDatabase], 
+            ancestors: Dict[str, List[str]],
+            former_ancestors: Dict[str, Set[str]],
+            chunk_size: int = WRITE_CHUNK_SIZE) -> None:
         """
-        1. Проверка отсутствия новых id в уже существующих id с разным type.
-        2. Запись объектов с одинаковыми id и type в бд.
-        3. Проверка существования parentIds в бд или в новых ShopUnits
+        Обновление актуальных записей элементов.
+        Кроме полей элемента хранятся ancestors - путь предков от корня к родителю
+        и allAncestors - все категории, в поддереве которых элемент когда-либо был.
+        Элемент, перенесенный в другую категорию, записывается заново,
+        чтобы оказаться в конце списка дочерних элементов новой категории.
         """
-        # Словарь существующих товаров и их типов
-        old_ids_types = dict()
-        
-        # Считываем id и type элемента из базы, 
-        # запоминаем id категорий из базы
-        # и выполняем 1 и 2 задачи
-        for old_id_type in self._collection.find({}, {"id": 1, "type": 1}):
-            # Если id из базы есть в списке новых id
-            if old_id_type["id"] in new_ids_types:
-                # Если их type не совпадает
-                if new_ids_types[old_id_type["id"]] != old_id_type["type"]:
-                    # Вызываем исключение
-                    raise ValueError(
-                        f"Unit with id={old_id_type['id']} has different type with the already exist in db.")
-            # Если id из базы отсутствует в списке новых id
-            else:
-                # Запоминаем этот id и его type
-                old_ids_types[old_id_type["id"]] = old_id_type["type"]
         
-        # Проверяем new_parent_ids
-        for new_parent_id in new_parent_ids:
-            if new_parent_id not in new_ids_types and new_parent_id not in old_ids_types:
-                raise ValueError(f"Parent element with id {new_parent_id} not exist")
+        moved_ids = [
+            shop_unit.id for shop_unit in shop_units
+            if shop_unit.id in records and records[shop_unit.id].parentId != shop_unit.parentId]
+            
+        # Операции сгруппированы по типу: упорядоченный bulk_write отправляет
+        # одну команду на каждую серию операций одного типа
+        updates = []
+        inserts = []
+        for shop_unit in shop_units:
+            path = ancestors[shop_unit.id]
+            record = records.get(shop_unit.id)
+            if record is not None and record.parentId == shop_unit.parentId:
+                # Запись не заменяется записью с более ранней updateDate
+                updates.append(pymongo.UpdateOne(
+                    {"id": shop_unit.id, "updateDate": {"$lte": shop_unit.updateDate}},
+                    {"$set": {**shop_unit.__dict__, "ancestors": path},
+                     "$addToSet": {"allAncestors": {"$each": list(former_ancestors[shop_unit.id])}}}))
             else:
-                if new_parent_id in new_ids_types and new_ids_types[new_parent_id] == "OFFER":
-                    raise ValueError(f"{new_parent_id} is 'OFFER', not 'CATEGORY'")
-                elif new_parent_id in old_ids_types and old_ids_types[new_parent_id] == "OFFER":
-                    raise ValueError(f"{new_parent_id} is 'OFFER', not 'CATEGORY'")
+                document = dict(shop_unit.__dict__)
+                document["ancestors"] = path
+                document["allAncestors"] = list(former_ancestors[shop_unit.id])
+                inserts.append(pymongo.InsertOne(document))
                 
-    def recursive_delete_childs(self, childs: Set[Tuple[str, str]], id) -> None:
-        """Рекурсивный поиск подкаталогов для удаления"""
-        
-        elements = self._collection.find({"parentId": id}, {"id": 1, "parentId": 1, "type": 1})
-        
-        for element in elements:
-            childs.add((element["id"], element["parentId"]))
-            if element["type"] == "CATEGORY":
-                self.recursive_delete_childs(childs, element["id"])
-    
-    def delete_by_id(self, id: str) -> None:
-        """
-        Удаление элемента по идентификатору.
-        При удалении категории удаляются все дочерние элементы.
-        """
-        if self.get_type_by_id(id) == "CATEGORY":
-            childs = set()
-            self.recursive_delete_childs(childs, id)
-            for child in childs:
-                self._collection.delete_many({"id": child[0], "parentId": child[1]})
-        self._collection.delete_many({"id": id})
-    
-    def get_latest_record_shop_unit(self, id: str) -> ShopUnitDatabase:
+        requests = []
+        if len(moved_ids) > 0:
+            requests.append(pymongo.DeleteMany({"id": {"$in": moved_ids}}))
+        requests.extend(inserts)
+        requests.extend(updates)
+        
+        for i in range(0, len(requests), chunk_size):
+            self._current.bulk_write(requests[i:i + chunk_size])
+            
+    def update_ancestors(self, ancestors: Dict[str, List[str]], chunk_size: int = WRITE_CHUNK_SIZE) -> None:
+        """Обновление путей предков элементов, не входящих в импорт"""
+        
+        requests = [
+            pymongo.UpdateOne(
+                {"id": id},
+                {"$set": {"ancestors": path}, "$addToSet": {"allAncestors": {"$each": path}}})
+            for id, path in ancestors.items()]
+            
+        for i in range(0, len(requests), chunk_size):
+            self._current.bulk_write(requests[i:i + chunk_size])
+            
+    def add_former_ancestors(self, ancestors_ids: Dict[str, Set[str]], chunk_size: int = WRITE_CHUNK_SIZE) -> None:
         """
-        Получение новейшей записи о товаре/категории
+        Добавление категорий ancestors_ids[id] к allAncestors элемента id
+        и элементов, у которых id есть в allAncestors (одной записью)
         """
         
-        try:
-            unit = self._collection.find({"id": id}).sort("updateDate", pymongo.DESCENDING).limit(1)[0]
-            del unit["_id"]
-            shop_unit_database = ShopUnitDatabase(**unit)
+        requests = [
+            pymongo.UpdateMany(
+                {"$or": [{"id": id}, {"allAncestors": id}]},
+                {"$addToSet": {"allAncestors": {"$each": list(added)}}})
+            for id, added in ancestors_ids.items()]
             
-            return shop_unit_database
-        except:
-            raise ValueError(f"Unit with id {id} missing in db")
-        
-    def get_info(self, id: str) -> ShopUnit:
-        """Получение информации о товаре/категории"""
+        for i in range(0, len(requests), chunk_size):
+            self._current.bulk_write(requests[i:i + chunk_size], ordered=False)
+            
+    def apply_aggregates_deltas(self, deltas: Dict[str, List[int]]) -> None:
+        """Запись изменений агрегатов категорий в базу"""
+        
+        requests = [
+            pymongo.UpdateOne(
+                {"id": id}, 
+                {"$inc": {"sum": delta[0], "count": delta[1]}}, 
+                upsert=True)
+            for id, delta in deltas.items() if delta != [0, 0]]
+            
+        if len(requests) > 0:
+            self._aggregates.bulk_write(requests)
+            
+    def rebuild_category_aggregates(self) -> None:
+        """Полный пересчет агрегатов категорий по актуальным записям"""
         
-        shop_unit_database_dict = self.get_latest_record_shop_unit(id).__dict__
+        # Актуальные записи элементов
+        latest = dict()
+        for unit in self._current.find({}, {"_id": 0}):
+            latest[unit["id"]] = unit
+            
+        aggregates = {
+            id: [0, 0] for id, unit in latest.items() if unit["type"] == "CATEGORY"}
+            
+        for unit in latest.values():
+            if unit["type"] != "OFFER":
+                continue
+            visited = set()
+            parent_id = unit["parentId"]
+            while parent_id in aggregates and parent_id not in visited:
+                visited.add(parent_id)
+                aggregates[parent_id][0] += unit["price"]
+                aggregates[parent_id][1] += 1
+                parent_id = latest[parent_id]["parentId"]
+                
+        self._aggregates.delete_many({})
+        if len(aggregates) > 0:
+            self._aggregates.insert_many([
+                {"id": id, "sum": aggregate[0], "count": aggregate[1]}
+                for id, aggregate in aggregates.items()])
+                
+    def rebuild_current_collection(self) -> None:
+        """Заполнение актуальных записей по истории"""
         
-        iso_date = shop_unit_database_dict["updateDate"].isoformat() + ".000Z"
+        pipeline = [
+            {"$sort": {"updateDate": pymongo.DESCENDING}},
+            {"$group": {"_id": "$id", "unit": {"$first": "$$ROOT"}}}]
+            
+        units = []
+        for element in self._history.aggregate(pipeline, allowDiskUse=True):
+            unit = element["unit"]
+            del unit["_id"]
+            units.append(unit)
+            
+        self._current.delete_many({})
+        for i in range(0, len(units), WRITE_CHUNK_SIZE):
+            self._current.insert_many(units[i:i + WRITE_CHUNK_SIZE])
+            
+    def rebuild_ancestors(self) -> None:
+        """
+        Заполнение путей предков актуальных записей.
+        allAncestors строится по всем parentId из истории с замыканием
+        по предкам бывших родителей - с запасом, но без пропусков.
+        """
         
-        del shop_unit_database_dict["updateDate"]
+        parents = {
+            element["id"]: element["parentId"]
+            for element in self._current.find({}, {"_id": 0, "id": 1, "parentId": 1})}
+        paths = get_ancestors_paths(list(parents), parents, dict())
+        
+        # Когда-либо бывшие родители элементов
+        former_parents = dict()
+        pipeline = [{"$group": {"_id": {"id": "$id", "parentId": "$parentId"}}}]
+        for element in self._history.aggregate(pipeline, allowDiskUse=True):
+            if element["_id"].get("parentId") is not None:
+                former_parents.setdefault(element["_id"]["id"], set()).add(element["_id"]["parentId"])
+                
+        requests = []
+        for id, path in paths.items():
+            all_ancestors = set(path)
+            level = former_parents.get(id, set())
+            while len(level) > 0:
+                all_ancestors.update(level)
+                level = {
+                    parent_id for unit_id in level for parent_id in former_parents.get(unit_id, set())
+                    if parent_id not in all_ancestors}
+            requests.append(pymongo.UpdateOne(
+                {"id": id}, {"$set": {"ancestors": path, "allAncestors": list(all_ancestors)}}))
+                
+        for i in range(0, len(requests), WRITE_CHUNK_SIZE):
+            self._current.bulk_write(requests[i:i + WRITE_CHUNK_SIZE])
+            
+    def get_types_by_ids(self, ids: List[str]) -> Dict[str, str]:
+        """Возвращает type существующих в базе элементов из ids"""
         
-        shop_unit = ShopUnit(
-            **shop_unit_database_dict, 
-            date=iso_date)
+        return {
+            element["id"]: element["type"] 
+            for element in self._current.find({"id": {"$in": ids}}, {"id": 1, "type": 1})}
+            
+    def delete_records(self, ids: Set[str], categories_ids: Set[str], chunk_size: int = WRITE_CHUNK_SIZE) -> None:
+        """
+        Удаление элементов ids (актуальные записи и история),
+        записей истории с parentId из categories_ids и агрегатов categories_ids.
+        Для больших поддеревьев delete_many выполняется пачками по chunk_size ids.
+        """
         
-        if shop_unit.type == "CATEGORY":
-            storage = []
+        categories_ids = list(categories_ids)
+        for i in range(0, len(categories_ids), chunk_size):
+            chunk = categories_ids[i:i + chunk_size]
+            self._history.delete_many({"parentId": {"$in": chunk}})
+            self._aggregates.delete_many({"id": {"$in": chunk}})
             
-            price_count = self.recursive_get_childrens(storage, shop_unit.id)
-                    
-            shop_unit.children = storage
-            if len(storage) > 0:
-                shop_unit.price = math.floor(price_count[0]/price_count[1])
+        ids = list(ids)
+        for i in range(0, len(ids), chunk_size):
+            chunk = ids[i:i + chunk_size]
+            self._history.delete_many({"id": {"$in": chunk}})
+            self._current.delete_many({"id": {"$in": chunk}})
             
-        return shop_unit
+    def get_subtree_types(self, id: str) -> Dict[str, str]:
+        """Типы элементов поддерева id (включая сам элемент) одним запросом по путям предков"""
         
+        return {
+            element["id"]: element["type"]
+            for element in self._current.find(
+                {"$or": [{"id": id}, {"ancestors": id}]}, {"_id": 0, "id": 1, "type": 1})}
+                
+    def get_latest_records_shop_units(self, ids: List[str]) -> Dict[str, ShopUnitDatabase]:
+        """
+        Получение новейших записей о товарах/категориях одним запросом
+        """
         
-    def get_childrens_ids(self, parent_id: str) -> List[str]:
-        """Считывание ids элементов c указанным parent_id"""
-        
-        elements_ids = self._collection.find({"parentId": parent_id}, {"id": 1})
+        units = dict()
+        for unit in self._current.find({"id": {"$in": ids}}, RECORD_PROJECTION):
+            units[unit["id"]] = ShopUnitDatabase.from_document(unit)
+            
+        return units
         
-        ids = []
-        for element_id in elements_ids:
-            if element_id["id"] not in ids:
-                ids.append(element_id["id"])
+    def get_category_aggregates(self, ids: List[str]) -> Dict[str, Tuple[int, int]]:
+        """Возвращает (суммарная стоимость, количество товаров) категорий из ids"""
         
-        return ids
+        return {
+            aggregate["id"]: (aggregate["sum"], aggregate["count"])
+            for aggregate in self._aggregates.find({"id": {"$in": ids}}, {"id": 1, "sum": 1, "count": 1})}
+            
+    def get_ancestors(self, ids: List[str]) -> Dict[str, List[str]]:
+        """Пути предков (от корня к родителю) существующих элементов из ids"""
         
-    def recursive_get_childrens(self, storage: List[ShopUnit], parent_id: str) -> tuple:
-        """Рекурсивное считывание товаров и подкаталогов"""
+        return {
+            element["id"]: element["ancestors"]
+            for element in self._current.find({"id": {"$in": ids}}, {"_id": 0, "id": 1, "ancestors": 1})}
+            
+    def get_all_ancestors(self, ids: List[str]) -> Dict[str, Tuple[List[str], Set[str]]]:
+        """Пути предков (от корня к родителю) и allAncestors существующих элементов из ids"""
         
-        #Суммарная стоимость и количество товаров текущего каталога
-        price = 0
-        count = 0
+        return {
+            element["id"]: (element["ancestors"], set(element.get("allAncestors", [])))
+            for element in self._current.find(
+                {"id": {"$in": ids}}, {"_id": 0, "id": 1, "ancestors": 1, "allAncestors": 1})}
+                
+    def get_subtree_records(self, ids: List[str]) -> List[ShopUnitDatabase]:
+        """Актуальные записи потомков элементов ids в порядке добавления одним запросом"""
         
-        #Считываем id дочерних элементов категории
-        ids = self.get_childrens_ids(parent_id)
+        query = {"ancestors": ids[0]} if len(ids) == 1 else {"ancestors": {"$in": ids}}
         
-        for id in ids:
-            # Получаем актуальную информацию об элементе
-            shop_unit_database_dict = self.get_latest_record_shop_unit(id).__dict__
-            # Преобразуем дату
-            iso_date = shop_unit_database_dict["updateDate"].isoformat() + ".000Z"
-            # Удаляем дату из словаря
-            del shop_unit_database_dict["updateDate"]
-            # Переводим в класс ShopUnit
-            shop_unit = ShopUnit(
-            **shop_unit_database_dict, 
-            date=iso_date)
+        return [
+            ShopUnitDatabase.from_document(unit)
+            for unit in self._current.find(query, RECORD_PROJECTION).sort("_id", pymongo.ASCENDING)]
             
-            # Если нашлась подкатегория
-            if shop_unit.type == "CATEGORY":
-                # Рекурсивно считываем данные подкатегории
-                new_storage = []
-                price_count = self.recursive_get_childrens(new_storage, shop_unit.id)
-                
-                # Записываем children и среднюю цену категории
-                shop_unit.children = new_storage
-                if len(new_storage) > 0:
-                    shop_unit.price = math.floor(price_count[0]/price_count[1])
-                
-                # Увеличиваем суммарную стоимость и кол-во товаров категории
-                price += price_count[0]
-                count += price_count[1]
-            # Если просто товар
-            else:
-                # Просто увеличиваем стоимость категории и кол-во товаров
-                price += shop_unit.price
-                count += 1
-            
-            # Пополняем список childs
-            storage.append(shop_unit)
-        
-        # Возвращаем суммарную стоимость и количество товаров категории
-        return (price, count)
-    
-    def get_ids_parent_actual(self, ids: dict, parend_id: str, date: datetime.datetime) -> List[str]:
+    def get_childrens(
+            self,
+            parent_ids: List[str],
+            limit: Optional[int] = None,
+            after_id: Optional[str] = None) -> Dict[str, List[ShopUnitDatabase]]:
         """
-        Проверка, действительно указанные _ids имеют актульную
-        принадлежность к parent_id на момент date.
-        Возвращает валидные _ids
+        Актуальные записи дочерних элементов категорий в порядке добавления:
+        не более limit на категорию и, если задан after_id, - после дочернего элемента after_id
+        (after_id - только для одной категории).
+        Выполняется одним запросом: для одной категории - find с limit,
+        для нескольких с limit - агрегация с отбором первых limit дочерних элементов каждой.
         """
-        _ids = list()
-        for id in ids:
-            data = self._collection.find(
-                {"id": id, 
-                 "updateDate": {"$lte": date}    
-                }, 
-                {"parentId": 1, 
-                 "updateDate": 1}).sort("updateDate", pymongo.DESCENDING).limit(1)[0]
-            if data["parentId"] == parend_id:
-                _ids.append(ids[id]["_id"])
-        return _ids
         
-    
-    def get_childrens_by_date(self, parend_id: str, date: datetime.datetime) -> List[int]:
-        """Возвращает список _id (MongoDB) элементов с parend_id на момент date"""
-        
-        elements = self._collection.find(
-            {"parentId": parend_id, 
-             "updateDate": {"$lte": date}
-            }, {"id": 1, "updateDate": 1})
-        
-        ids = dict()
-        for element in elements:
-            if element["id"] not in ids:
-                ids[element["id"]] = {
-                    "_id": element["_id"], 
-                    "updateDate": element["updateDate"]}
-            elif ids[element["id"]]["updateDate"] < element["updateDate"] :
-                ids[element["id"]] = {
-                    "_id": element["_id"], 
-                    "updateDate": element["updateDate"]}
-        
-        _ids = self.get_ids_parent_actual(ids, parend_id, date)
-        
-        return _ids
-    
-    def get_update_dates_by_id(self, id: str) -> Set[datetime.datetime]:
-        """Считывает все даты обновления элемента по id"""
+        pages = {parent_id: [] for parent_id in parent_ids}
+        if len(parent_ids) == 0:
+            return pages
+            
+        filter = {"parentId": parent_ids[0] if len(parent_ids) == 1 else {"$in": parent_ids}}
+        if after_id is not None:
+            after = None
+            if len(parent_ids) == 1:
+                after = self._current.find_one({"id": after_id, "parentId": parent_ids[0]}, {"_id": 1})
+            if after is None:
+                raise ValueError(f"Unit with id {after_id} is not a child of {parent_ids[0]}")
+            filter["_id"] = {"$gt": after["_id"]}
+            
+        if limit is None or len(parent_ids) == 1:
+            elements = self._current.find(filter, RECORD_PROJECTION).sort("_id", pymongo.ASCENDING)
+            if limit is not None:
+                elements = elements.limit(limit)
+            for unit in elements:
+                pages[unit["parentId"]].append(ShopUnitDatabase.from_document(unit))
+            return pages
+            
+        # Сортировка по индексу (parentId, _id), в группу попадают записи без путей предков
+        pipeline = [
+            {"$match": filter},
+            {"$sort": {"parentId": pymongo.ASCENDING, "_id": pymongo.ASCENDING}},
+            {"$project": RECORD_PROJECTION},
+            {"$group": {"_id": "$parentId", "units": {"$push": "$$ROOT"}}},
+            {"$project": {"units": {"$slice": ["$units", limit]}}}]
+        for element in self._current.aggregate(pipeline, allowDiskUse=True):
+            pages[element["_id"]] = [ShopUnitDatabase.from_document(unit) for unit in element["units"]]
+            
+        return pages
         
-        dates = set()
+    def count_childrens(self, parent_ids: List[str]) -> Dict[str, int]:
+        """Количество дочерних элементов категорий одним запросом"""
         
-        for date in self._collection.find({"id": id}, {"updateDate": 1}):
-            dates.add(date["updateDate"])
+        counts = {parent_id: 0 for parent_id in parent_ids}
         
-        return dates
+        pipeline = [
+            {"$match": {"parentId": {"$in": parent_ids}}},
+            {"$group": {"_id": "$parentId", "count": {"$sum": 1}}}]
+        for element in self._current.aggregate(pipeline):
+            counts[element["_id"]] = element["count"]
             
-    def recursive_find_update_dates(self, parent_id: str, update_dates: Set[datetime.datetime]) -> None:
-        """Поиск всех дат обновления категории"""
+        return counts
         
-        #Считываем id дочерних элементов категории
-        ids = self.get_childrens_ids(parent_id)
+    def get_subtree_parents(self, ids: List[str]) -> Dict[str, Optional[str]]:
+        """parentId всех потомков элементов ids"""
         
-        for id in ids:
-            update_dates.update(self.get_update_dates_by_id(id))
-            if self.get_type_by_id(id) == "CATEGORY":
-                self.recursive_find_update_dates(id, update_dates)
+        return {
+            element["id"]: element["parentId"]
+            for element in self._current.find(
+                {"ancestors": {"$in": ids}}, {"_id": 0, "id": 1, "parentId": 1})}
                 
-    def find_update_dates(self, id: str) -> Set[datetime.datetime]:
-        """Поиск всех дат обновления товара/категории"""
-        
-        update_dates = self.get_update_dates_by_id(id)
-        if self.get_type_by_id(id) == "CATEGORY":
-            self.recursive_find_update_dates(id, update_dates)
-        
-        return update_dates
-    
-    def get_shop_unit_database_by_bd_id(self, _id: str) -> ShopUnitDatabase:
+    def get_former_descendants_ids(self, ids: List[str]) -> Set[str]:
         """
-        Получение записи о товаре/категории по _id
+        Ids элементов, когда-либо находившихся в поддеревьях ids.
+        Может содержать лишние элементы, но не пропускает ни одного.
         """
         
-        try:
-            unit = self._collection.find_one({"_id": _id})
-            del unit["_id"]
-            shop_unit_database = ShopUnitDatabase(**unit)
+        if len(ids) == 0:
+            return set()
             
-            return shop_unit_database
-        except:
-            raise ValueError(f"Unit with id {id} missing in db")
-    
-    def recursive_get_statistic(self, parent_id: str, date: datetime.datetime):
-        """Рекурсивное получение статистики по категории за date"""
+        return set(self._current.distinct("id", {"allAncestors": {"$in": ids}}))
         
-        #Суммарная стоимость и количество товаров текущего каталога
-        price = 0
-        count = 0
+    def get_former_ancestors_ids(self, ids: List[str]) -> Set[str]:
+        """Ids категорий, в поддеревьях которых когда-либо находились элементы ids"""
         
-        #Считываем id дочерних элементов категории
-        _ids = self.get_childrens_by_date(parent_id, date)
+        return set(self._current.distinct("allAncestors", {"id": {"$in": ids}}))
         
-        for _id in _ids:
-            # Получаем актуальную информацию об элементе
-            shop_unit_database = self.get_shop_unit_database_by_bd_id(_id)
-            
-            # Если нашлась подкатегория
-            if shop_unit_database.type == "CATEGORY":
-                # Рекурсивно считываем данные подкатегории
-                price_count = self.recursive_get_statistic(shop_unit_database.id, date)
-                
-                # Увеличиваем суммарную стоимость и кол-во товаров категории
-                price += price_count[0]
-                count += price_count[1]
-            # Если просто товар
-            else:
-                # Просто увеличиваем стоимость категории и кол-во товаров
-                price += shop_unit_database.price
-                count += 1
+    def next_version(self) -> int:
+        """Следующее значение сквозного счетчика записей"""
         
-        # Возвращаем суммарную стоимость и количество товаров категории
-        return (price, count)
-    
-    def get_actual_shop_unit_database(self, id: str, date: datetime.datetime) -> ShopUnitDatabase:
-        """Получение актуальной ShopUnitDatabase по id на момент date"""
+        counter = self._counters.find_one_and_update(
+            {"_id": "version"},
+            {"$inc": {"value": 1}},
+            upsert=True,
+            return_document=pymongo.ReturnDocument.AFTER)
+            
+        return counter["value"]
         
-        unit = self._collection.find(
-                {"id": id, 
-                 "updateDate": {"$lte": date}    
-                }).sort("updateDate", pymongo.DESCENDING).limit(1)[0]
+    def set_versions(self, ids: Set[str], version: int) -> None:
+        """Запись версии существующим элементам ids"""
         
-        del unit["_id"]
-        shop_unit_database = ShopUnitDatabase(**unit)
-            
-        return shop_unit_database
+        ids = list(ids)
+        for i in range(0, len(ids), WRITE_CHUNK_SIZE):
+            self._current.update_many(
+                {"id": {"$in": ids[i:i + WRITE_CHUNK_SIZE]}}, {"$set": {"version": version}})
                 
-    def get_statistic(self, id: str, start_date: str, end_date: str) -> ShopUnitStatisticResponse:
-        """Получение статистики товара за определенный промежуток времени"""
+    def get_versions(self, ids: List[str]) -> Dict[str, int]:
+        """Версии существующих элементов из ids (0 - для записей, созданных до появления версий)"""
         
-        start_datetime = datetime.datetime.fromisoformat(start_date)
-        end_datetime = datetime.datetime.fromisoformat(end_date)
+        return {
+            element["id"]: element.get("version", 0)
+            for element in self._current.find({"id": {"$in": ids}}, {"_id": 0, "id": 1, "version": 1})}
+            
+    def get_history_records(self, ids: List[str], end_date: datetime.datetime) -> List[ShopUnitDatabase]:
+        """Записи истории элементов ids до end_date (не включительно) в порядке updateDate"""
         
-        update_dates = self.find_update_dates(id)
+        elements = self._history.find(
+            {"id": {"$in": ids}, "updateDate": {"$lt": end_date}},
+            {"_id": 0}
+        ).sort([("updateDate", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)])
         
-        dates = list()
+        return [ShopUnitDatabase.from_document(element) for element in elements]
         
-        for update_date in update_dates:
-            if update_date >= start_datetime and update_date < end_datetime:
-                dates.append(update_date)
-                
-        type = self.get_type_by_id(id)
+    def get_former_descendants_history(self, ids: List[str], end_date: datetime.datetime) -> List[ShopUnitDatabase]:
+        """
+        Записи истории элементов ids и их бывших потомков до end_date (не включительно)
+        в порядке updateDate: элементы выбираются по индексу allAncestors актуальных записей,
+        их история присоединяется по индексу (id, updateDate) - одной агрегацией.
+        """
         
-        items = []
-        for date in dates:
-            shop_unit_database_dict = self.get_actual_shop_unit_database(id, date).__dict__
-    
-            del shop_unit_database_dict["updateDate"]
-    
-            shop_unit_statistic_unit = ShopUnitStatisticUnit(
-                **shop_unit_database_dict, 
-                date=date.isoformat() + ".000Z")
-            
-            if type == "CATEGORY":
-                price_count = self.recursive_get_statistic(shop_unit_statistic_unit.id, date)
-                if price_count[1] > 0:
-                    shop_unit_statistic_unit.price = math.floor(price_count[0]/price_count[1])
+        pipeline = [
+            {"$match": {"$or": [{"id": {"$in": ids}}, {"allAncestors": {"$in": ids}}]}},
+            {"$project": {"_id": 0, "id": 1}},
+            {"$lookup": {"from": self._history.name, "localField": "id", "foreignField": "id", "as": "records"}},
+            {"$unwind": "$records"},
+            {"$replaceRoot": {"newRoot": "$records"}},
+            {"$match": {"updateDate": {"$lt": end_date}}},
+            {"$sort": {"updateDate": pymongo.ASCENDING, "_id": pymongo.ASCENDING}},
+            {"$project": {"_id": 0}}]
             
-            items.append(shop_unit_statistic_unit)
+        return [
+            ShopUnitDatabase.from_document(element)
+            for element in self._current.aggregate(pipeline, allowDiskUse=True)]
             
-        shop_unit_statistic_response = ShopUnitStatisticResponse(items=items)
-
-        return shop_unit_statistic_response
-    
-    def get_type_by_id(self, id: str) -> str:
-        """Возвращает type элемента с id"""
-        
-        return self._collection.find_one({"id": id}, {"type": 1})["type"]
-    
-    def get_updated_offers(self, start_date: datetime.datetime, end_date: datetime.datetime) -> List[ShopUnitDatabase]:
-        """Получение списка обновленных товаров на интервале"""
-        
-        elements = self._collection.find(
-            {"type": "OFFER", "updateDate": {"$gte": start_date, "$lte": end_date}
-        })
-        
-        units = []
+    def get_updated_records(self, start_date: datetime.datetime, end_date: datetime.datetime) -> List[ShopUnitDatabase]:
+        """
+        Записи истории всех элементов с updateDate в [start_date, end_date) в порядке updateDate.
+        Условие на type - для выборки по индексу (type, updateDate).
+        """
         
-        for element in elements:
-            del element["_id"]
-            shop_unit_database = ShopUnitDatabase(**element)
-            units.append(shop_unit_database)
+        pipeline = [
+            {"$match": {"type": {"$in": ["CATEGORY", "OFFER"]}, "updateDate": {"$gte": start_date, "$lt": end_date}}},
+            {"$sort": {"updateDate": pymongo.ASCENDING, "_id": pymongo.ASCENDING}},
+            {"$project": {"_id": 0}}]
+            
+        return [
+            ShopUnitDatabase.from_document(element)
+            for element in self._history.aggregate(pipeline, allowDiskUse=True)]
+            
+    def get_records_at(self, ids: List[str], end_date: datetime.datetime) -> List[ShopUnitDatabase]:
+        """
+        Состояние элементов ids до end_date (не включительно) - последние записи истории
+        по updateDate, в порядке появления элементов в истории.
+        Выборка по индексу (id, updateDate), выбор последней записи - на стороне MongoDB.
+        """
         
-        return units
-    
-    def get_sales(self, date: str) -> ShopUnitStatisticResponse:
-        """Функция для получения обновленных товаров за сутки от date"""
+        pipeline = [
+            {"$match": {"id": {"$in": ids}, "updateDate": {"$lt": end_date}}},
+            {"$sort": {"id": pymongo.ASCENDING, "updateDate": pymongo.ASCENDING, "_id": pymongo.ASCENDING}},
+            {"$group": {"_id": "$id", "first": {"$min": "$_id"}, "record": {"$last": "$$ROOT"}}},
+            {"$sort": {"first": pymongo.ASCENDING}}]
+            
+        return [
+            ShopUnitDatabase.from_document(element["record"])
+            for element in self._history.aggregate(pipeline, allowDiskUse=True)]
+            
+    def get_price_rollups(
+            self,
+            ids: List[str],
+            start: datetime.datetime,
+            end: datetime.datetime,
+            granularity: Optional[str] = None) -> List[PriceRollup]:
+        """Сводки цен категорий ids с началом корзины в [start, end) по индексу (id, granularity, bucket)"""
+        
+        filter = {"id": {"$in": ids}, "bucket": {"$gte": start, "$lt": end}}
+        if granularity is not None:
+            filter["granularity"] = granularity
+            
+        elements = self._rollups.find(filter, {"_id": 0}).sort([
+            ("id", pymongo.ASCENDING), ("granularity", pymongo.ASCENDING), ("bucket", pymongo.ASCENDING)])
+            
+        return [PriceRollup(**element) for element in elements]
         
-        _datetime = datetime.datetime.fromisoformat(date)
-        start_date = _datetime - datetime.timedelta(days=1)
-        end_date = _datetime
+    def get_latest_price_rollups(self, ids: List[str], end: datetime.datetime) -> Dict[str, PriceRollup]:
+        """
+        Последние часовые сводки цен категорий ids с началом корзины до end.
+        Выбор последней сводки по индексу (id, granularity, bucket) - на стороне MongoDB.
+        """
         
-        updated_units = self.get_updated_offers(start_date, end_date)
+        pipeline = [
+            {"$match": {"id": {"$in": ids}, "granularity": "hour", "bucket": {"$lt": end}}},
+            {"$sort": {"id": pymongo.ASCENDING, "granularity": pymongo.ASCENDING, "bucket": pymongo.DESCENDING}},
+            {"$group": {"_id": "$id", "rollup": {"$first": "$$ROOT"}}},
+            {"$project": {"rollup._id": 0}}]
+            
+        return {
+            element["_id"]: PriceRollup(**element["rollup"])
+            for element in self._rollups.aggregate(pipeline)}
+            
+    def write_price_rollups(
+            self,
+            rollups: List[PriceRollup],
+            deleted_keys: Iterable[Tuple[str, str, datetime.datetime]] = (),
+            deleted_ids: Iterable[str] = (),
+            chunk_size: int = WRITE_CHUNK_SIZE) -> None:
+        """
+        Запись сводок цен с заменой сводок тех же корзин (upsert), удаление сводок по ключам
+        и всех сводок категорий deleted_ids - одной неупорядоченной записью
+        """
         
-        data = dict()
+        requests = [
+            pymongo.ReplaceOne(
+                {"id": rollup.id, "granularity": rollup.granularity, "bucket": rollup.bucket},
+                rollup._asdict(),
+                upsert=True)
+            for rollup in rollups]
+        requests.extend(
+            pymongo.DeleteOne({"id": id, "granularity": granularity, "bucket": bucket})
+            for id, granularity, bucket in deleted_keys)
+        deleted_ids = list(deleted_ids)
+        requests.extend(
+            pymongo.DeleteMany({"id": {"$in": deleted_ids[i:i + chunk_size]}})
+            for i in range(0, len(deleted_ids), chunk_size))
+            
+        for i in range(0, len(requests), chunk_size):
+            self._rollups.bulk_write(requests[i:i + chunk_size], ordered=False)
+            
+    def delete_price_rollups(
+            self,
+            ids: Set[str],
+            start: datetime.datetime = datetime.datetime.min,
+            end: datetime.datetime = datetime.datetime.max,
+            chunk_size: int = WRITE_CHUNK_SIZE) -> None:
+        """Удаление сводок цен категорий ids с началом корзины в [start, end)"""
+        
+        ids = list(ids)
+        for i in range(0, len(ids), chunk_size):
+            self._rollups.delete_many({"id": {"$in": ids[i:i + chunk_size]}, "bucket": {"$gte": start, "$lt": end}})
+            
+    def get_latest_updated_offers(self, start_date: datetime.datetime, end_date: datetime.datetime) -> Iterable[dict]:
+        """
+        Последние версии товаров, обновленных на интервале [start_date, end_date],
+        в порядке id. Элементы - словари полей ShopUnitStatisticUnit.
+        Выбор последней версии выполняется на стороне MongoDB,
+        возвращается курсор по результату (дата форматируется при чтении).
+        """
         
-        for updated_unit in updated_units:
-            if updated_unit.id not in data:
-                data[updated_unit.id] = updated_unit.__dict__
-            elif updated_unit.updateDate > data[updated_unit.id]["updateDate"]:
-                data[updated_unit.id] = updated_unit.__dict__
+        pipeline = [
+            {"$match": {"type": "OFFER", "updateDate": {"$gte": start_date, "$lte": end_date}}},
+            {"$sort": {"id": pymongo.ASCENDING, "updateDate": pymongo.DESCENDING, "_id": pymongo.DESCENDING}},
+            {"$group": {
+                "_id": "$id",
+                "name": {"$first": "$name"},
+                "parentId": {"$first": "$parentId"},
+                "type": {"$first": "$type"},
+                "price": {"$first": "$price"},
+                "updateDate": {"$first": "$updateDate"}}},
+            {"$sort": {"_id": pymongo.ASCENDING}},
+            {"$project": {
+                "_id": 0,
+                "id": "$_id",
+                "name": 1,
+                "parentId": 1,
+                "type": 1,
+                "price": 1,
+                "updateDate": 1}}]
                 
-        items = []
-        
-        for unit in data.values():
-            iso_date = unit["updateDate"].isoformat() + ".000Z"
-            del unit["updateDate"]
-            items.append(ShopUnitStatisticUnit(
-                **unit, 
-                date=iso_date))
+        return (
+            {
+                "id": element["id"],
+                "name": element["name"],
+                "parentId": element.get("parentId"),
+                "type": element["type"],
+                "price": element.get("price"),
+                "date": format_sales_date(element["updateDate"])}
+            for element in self._history.aggregate(pipeline, allowDiskUse=True))
             
-                
-        shop_unit_statistic_response = ShopUnitStatisticResponse(items=items)
-        
-        return shop_unit_statistic_response
-        
 if __name__ == "__main__":
     a = DatabaseDriver()
     
@@ -440,6 +631,6 @@ if __name__ == "__main__":
         "3fa85f64-5717-4562-b3fc-2c963f66a002",
         "2022-05-28T10:00:00",
         "2022-05-28T14:00:00"))
-        
-    
-    
+
+
+
@@ -117,6 +117,23 @@ class ShopUnitImportRequest(BaseModel):
             raise ValueError("updateDate must be in ISO 8601 format")
         return date.replace('Z', '')
 
+class ShopUnitBatchRequest(BaseModel):
+    ids: List[str] = Field(
+        ...,
+        description="Идентификаторы запрашиваемых элементов",
+        min_items=1,
+        max_items=1000,
+    )
+    
+    @validator("ids", each_item=True)
+    def is_id_is_uuid(cls, id):
+        """Проверка, является ли id валидным uuid."""
+        try:
+            _ = UUID(id, version=4)
+        except ValueError:
+            raise ValueError(f"Offer {id} must be valid uuid value")
+        return id
+
 class ShopUnitStatisticUnit(BaseModel):
     id: str = Field(
         ...,
@@ -149,6 +166,24 @@ class ShopUnitStatisticResponse(BaseModel):
         description="История в произвольном порядке."
     )
 
+class ShopUnitStatisticBucket(ShopUnitStatisticUnit):
+    """Цены товара/категории за корзину времени (date - начало корзины)"""
+
+    minPrice: Optional[int] = Field(
+        None,
+        description="Наименьшая цена товаров, обновленных в корзине (для категории - товаров ее поддерева)",
+    )
+    maxPrice: Optional[int] = Field(
+        None,
+        description="Наибольшая цена товаров, обновленных в корзине (для категории - товаров ее поддерева)",
+    )
+
+class ShopUnitStatisticBucketResponse(BaseModel):
+    items: List[ShopUnitStatisticBucket] = Field(
+        ...,
+        description="Корзины в порядке времени."
+    )
+
 class Error(BaseModel):
     code: int = Field(
         ...,
@@ -0,0 +1,77 @@
+import pymongo
+
+from typing import List, NamedTuple, Tuple
+
+
+class IndexSpec(NamedTuple):
+    """Описание индекса коллекции"""
+    
+    name: str
+    keys: List[Tuple[str, int]]
+    unique: bool = False
+    
+    def to_index_model(self) -> pymongo.IndexModel:
+        """Преобразование в IndexModel для create_indexes"""
+        return pymongo.IndexModel(self.keys, name=self.name, unique=self.unique)
+
+
+# Индексы коллекции с историей записей товаров/категорий
+HISTORY_INDEXES = [
+    # Новейшая запись элемента, записи элемента на момент даты
+    IndexSpec(
+        name="id_updateDate",
+        keys=[("id", pymongo.ASCENDING), ("updateDate", pymongo.DESCENDING)]),
+    # Дочерние элементы категории (в том числе на момент даты)
+    IndexSpec(
+        name="parentId_updateDate",
+        keys=[("parentId", pymongo.ASCENDING), ("updateDate", pymongo.ASCENDING)]),
+    # Обновленные товары на интервале (/sales)
+    IndexSpec(
+        name="type_updateDate",
+        keys=[("type", pymongo.ASCENDING), ("updateDate", pymongo.ASCENDING)]),
+]
+
+# Индексы коллекции актуальных записей товаров/категорий
+CURRENT_INDEXES = [
+    IndexSpec(
+        name="id",
+        keys=[("id", pymongo.ASCENDING)],
+        unique=True),
+    # Дочерние элементы категории в порядке добавления (постраничный /nodes)
+    IndexSpec(
+        name="parentId",
+        keys=[("parentId", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)]),
+    # Поддерево элемента в порядке добавления
+    IndexSpec(
+        name="ancestors",
+        keys=[("ancestors", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)]),
+    # Элементы, когда-либо бывшие в поддереве категории (/statistic)
+    IndexSpec(
+        name="allAncestors",
+        keys=[("allAncestors", pymongo.ASCENDING)]),
+]
+
+# Индексы коллекции агрегатов цен категорий
+AGGREGATES_INDEXES = [
+    IndexSpec(
+        name="id",
+        keys=[("id", pymongo.ASCENDING)],
+        unique=True),
+]
+
+# Индексы коллекции сводок цен категорий по корзинам времени
+ROLLUPS_INDEXES = [
+    # Сводки категории по корзинам одной длительности в порядке времени
+    IndexSpec(
+        name="id_granularity_bucket",
+        keys=[("id", pymongo.ASCENDING), ("granularity", pymongo.ASCENDING), ("bucket", pymongo.ASCENDING)],
+        unique=True),
+]
+
+
+def ensure_indexes(collection: pymongo.collection.Collection, indexes: List[IndexSpec]) -> List[str]:
+    """
+    Создание индексов коллекции.
+    Повторный вызов с теми же описаниями ничего не меняет.
+    """
+    return collection.create_indexes([index.to_index_model() for index in indexes])
@@ -0,0 +1,170 @@
+import datetime
+import tempfile
+import threading
+import uuid
+
+from collections import OrderedDict
+from typing import AsyncIterable, BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from .async_database import AsyncDatabaseDriver
+from .parsers import parse_import_batch
+from .storage import ShopUnitDatabase, WRITE_CHUNK_SIZE
+
+# Сколько последних заданий хранится для запросов статуса
+MAX_JOBS = 1000
+
+# Размер тела задания (байт), до которого оно хранится в памяти, а не во временном файле
+SPOOL_MAX_SIZE = 1024 * 1024
+
+
+class ImportJob:
+    """
+    Задание фонового импорта: последовательность запросов ShopUnitImportRequest
+    (по строке NDJSON на запрос), прогресс и ошибки по строкам.
+    """
+    
+    def __init__(self) -> None:
+        self.id = str(uuid.uuid4())
+        # queued -> running -> completed / failed (ошибка хранилища, остальные строки не записаны)
+        self.status = "queued"
+        self.batches = 0
+        self.processed = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.errors: List[Dict[str, object]] = []
+        self.created = datetime.datetime.utcnow()
+        self.finished: Optional[datetime.datetime] = None
+        
+    def add_error(self, line: int, message: str) -> None:
+        """Ошибка запроса из строки line (строка не записывается)"""
+        
+        self.processed += 1
+        self.failed += 1
+        self.errors.append({"line": line, "message": message})
+        
+    def to_dict(self) -> dict:
+        """Статус задания для ответа API"""
+        
+        return {
+            "id": self.id,
+            "status": self.status,
+            "batches": self.batches,
+            "processed": self.processed,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "errors": list(self.errors),
+            "created": self.created.isoformat(timespec="milliseconds") + "Z",
+            "finished": None if self.finished is None
+                else self.finished.isoformat(timespec="milliseconds") + "Z"}
+
+
+class ImportJobs:
+    """Задания импорта в памяти процесса (хранятся последние MAX_JOBS)"""
+    
+    def __init__(self, max_jobs: int = MAX_JOBS) -> None:
+        self.max_jobs = max_jobs
+        self._lock = threading.Lock()
+        self._jobs: "OrderedDict[str, ImportJob]" = OrderedDict()
+        
+    def create(self) -> ImportJob:
+        """Новое задание в очереди"""
+        
+        job = ImportJob()
+        with self._lock:
+            self._jobs[job.id] = job
+            while len(self._jobs) > self.max_jobs:
+                self._jobs.popitem(last=False)
+                
+        return job
+        
+    def get(self, id: str) -> Optional[ImportJob]:
+        with self._lock:
+            return self._jobs.get(id)
+
+
+async def spool_body(chunks: AsyncIterable[bytes], max_size: int = SPOOL_MAX_SIZE) -> BinaryIO:
+    """
+    Сохранение тела запроса без разбора: до max_size байт - в памяти,
+    больше - во временном файле (запись выполняется в пуле потоков).
+    Возвращает файл, открытый на чтение с начала.
+    """
+    
+    file = tempfile.SpooledTemporaryFile(max_size=max_size)
+    async for chunk in chunks:
+        await run_in_threadpool(file.write, chunk)
+    file.seek(0)
+    
+    return file
+    
+def read_batches(
+        job: ImportJob,
+        file: BinaryIO,
+        chunk_size: int = WRITE_CHUNK_SIZE) -> Iterator[List[Tuple[int, List[ShopUnitDatabase]]]]:
+    """
+    Разбор NDJSON по строкам: каждая непустая строка - ShopUnitImportRequest.
+    Строки с ошибкой разбора сразу записываются в ошибки задания.
+    Возвращает группы (номер строки, элементы) подряд идущих запросов
+    общим размером до chunk_size элементов (не менее одного запроса в группе),
+    в памяти находится только текущая группа.
+    """
+    
+    group = []
+    size = 0
+    for line_number, line in enumerate(file, start=1):
+        if len(line.strip()) == 0:
+            continue
+        job.batches += 1
+        try:
+            shop_units = parse_import_batch(line.decode("utf-8"))
+        except (ValueError, TypeError) as e:
+            job.add_error(line_number, str(e))
+            continue
+            
+        if len(group) > 0 and size + len(shop_units) > chunk_size:
+            yield group
+            group = []
+            size = 0
+        group.append((line_number, shop_units))
+        size += len(shop_units)
+        
+    if len(group) > 0:
+        yield group
+        
+async def run_import_job(
+        job: ImportJob,
+        file: BinaryIO,
+        database: AsyncDatabaseDriver,
+        chunk_size: int = WRITE_CHUNK_SIZE) -> None:
+    """
+    Разбор и запись запросов задания из тела file по порядку (файл закрывается по завершении).
+    Строки разбираются в пуле потоков группами до chunk_size элементов:
+    группа проверяется и записывается окнами под блокировкой записи,
+    между группами выполняются другие импорты и удаления.
+    """
+    
+    job.status = "running"
+    groups = read_batches(job, file, chunk_size)
+    try:
+        while True:
+            group = await run_in_threadpool(next, groups, None)
+            if group is None:
+                break
+                
+            errors = await database.import_batches([shop_units for _, shop_units in group])
+            for (line_number, _), error in zip(group, errors):
+                if error is None:
+                    job.processed += 1
+                    job.succeeded += 1
+                else:
+                    job.add_error(line_number, error)
+                    
+        job.status = "completed"
+    except Exception as e:
+        print(e)
+        job.status = "failed"
+        job.errors.append({"line": None, "message": str(e)})
+    finally:
+        file.close()
+        job.finished = datetime.datetime.utcnow()
@@ -1,22 +1,84 @@
+from typing import List, Optional
+
 from fastapi import FastAPI
-from fastapi import Request, Response, status
-from fastapi.responses import JSONResponse
+from fastapi import BackgroundTasks, Header, Query, Request, Response, status
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.exceptions import RequestValidationError
 
-from .database import DatabaseDriver
-from .datatypes import ShopUnitImportRequest
+from .storage import STATISTIC_GRANULARITIES, create_driver
+from .async_database import AsyncDatabaseDriver
+from .cache import create_nodes_cache
+from .jobs import ImportJobs, run_import_job, spool_body
+from .write_queue import create_import_queue
+from .metrics import Metrics, MetricsMiddleware, format_metric, register_mongo_listener
+from .datatypes import ShopUnitBatchRequest, ShopUnitImportRequest
+from .streaming import items_response, iterate_json_nodes, iterate_json_tree
 
 from .parsers import parse_shop_unit_import_request, get_ids_types_from_shop_units
-from .parsers import get_parent_ids_from_shop_units, validate_id, validate_date
+from .parsers import validate_id, validate_date
+from .parsers import make_etag, is_etag_matched
 
 app = FastAPI(title="Didenok API")
 
-database = DatabaseDriver()
+# Метрики запросов и команд MongoDB (слушатель регистрируется до создания клиента)
+metrics = Metrics()
+register_mongo_listener(metrics)
+app.add_middleware(MetricsMiddleware, metrics=metrics)
+
+database = create_driver()
+async_database = AsyncDatabaseDriver(database)
+
+# Задания фонового импорта NDJSON
+import_jobs = ImportJobs()
+
+# Очередь записи POST /imports: одновременные импорты записываются группой
+import_queue = create_import_queue(async_database)
+
+# Кэш ответов /nodes/{id}, сбрасывается по изменившимся элементам и их предкам
+nodes_cache = create_nodes_cache()
+database.add_change_listener(nodes_cache.invalidate)
+
+def collect_nodes_cache_metrics() -> List[str]:
+    """Счетчики кэша ответов /nodes/{id} для /metrics"""
+    stats = nodes_cache.stats()
+    
+    lines = []
+    for name in ["entries", "bytes"]:
+        lines.extend(format_metric(f"nodes_cache_{name}", f"Кэш /nodes/{{id}}: {name}", "gauge", stats[name]))
+    for name in ["hits", "misses", "evictions", "invalidations"]:
+        lines.extend(format_metric(f"nodes_cache_{name}_total", f"Кэш /nodes/{{id}}: {name}", "counter", stats[name]))
+        
+    return lines
+    
+metrics.add_collector(collect_nodes_cache_metrics)
+
+def collect_import_queue_metrics() -> List[str]:
+    """Счетчики очереди записи импортов для /metrics"""
+    
+    return (
+        format_metric("import_queue_groups_total", "Записанные группы импортов", "counter", import_queue.groups)
+        + format_metric("import_queue_imports_total", "Импорты, записанные в группах", "counter", import_queue.imports))
+        
+metrics.add_collector(collect_import_queue_metrics)
+
+def collect_delete_metrics() -> List[str]:
+    """Счетчики удалений DELETE /delete/{id} для /metrics"""
+    
+    return (
+        format_metric("storage_deletes_total", "Удаления элементов", "counter", database.deletes)
+        + format_metric(
+            "storage_deleted_units_total", "Элементы, удаленные вместе с поддеревьями", "counter",
+            database.deleted_units)
+        + format_metric(
+            "storage_delete_seconds_total", "Суммарная длительность удалений в хранилище", "counter",
+            database.delete_seconds))
+            
+metrics.add_collector(collect_delete_metrics)
 
 class CustomException(Exception):
     def __init__(self, name: str) -> None:
         self.name = name
-
+        
 @app.exception_handler(CustomException)
 async def custom_exception_handler(request: Request, exception: CustomException) -> JSONResponse:
     return JSONResponse (
@@ -26,7 +88,7 @@ async def custom_exception_handler(request: Request, exception: CustomException)
             "message": "Validation Failed",
             }
         )
-    
+        
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request, exc):
     print(exc)
@@ -37,7 +99,7 @@ async def validation_exception_handler(request, exc):
             "message": "Validation Failed",
             }
         )
-
+        
 @app.post(
     "/imports",
     description="Импортирует новые товары и/или категории.",
@@ -47,19 +109,57 @@ async def imports(input: ShopUnitImportRequest) -> None:
     try:
         # Преобразуем в List[ShopUnitDatabase]
         parsed_input = parse_shop_unit_import_request(input)
-        # Считываем id и type новых ShopUnits
-        new_ids_types = get_ids_types_from_shop_units(parsed_input)
-        # Считываем parentId новых ShopUnits
-        new_parent_ids = get_parent_ids_from_shop_units(parsed_input)
-        # Проверяем ids (см. описание функции)
-        database.check_ids_new_shop_units(new_ids_types, new_parent_ids)
-        # Записываем в бд новые ShopUnits
-        database.write_list_shop_unit_database_to_collection(parsed_input)
-    
+        # Проверяем уникальность id в запросе
+        get_ids_types_from_shop_units(parsed_input)
+        # Проверяем ids (см. StorageDriver.import_batches) и записываем в бд
+        # вместе с импортами, пришедшими одновременно
+        await import_queue.submit(parsed_input)
+        
         return Response(status_code=status.HTTP_200_OK)
     except Exception as e:
         print(e)
         raise CustomException(name = "Validation Failed")
+        
+@app.post(
+    "/imports/jobs",
+    description="Создает задание фонового импорта. Тело - NDJSON: " \
+        "каждая строка - запрос ShopUnitImportRequest. Тело сохраняется без разбора, запросы " \
+        "разбираются, проверяются и записываются по порядку после ответа, запрос с ошибкой пропускается. " \
+        "Возвращает id задания, статус - GET /imports/jobs/{id}.",
+    status_code=status.HTTP_202_ACCEPTED
+)
+async def create_import_job(request: Request, background_tasks: BackgroundTasks) -> JSONResponse:
+    
+    # Тело сохраняется без разбора, строки разбираются и записываются в фоновой задаче
+    job = import_jobs.create()
+    file = await spool_body(request.stream())
+    background_tasks.add_task(run_import_job, job, file, async_database)
+    
+    return JSONResponse(
+        status_code=status.HTTP_202_ACCEPTED,
+        content=job.to_dict(),
+        headers={"Location": f"/imports/jobs/{job.id}"},
+        background=background_tasks)
+        
+@app.get(
+    "/imports/jobs/{id}",
+    description="Статус задания импорта: число обработанных, записанных " \
+        "и пропущенных запросов и ошибки по номерам строк NDJSON."
+)
+async def get_import_job(id: str) -> JSONResponse:
+    
+    try:
+        validate_id(id)
+    except Exception as e:
+        print(e)
+        raise CustomException(name = "Validation Failed")
+    job = import_jobs.get(id)
+    if job is None:
+        return JSONResponse(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content={"code": 404, "message": "Item not found"})
+            
+    return JSONResponse(content=job.to_dict())
     
 @app.delete(
     "/delete/{id}",
@@ -69,24 +169,89 @@ async def delete_shop_unit(id: str) -> None:
     
     try:
         validate_id(id)
-        database.delete_by_id(id)
+        await async_database.delete_by_id(id)
         return Response(status_code=status.HTTP_200_OK)
     except Exception as e:
         print(e)
         raise CustomException(name = "Validation Failed")
-    
+        
 @app.get(
     '/nodes/{id}',
-    description="Получить информацию об элементе по идентификатору."
+    description="Получить информацию об элементе по идентификатору. " \
+        "Необязательные depth и children_limit ограничивают глубину дерева " \
+        "и число дочерних элементов каждой категории: категории получают поле childrenCount, " \
+        "у нераскрытых категорий children равно null. " \
+        "Следующая страница дочерних элементов - с cursor из заголовка X-Next-Cursor. " \
+        "Необязательный at (ISO 8601) - дерево по истории на этот момент включительно " \
+        "(без depth, children_limit и cursor, удаленные элементы в дерево не входят)."
 )
-async def get_info(id: str) -> None:
+async def get_info(
+        id: str, 
+        depth: Optional[int] = Query(None, ge=0), 
+        children_limit: Optional[int] = Query(None, ge=1), 
+        cursor: Optional[str] = None, 
+        at: Optional[str] = None, 
+        if_none_match: Optional[str] = Header(None)) -> None:
     try:
         validate_id(id)
-        return database.get_info(id)
+        if cursor is not None:
+            validate_id(cursor)
+        # Дерево на момент at собирается по истории, без кэша и ETag
+        if at is not None:
+            if depth is not None or children_limit is not None or cursor is not None:
+                raise ValueError("at can't be combined with depth, children_limit or cursor")
+            root, childrens, prices = await async_database.load_info_at(id, validate_date(at))
+            return StreamingResponse(
+                iterate_json_tree(root, childrens, prices),
+                media_type="application/json")
+                
+        # Версия считывается до ответа: ответ не старше своего ETag
+        version = await async_database.get_version(id)
+        etag = make_etag(version)
+        if is_etag_matched(if_none_match, etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+            
+        # Частичное дерево: не глубже depth, не более children_limit дочерних элементов
+        if depth is not None or children_limit is not None or cursor is not None:
+            root, childrens, prices, counts, next_cursor = await async_database.load_info_page(
+                id, depth, children_limit, cursor)
+            headers = {"ETag": etag}
+            if next_cursor is not None:
+                headers["X-Next-Cursor"] = next_cursor
+            return StreamingResponse(
+                iterate_json_tree(root, childrens, prices, counts),
+                media_type="application/json",
+                headers=headers)
+                
+        body = nodes_cache.get(id, version)
+        if body is not None:
+            return Response(body, media_type="application/json", headers={"ETag": etag})
+        root, childrens, prices = await async_database.load_info(id)
     except Exception as e:
         print(e)
         raise CustomException(name = "Validation Failed")
-    
+    return StreamingResponse(
+        nodes_cache.iterate_and_put(id, version, iterate_json_tree(root, childrens, prices)),
+        media_type="application/json",
+        headers={"ETag": etag})
+        
+@app.post(
+    '/nodes/batch',
+    description="Получить информацию о нескольких элементах (до 1000 ids) одним запросом. " \
+        "Ответ - items в порядке ids: {id, node} с деревом как в /nodes/{id} " \
+        "или {id, error} для отсутствующего элемента. " \
+        "Пересекающиеся поддеревья загружаются один раз."
+)
+async def get_infos(input: ShopUnitBatchRequest) -> StreamingResponse:
+    try:
+        roots, childrens, prices = await async_database.load_infos(input.ids)
+    except Exception as e:
+        print(e)
+        raise CustomException(name = "Validation Failed")
+    return StreamingResponse(
+        iterate_json_nodes(input.ids, roots, childrens, prices),
+        media_type="application/json")
+        
 @app.get(
     '/sales',
     description="Получение списка **товаров**, цена которых была обновлена " \
@@ -96,26 +261,50 @@ async def get_info(id: str) -> None:
 async def get_sales(date: str) -> None:
     try:
         date = validate_date(date)
-        return database.get_sales(date)
+        items = await async_database.get_sales(date)
     except Exception as e:
         print(e)
         raise CustomException(name = "Validation Failed")
-
+    return items_response(items)
+    
 @app.get(
     '/node/{id}/statistic',
     description="Получение статистики (истории обновлений) по " \
         "товару/категории за заданный полуинтервал [from, to). " \
-        "Статистика по удаленным элементам недоступна."
+        "Статистика по удаленным элементам недоступна. " \
+        "С granularity (hour или day) - по точке на корзину времени, пересекающую интервал: " \
+        "цена на конец корзины, minPrice и maxPrice среди обновлений в ней, date - начало корзины."
 ) 
-async def get_statistic(id: str, start_date: str, end_date: str) -> None:
+async def get_statistic(
+        id: str, 
+        start_date: str, 
+        end_date: str, 
+        response: Response, 
+        granularity: Optional[str] = None, 
+        if_none_match: Optional[str] = Header(None)) -> None:
     try:
         validate_id(id)
         start_date = validate_date(start_date)
         end_date = validate_date(end_date)
-        return database.get_statistic(id, start_date, end_date)
+        if granularity is not None and granularity not in STATISTIC_GRANULARITIES:
+            raise ValueError(f"Unknown granularity {granularity}")
+        etag = make_etag(await async_database.get_version(id))
+        if is_etag_matched(if_none_match, etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+        response.headers["ETag"] = etag
+        if granularity is not None:
+            return await async_database.get_statistic_buckets(id, start_date, end_date, granularity)
+        return await async_database.get_statistic(id, start_date, end_date)
     except Exception as e:
         print(e)
         raise CustomException(name = "Validation Failed")
-    
-
-        
\ No newline at end of file
+        
+@app.get(
+    '/metrics',
+    description="Метрики приложения в текстовом формате Prometheus: " \
+        "длительность запросов по маршруту и статусу, число и длительность команд MongoDB " \
+        "(всего и на запрос), счетчики кэша ответов /nodes/{id}.",
+    include_in_schema=False
+)
+async def get_metrics() -> Response:
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,416 @@
+import bisect
+import datetime
+import threading
+
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from .storage import PriceRollup, ShopUnitDatabase, StorageDriver, WRITE_CHUNK_SIZE, format_sales_date
+
+
+class MemoryDriver(StorageDriver):
+    """
+    Хранилище в памяти процесса.
+    История индексируется по id и по updateDate,
+    актуальные записи - по id, по parentId и по путям предков.
+    """
+    
+    def __init__(self) -> None:
+        """Инициализация пустого хранилища"""
+        
+        super().__init__()
+        self._lock = threading.RLock()
+        # Счетчик записей не сбрасывается при очистке, чтобы версии не повторялись
+        self._version = 0
+        self.clear_collection()
+        
+    def clear_collection(self) -> None:
+        """Очистка хранилища"""
+        
+        with self._lock:
+            # История: id -> (номер, запись), отсортированные (updateDate, номер, запись)
+            self._history_by_id: Dict[str, List[Tuple[int, ShopUnitDatabase]]] = dict()
+            self._history_by_date: List[Tuple[datetime.datetime, int, ShopUnitDatabase]] = []
+            self._history_count = 0
+            # Актуальные записи: id -> запись, parentId -> ids в порядке добавления
+            self._current: Dict[str, ShopUnitDatabase] = dict()
+            self._childrens: Dict[str, Dict[str, None]] = dict()
+            # Пути предков: id -> путь, категория -> ids когда-либо бывших в ее поддереве
+            # и обратный индекс: id -> категории, в поддеревьях которых он когда-либо был
+            self._ancestors: Dict[str, List[str]] = dict()
+            self._former_descendants: Dict[str, Set[str]] = dict()
+            self._former_ancestors: Dict[str, Set[str]] = dict()
+            # Агрегаты категорий: id -> [сумма, количество]
+            self._aggregates: Dict[str, List[int]] = dict()
+            # Сводки цен категорий: (id, granularity, начало корзины) -> сводка
+            self._rollups: Dict[tuple, PriceRollup] = dict()
+            # Версии элементов: id -> значение счетчика записей
+            self._versions: Dict[str, int] = dict()
+            
+        self.notify_changed(None)
+        
+    def insert_history_records(
+            self,
+            shop_units: List[ShopUnitDatabase],
+            chunk_size: int = WRITE_CHUNK_SIZE,
+            ordered: bool = True) -> int:
+        """Запись объектов в историю"""
+        
+        with self._lock:
+            for shop_unit in shop_units:
+                self._add_history_record(shop_unit.copy())
+                
+        return len(shop_units)
+        
+    def write_current_records(
+            self,
+            shop_units: List[ShopUnitDatabase],
+            records: Dict[str, ShopUnitDatabase],
+            ancestors: Dict[str, List[str]],
+            former_ancestors: Dict[str, Set[str]],
+            chunk_size: int = WRITE_CHUNK_SIZE) -> None:
+        """Обновление актуальных записей элементов, путей их предков и бывших предков"""
+        
+        with self._lock:
+            for shop_unit in shop_units:
+                old = self._current.get(shop_unit.id)
+                if old is not None and old.parentId != shop_unit.parentId:
+                    del self._childrens[old.parentId][shop_unit.id]
+                self._current[shop_unit.id] = shop_unit.copy()
+                if old is None or old.parentId != shop_unit.parentId:
+                    self._childrens.setdefault(shop_unit.parentId, dict())[shop_unit.id] = None
+                    
+            self.update_ancestors(ancestors)
+            for shop_unit in shop_units:
+                self._add_former_ancestors([shop_unit.id], former_ancestors[shop_unit.id])
+                
+    def update_ancestors(self, ancestors: Dict[str, List[str]], chunk_size: int = WRITE_CHUNK_SIZE) -> None:
+        """Обновление путей предков элементов"""
+        
+        with self._lock:
+            for id, path in ancestors.items():
+                self._ancestors[id] = list(path)
+                self._add_former_ancestors([id], path)
+                
+    def add_former_ancestors(self, ancestors_ids: Dict[str, Set[str]], chunk_size: int = WRITE_CHUNK_SIZE) -> None:
+        """Добавление категорий ancestors_ids[id] к бывшим предкам элемента id и его бывших потомков"""
+        
+        with self._lock:
+            for id, added in ancestors_ids.items():
+                self._add_former_ancestors({id}.union(self._former_descendants.get(id, set())), added)
+                
+    def apply_aggregates_deltas(self, deltas: Dict[str, List[int]]) -> None:
+        """Запись изменений агрегатов категорий"""
+        
+        with self._lock:
+            for id, delta in deltas.items():
+                aggregate = self._aggregates.setdefault(id, [0, 0])
+                aggregate[0] += delta[0]
+                aggregate[1] += delta[1]
+                
+    def delete_records(self, ids: Set[str], categories_ids: Set[str], chunk_size: int = WRITE_CHUNK_SIZE) -> None:
+        """
+        Удаление элементов ids (актуальные записи и история),
+        записей истории с parentId из categories_ids и агрегатов categories_ids.
+        """
+        
+        with self._lock:
+            # Записи с parentId из categories_ids есть только у бывших потомков этих категорий
+            deleted = []
+            for id in set(ids).union(*[self._former_descendants.get(id, set()) for id in categories_ids]):
+                history = self._history_by_id.pop(id, [])
+                if id not in ids:
+                    kept = [(seq, record) for seq, record in history if record.parentId not in categories_ids]
+                    if len(kept) > 0:
+                        self._history_by_id[id] = kept
+                    history = [(seq, record) for seq, record in history if record.parentId in categories_ids]
+                deleted.extend((record.updateDate, seq) for seq, record in history)
+                
+            for item in deleted:
+                del self._history_by_date[bisect.bisect_left(self._history_by_date, item)]
+                
+            for id in ids:
+                record = self._current.pop(id, None)
+                if record is not None and record.parentId in self._childrens:
+                    self._childrens[record.parentId].pop(id, None)
+                self._childrens.pop(id, None)
+                self._ancestors.pop(id, None)
+                for ancestor_id in self._former_ancestors.pop(id, set()):
+                    self._former_descendants[ancestor_id].discard(id)
+                for descendant_id in self._former_descendants.pop(id, set()):
+                    self._former_ancestors[descendant_id].discard(id)
+                self._versions.pop(id, None)
+                
+            for id in categories_ids:
+                self._aggregates.pop(id, None)
+                
+    def get_subtree_types(self, id: str) -> Dict[str, str]:
+        """Типы элементов поддерева id (включая сам элемент)"""
+        
+        with self._lock:
+            if id not in self._current:
+                return dict()
+            return {
+                unit_id: self._current[unit_id].type
+                for unit_id in [id] + self._get_descendants_ids([id])}
+                
+    def get_ancestors(self, ids: List[str]) -> Dict[str, List[str]]:
+        """Пути предков (от корня к родителю) существующих элементов из ids"""
+        
+        with self._lock:
+            return {id: list(self._ancestors[id]) for id in ids if id in self._ancestors}
+            
+    def get_all_ancestors(self, ids: List[str]) -> Dict[str, Tuple[List[str], Set[str]]]:
+        """Пути предков (от корня к родителю) и бывшие предки существующих элементов из ids"""
+        
+        with self._lock:
+            return {
+                id: (list(self._ancestors[id]), set(self._former_ancestors.get(id, set())))
+                for id in ids if id in self._ancestors}
+
+
+    def get_subtree_records(self, ids: List[str]) -> List[ShopUnitDatabase]:
+        """Актуальные записи потомков элементов ids (дочерние элементы - в порядке добавления)"""
+        
+        with self._lock:
+            return [self._current[unit_id].copy() for unit_id in self._get_descendants_ids(ids)]
+            
+    def get_childrens(
+            self,
+            parent_ids: List[str],
+            limit: Optional[int] = None,
+            after_id: Optional[str] = None) -> Dict[str, List[ShopUnitDatabase]]:
+        """
+        Актуальные записи дочерних элементов категорий в порядке добавления:
+        не более limit на категорию и, если задан after_id, - после дочернего элемента after_id.
+        """
+        
+        with self._lock:
+            pages = dict()
+            for parent_id in parent_ids:
+                ids = list(self._childrens.get(parent_id, dict()))
+                if after_id is not None:
+                    if after_id not in ids:
+                        raise ValueError(f"Unit with id {after_id} is not a child of {parent_id}")
+                    ids = ids[ids.index(after_id) + 1:]
+                if limit is not None:
+                    ids = ids[:limit]
+                pages[parent_id] = [self._current[id].copy() for id in ids]
+                
+            return pages
+            
+    def count_childrens(self, parent_ids: List[str]) -> Dict[str, int]:
+        """Количество дочерних элементов категорий"""
+        
+        with self._lock:
+            return {parent_id: len(self._childrens.get(parent_id, dict())) for parent_id in parent_ids}
+            
+    def get_subtree_parents(self, ids: List[str]) -> Dict[str, Optional[str]]:
+        """parentId всех потомков элементов ids"""
+        
+        with self._lock:
+            return {
+                unit_id: self._current[unit_id].parentId
+                for unit_id in self._get_descendants_ids(ids)}
+                
+    def get_former_descendants_ids(self, ids: List[str]) -> Set[str]:
+        """Ids элементов, когда-либо находившихся в поддеревьях ids"""
+        
+        with self._lock:
+            return set().union(*[self._former_descendants.get(id, set()) for id in ids])
+            
+    def get_former_ancestors_ids(self, ids: List[str]) -> Set[str]:
+        """Ids категорий, в поддеревьях которых когда-либо находились элементы ids"""
+        
+        with self._lock:
+            return set().union(*[self._former_ancestors.get(id, set()) for id in ids])
+            
+    def next_version(self) -> int:
+        """Следующее значение сквозного счетчика записей"""
+        
+        with self._lock:
+            self._version += 1
+            return self._version
+            
+    def set_versions(self, ids: Set[str], version: int) -> None:
+        """Запись версии существующим элементам ids"""
+        
+        with self._lock:
+            for id in ids:
+                if id in self._current:
+                    self._versions[id] = version
+                    
+    def get_versions(self, ids: List[str]) -> Dict[str, int]:
+        """Версии существующих элементов из ids"""
+        
+        with self._lock:
+            return {id: self._versions.get(id, 0) for id in ids if id in self._current}
+            
+    def get_latest_records_shop_units(self, ids: List[str]) -> Dict[str, ShopUnitDatabase]:
+        """Получение новейших записей о товарах/категориях"""
+        
+        with self._lock:
+            return {id: self._current[id].copy() for id in ids if id in self._current}
+            
+    def get_types_by_ids(self, ids: List[str]) -> Dict[str, str]:
+        """Возвращает type существующих элементов из ids"""
+        
+        with self._lock:
+            return {id: self._current[id].type for id in ids if id in self._current}
+            
+    def get_category_aggregates(self, ids: List[str]) -> Dict[str, Tuple[int, int]]:
+        """Возвращает (суммарная стоимость, количество товаров) категорий из ids"""
+        
+        with self._lock:
+            return {id: tuple(self._aggregates[id]) for id in ids if id in self._aggregates}
+            
+    def get_history_records(self, ids: List[str], end_date: datetime.datetime) -> List[ShopUnitDatabase]:
+        """Записи истории элементов ids до end_date (не включительно) в порядке updateDate"""
+        
+        with self._lock:
+            records = [
+                (record.updateDate, seq, record)
+                for id in set(ids)
+                for seq, record in self._history_by_id.get(id, [])
+                if record.updateDate < end_date]
+            records.sort(key=lambda item: item[:2])
+            return [record.copy() for _, _, record in records]
+            
+    def get_former_descendants_history(self, ids: List[str], end_date: datetime.datetime) -> List[ShopUnitDatabase]:
+        """Записи истории элементов ids и их бывших потомков до end_date (не включительно) в порядке updateDate"""
+        
+        with self._lock:
+            return self.get_history_records(list(set(ids).union(self.get_former_descendants_ids(ids))), end_date)
+            
+    def get_updated_records(self, start_date: datetime.datetime, end_date: datetime.datetime) -> List[ShopUnitDatabase]:
+        """Записи истории всех элементов с updateDate в [start_date, end_date) в порядке updateDate"""
+        
+        with self._lock:
+            start = bisect.bisect_left(self._history_by_date, (start_date, -1))
+            end = bisect.bisect_left(self._history_by_date, (end_date, -1))
+            return [record.copy() for _, _, record in self._history_by_date[start:end]]
+            
+    def get_records_at(self, ids: List[str], end_date: datetime.datetime) -> List[ShopUnitDatabase]:
+        """
+        Состояние элементов ids до end_date (не включительно) - последние записи истории
+        по updateDate, в порядке появления элементов в истории.
+        """
+        
+        with self._lock:
+            records = []
+            for id in set(ids):
+                history = [(record.updateDate, seq, record) for seq, record in self._history_by_id.get(id, [])]
+                history = [item for item in history if item[0] < end_date]
+                if len(history) > 0:
+                    records.append((min(item[1] for item in history), max(history, key=lambda item: item[:2])[2]))
+            records.sort(key=lambda item: item[0])
+            return [record.copy() for _, record in records]
+            
+    def get_price_rollups(
+            self,
+            ids: List[str],
+            start: datetime.datetime,
+            end: datetime.datetime,
+            granularity: Optional[str] = None) -> List[PriceRollup]:
+        """Сводки цен категорий ids с началом корзины в [start, end)"""
+        
+        ids = set(ids)
+        with self._lock:
+            return sorted(
+                rollup for rollup in self._rollups.values()
+                if rollup.id in ids and start <= rollup.bucket < end
+                and (granularity is None or rollup.granularity == granularity))
+                
+    def get_latest_price_rollups(self, ids: List[str], end: datetime.datetime) -> Dict[str, PriceRollup]:
+        """Последние часовые сводки цен категорий ids с началом корзины до end"""
+        
+        ids = set(ids)
+        latest = dict()
+        with self._lock:
+            for rollup in self._rollups.values():
+                if rollup.id in ids and rollup.granularity == "hour" and rollup.bucket < end:
+                    if rollup.id not in latest or latest[rollup.id].bucket < rollup.bucket:
+                        latest[rollup.id] = rollup
+                        
+        return latest
+        
+    def write_price_rollups(
+            self,
+            rollups: List[PriceRollup],
+            deleted_keys: Iterable[Tuple[str, str, datetime.datetime]] = (),
+            deleted_ids: Iterable[str] = (),
+            chunk_size: int = WRITE_CHUNK_SIZE) -> None:
+        """
+        Запись сводок цен с заменой сводок тех же корзин, удаление сводок по ключам deleted_keys
+        и всех сводок категорий deleted_ids
+        """
+        
+        with self._lock:
+            for rollup in rollups:
+                self._rollups[rollup.key] = rollup
+            for key in deleted_keys:
+                self._rollups.pop(key, None)
+            if deleted_ids:
+                deleted_ids = set(deleted_ids)
+                for key in [key for key in self._rollups if key[0] in deleted_ids]:
+                    del self._rollups[key]
+                    
+    def delete_price_rollups(
+            self,
+            ids: Set[str],
+            start: datetime.datetime = datetime.datetime.min,
+            end: datetime.datetime = datetime.datetime.max,
+            chunk_size: int = WRITE_CHUNK_SIZE) -> None:
+        """Удаление сводок цен категорий ids с началом корзины в [start, end)"""
+        
+        with self._lock:
+            for key in [key for key in self._rollups if key[0] in ids and start <= key[2] < end]:
+                del self._rollups[key]
+                
+    def get_latest_updated_offers(self, start_date: datetime.datetime, end_date: datetime.datetime) -> Iterable[dict]:
+        """
+        Последние версии товаров, обновленных на интервале [start_date, end_date],
+        в порядке id. Элементы - словари полей ShopUnitStatisticUnit.
+        """
+        
+        with self._lock:
+            start = bisect.bisect_left(self._history_by_date, (start_date, -1))
+            end = bisect.bisect_right(self._history_by_date, (end_date, self._history_count))
+            # Записи идут по возрастанию updateDate - остается последняя
+            records = {
+                record.id: record for _, _, record in self._history_by_date[start:end]
+                if record.type == "OFFER"}
+                
+        return [
+            {
+                "id": record.id,
+                "name": record.name,
+                "parentId": record.parentId,
+                "type": record.type,
+                "price": record.price,
+                "date": format_sales_date(record.updateDate)}
+            for _, record in sorted(records.items())]
+            
+    def _get_descendants_ids(self, ids: List[str]) -> List[str]:
+        descendants = []
+        visited = set(ids)
+        level = list(ids)
+        while len(level) > 0:
+            level = [
+                child_id for parent_id in level
+                for child_id in self._childrens.get(parent_id, dict())
+                if child_id not in visited]
+            visited.update(level)
+            descendants.extend(level)
+            
+        return descendants
+        
+    def _add_former_ancestors(self, ids: Iterable[str], ancestors_ids: Iterable[str]) -> None:
+        for ancestor_id in ancestors_ids:
+            self._former_descendants.setdefault(ancestor_id, set()).update(ids)
+        for id in ids:
+            self._former_ancestors.setdefault(id, set()).update(ancestors_ids)
+            
+    def _add_history_record(self, record: ShopUnitDatabase) -> None:
+        self._history_by_id.setdefault(record.id, []).append((self._history_count, record))
+        bisect.insort(self._history_by_date, (record.updateDate, self._history_count, record))
+        self._history_count += 1
@@ -0,0 +1,271 @@
+import contextvars
+import threading
+import time
+
+from typing import Callable, Dict, Iterable, List, Tuple
+
+from pymongo import monitoring
+
+# Границы корзин гистограмм длительности (секунды) и числа команд MongoDB на запрос
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COMMANDS_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+
+# Метка маршрута для запросов, не попавших ни в один маршрут
+UNMATCHED_ROUTE = "<unmatched>"
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    labels = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if len(labels) > 0 else ""
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def format_metric(name: str, description: str, metric_type: str, value: float) -> List[str]:
+    """Строки метрики без меток в текстовом формате Prometheus"""
+    
+    return [f"# HELP {name} {description}", f"# TYPE {name} {metric_type}", f"{name} {format_value(value)}"]
+
+
+class Counter:
+    """Счетчик Prometheus с метками"""
+    
+    def __init__(self, name: str, description: str, label_names: Tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], float] = dict()
+        
+    def inc(self, labels: Tuple[str, ...] = (), value: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + value
+            
+    def get(self, labels: Tuple[str, ...] = ()) -> float:
+        with self._lock:
+            return self._values.get(labels, 0)
+            
+    def items(self) -> List[Tuple[Tuple[str, ...], float]]:
+        with self._lock:
+            return list(self._values.items())
+            
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{format_labels(self.label_names, labels)} {format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """Гистограмма Prometheus с метками (накопительные корзины, сумма и количество)"""
+    
+    def __init__(
+            self,
+            name: str,
+            description: str,
+            label_names: Tuple[str, ...] = (),
+            buckets: Iterable[float] = LATENCY_BUCKETS) -> None:
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # метки -> [количества по корзинам (не накопительные), сумма, количество]
+        self._values: Dict[Tuple[str, ...], list] = dict()
+        
+    def observe(self, value: float, labels: Tuple[str, ...] = ()) -> None:
+        with self._lock:
+            values = self._values.setdefault(labels, [[0] * len(self.buckets), 0, 0])
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    values[0][index] += 1
+                    break
+            values[1] += value
+            values[2] += 1
+            
+    def get_count(self, labels: Tuple[str, ...] = ()) -> int:
+        with self._lock:
+            return self._values.get(labels, [None, 0, 0])[2]
+            
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float("inf"),), counts + [count - sum(counts)]):
+                    cumulative += bucket_count
+                    le = 'le="' + format_value(bound) + '"'
+                    lines.append(
+                        f"{self.name}_bucket{format_labels(self.label_names, labels, le)} {cumulative}")
+                lines.append(f"{self.name}_sum{format_labels(self.label_names, labels)} {format_value(total)}")
+                lines.append(f"{self.name}_count{format_labels(self.label_names, labels)} {count}")
+        return lines
+
+
+class RequestStats:
+    """Команды MongoDB, выполненные при обработке одного запроса"""
+    
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.commands = 0
+        self.duration = 0.0
+        
+    def add(self, duration: float) -> None:
+        with self._lock:
+            self.commands += 1
+            self.duration += duration
+
+
+# Статистика текущего запроса. Контекст копируется в потоки run_in_threadpool,
+# поэтому команды драйвера из пула потоков учитываются в своем запросе
+current_request = contextvars.ContextVar("current_request", default=None)
+
+
+class Metrics:
+    """
+    Метрики приложения: длительность запросов по маршруту и статусу,
+    число и длительность команд MongoDB всего и на запрос, дополнительные
+    значения из collectors (вызываются при выводе /metrics).
+    """
+    
+    def __init__(self) -> None:
+        self.request_duration = Histogram(
+            "http_request_duration_seconds",
+            "Длительность обработки HTTP запроса (до отправки последней части ответа)",
+            ("method", "route", "status"))
+        self.mongo_commands = Counter(
+            "mongo_commands_total",
+            "Выполненные команды MongoDB",
+            ("command", "outcome"))
+        self.mongo_command_duration = Histogram(
+            "mongo_command_duration_seconds",
+            "Длительность команд MongoDB",
+            ("command",))
+        self.request_mongo_commands = Histogram(
+            "http_request_mongo_commands",
+            "Число команд MongoDB на HTTP запрос",
+            ("method", "route"),
+            COMMANDS_BUCKETS)
+        self.request_mongo_duration = Histogram(
+            "http_request_mongo_duration_seconds",
+            "Суммарная длительность команд MongoDB на HTTP запрос",
+            ("method", "route"))
+        self._collectors: List[Callable[[], Iterable[str]]] = []
+        
+    def add_collector(self, collector: Callable[[], Iterable[str]]) -> None:
+        """Добавление функции, возвращающей строки метрик в текстовом формате Prometheus"""
+        
+        self._collectors.append(collector)
+        
+    def observe_command(self, command: str, duration: float, succeeded: bool) -> None:
+        """Учет команды MongoDB (в том числе в статистике текущего запроса)"""
+        
+        self.mongo_commands.inc((command, "succeeded" if succeeded else "failed"))
+        self.mongo_command_duration.observe(duration, (command,))
+        stats = current_request.get()
+        if stats is not None:
+            stats.add(duration)
+            
+    def observe_request(self, method: str, route: str, status: int, duration: float, stats: RequestStats) -> None:
+        """Учет обработанного HTTP запроса"""
+        
+        self.request_duration.observe(duration, (method, route, str(status)))
+        self.request_mongo_commands.observe(stats.commands, (method, route))
+        self.request_mongo_duration.observe(stats.duration, (method, route))
+        
+    def render(self) -> str:
+        """Все метрики в текстовом формате Prometheus"""
+        
+        lines = []
+        for metric in [
+                self.request_duration,
+                self.request_mongo_commands,
+                self.request_mongo_duration,
+                self.mongo_commands,
+                self.mongo_command_duration]:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            lines.extend(collector())
+            
+        return "\n".join(lines) + "\n"
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Слушатель команд pymongo: передает длительность каждой команды в метрики"""
+    
+    def __init__(self, metrics: Metrics) -> None:
+        self._metrics = metrics
+        
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        pass
+        
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        self._metrics.observe_command(event.command_name, event.duration_micros / 1e6, True)
+        
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        self._metrics.observe_command(event.command_name, event.duration_micros / 1e6, False)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware: длительность запроса по шаблону маршрута и статусу
+    и команды MongoDB, выполненные до отправки последней части ответа
+    (включая чтение курсоров при потоковой передаче).
+    """
+    
+    def __init__(self, app, metrics: Metrics) -> None:
+        self.app = app
+        self.metrics = metrics
+        
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+            
+        stats = RequestStats()
+        token = current_request.set(stats)
+        start_time = time.perf_counter()
+        status = 500
+        
+        async def send_wrapper(message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+            
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_request.reset(token)
+            self.metrics.observe_request(
+                scope["method"], get_route(scope), status, time.perf_counter() - start_time, stats)
+
+
+def get_route(scope) -> str:
+    """Шаблон пути маршрута, обработавшего запрос (endpoint записывается в scope роутером)"""
+    
+    endpoint = scope.get("endpoint")
+    app = scope.get("app")
+    if endpoint is not None and app is not None:
+        for route in app.routes:
+            if getattr(route, "endpoint", None) is endpoint:
+                return route.path
+                
+    return UNMATCHED_ROUTE
+
+
+def register_mongo_listener(metrics: Metrics) -> None:
+    """Регистрация слушателя команд для всех создаваемых после этого клиентов pymongo"""
+    
+    monitoring.register(MongoCommandListener(metrics))
@@ -1,24 +1,39 @@
 import datetime
+import json
 
-from typing import List, Union
+from typing import List, Optional, Union
 from uuid import UUID
 
 from .datatypes import ShopUnit, ShopUnitImport, ShopUnitImportRequest 
-from .database import ShopUnitDatabase
+from .storage import ShopUnitDatabase
 
 ShopUnits = Union[ShopUnit, ShopUnitImport, ShopUnitImportRequest]
 
 def parse_shop_unit_import_request(input: ShopUnitImportRequest) -> List[ShopUnitDatabase]:
-    """Подготовка входных данных к загрузке в базу данных"""
+    """
+    Подготовка входных данных к загрузке в базу данных.
+    Элементы уже проверены в ShopUnitImportRequest и не валидируются повторно.
+    """
     
-    date = input.updateDate
+    date = datetime.datetime.fromisoformat(input.updateDate)
     
     output = []
     for item in input.items:
-        output.append(ShopUnitDatabase(updateDate=datetime.datetime.fromisoformat(date), **item.__dict__))
-    
+        output.append(ShopUnitDatabase.construct(updateDate=date, **item.__dict__))
+        
     return output
     
+def parse_import_batch(line: str) -> List[ShopUnitDatabase]:
+    """
+    Разбор строки NDJSON с ShopUnitImportRequest:
+    проверка запроса и уникальности id, преобразование в ShopUnitDatabase.
+    """
+    
+    shop_units = parse_shop_unit_import_request(ShopUnitImportRequest(**json.loads(line)))
+    get_ids_types_from_shop_units(shop_units)
+    
+    return shop_units
+    
 def get_ids_types_from_shop_units(shop_units: List[ShopUnits]) -> List[str]:
     """Считываем id и type из списка новых ShopUnits"""
     ids_types = dict()
@@ -28,9 +43,9 @@ def get_ids_types_from_shop_units(shop_units: List[ShopUnits]) -> List[str]:
             ids_types[shop_unit.id] = shop_unit.type
         else:
             raise ValueError(f"Multiple id in one request")
-    
+            
     return ids_types
-
+    
 def get_parent_ids_from_shop_units(shop_units: List[ShopUnits]) -> List[str]:
     """Считываем parentId из списка новых ShopUnits"""
     parent_ids = []
@@ -38,16 +53,16 @@ def get_parent_ids_from_shop_units(shop_units: List[ShopUnits]) -> List[str]:
     for shop_unit in shop_units:
         if (parent_id:=shop_unit.parentId) is not None and parent_id not in parent_ids:
             parent_ids.append(parent_id)
-    
+            
     return parent_ids
-
+    
 def validate_id(id: str) -> None:
     """Проверка, является ли входной id валидным uuid."""
     try:
         _ = UUID(id, version=4)
     except ValueError:
         raise ValueError(f"Offer {id} must be valid uuid value")
-    
+        
 def validate_date(date):
     """Проверка, соответствует ли дата ISO 8601"""
     try:
@@ -56,3 +71,14 @@ def validate_date(date):
         raise ValueError(f"{date} must be in ISO 8601 format")
     return date.replace('Z', '')
     
+def make_etag(version: int) -> str:
+    """ETag ответа по версии элемента"""
+    return f'"{version}"'
+    
+def is_etag_matched(if_none_match: Optional[str], etag: str) -> bool:
+    """Проверка, есть ли etag в заголовке If-None-Match"""
+    if if_none_match is None:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    # Слабые ETag сравниваются как сильные
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
@@ -0,0 +1,1473 @@
+import abc
+import bisect
+import collections
+import datetime
+import itertools
+import math
+import os
+import time
+
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+from dotenv import dotenv_values
+
+from .datatypes import ShopUnitImport
+from .datatypes import ShopUnit
+from .datatypes import ShopUnitStatisticResponse, ShopUnitStatisticUnit
+from .datatypes import ShopUnitStatisticBucket, ShopUnitStatisticBucketResponse
+
+# Размер пачки документов при массовой записи
+WRITE_CHUNK_SIZE = 1000
+
+# Длительность корзин сводок цен категорий (granularity в /node/{id}/statistic)
+STATISTIC_GRANULARITIES = {
+    "hour": datetime.timedelta(hours=1),
+    "day": datetime.timedelta(days=1),
+}
+
+class ShopUnitDatabase(ShopUnitImport):
+    """
+    Формат хранения данных в бд.
+    Аналогичен ShopUnitImport с полем updateDate.
+    """
+    updateDate: datetime.datetime
+    
+    @classmethod
+    def from_document(cls, document: dict) -> "ShopUnitDatabase":
+        """
+        Создание записи из документа хранилища без валидации.
+        Документы проверены при импорте, поэтому копируются только поля модели.
+        """
+        return cls.construct(**{name: document.get(name) for name in cls.__fields__})
+
+
+class TreeAggregates:
+    """
+    Агрегаты (сумма, количество) категорий при последовательном применении записей.
+    Вклад элемента (цена товара или агрегат категории) вычитается
+    из цепочки старых предков и прибавляется к цепочке новых.
+    """
+    
+    def __init__(
+            self,
+            units: Dict[str, tuple],
+            aggregates: Dict[str, Tuple[int, int]],
+            check_cycles: bool = True) -> None:
+        """
+        units - состояние элементов id -> (parentId, type, price),
+        aggregates - агрегаты категорий до применения записей.
+        Элементы, отсутствующие в units, считаются несуществующими.
+        check_cycles=False - цикл не считается ошибкой, цепочка предков обрывается на нем
+        (при проигрывании истории, в которую записи старше актуальных попадают без проверки).
+        """
+        
+        self.units = units
+        self.aggregates = aggregates
+        self.check_cycles = check_cycles
+        # Изменения агрегатов: id категории -> [сумма, количество]
+        self.deltas: Dict[str, List[int]] = dict()
+        
+    def get_parent_id(self, id: str) -> Optional[str]:
+        return self.units.get(id, (None, None, None))[0]
+        
+    def get_contribution(self, id: str) -> Tuple[int, int]:
+        """Вклад элемента в агрегаты предков"""
+        
+        _, type, price = self.units.get(id, (None, None, None))
+        if type == "OFFER":
+            return (price, 1)
+        if type == "CATEGORY":
+            price, count = self.aggregates.get(id, (0, 0))
+            delta = self.deltas.get(id, [0, 0])
+            return (price + delta[0], count + delta[1])
+        return (0, 0)
+        
+    def add_to_ancestors(self, id: str, price: int, count: int) -> None:
+        visited = {id}
+        parent_id = self.get_parent_id(id)
+        while parent_id is not None:
+            if parent_id in visited:
+                if not self.check_cycles:
+                    break
+                raise ValueError(f"Unit with id={id} creates a cycle")
+            visited.add(parent_id)
+            delta = self.deltas.setdefault(parent_id, [0, 0])
+            delta[0] += price
+            delta[1] += count
+            parent_id = self.get_parent_id(parent_id)
+            
+    def is_in_subtree(self, id: str, root_id: str) -> bool:
+        """Находится ли элемент в поддереве root_id (включая сам root_id)"""
+        
+        visited = set()
+        while id is not None and id not in visited:
+            if id == root_id:
+                return True
+            visited.add(id)
+            id = self.get_parent_id(id)
+        return False
+        
+    def apply(self, shop_unit: ShopUnitDatabase) -> None:
+        """Применение новой записи элемента"""
+        
+        price, count = self.get_contribution(shop_unit.id)
+        self.add_to_ancestors(shop_unit.id, -price, -count)
+        
+        self.units[shop_unit.id] = (shop_unit.parentId, shop_unit.type, shop_unit.price)
+        
+        price, count = self.get_contribution(shop_unit.id)
+        self.add_to_ancestors(shop_unit.id, price, count)
+        
+    def get_path_ids(self, id: str) -> List[str]:
+        """Элемент и его предки (от родителя к корню)"""
+        
+        path = [id]
+        parent_id = self.get_parent_id(id)
+        while parent_id is not None and parent_id not in path:
+            path.append(parent_id)
+            parent_id = self.get_parent_id(parent_id)
+        return path
+        
+    def apply_with_points(self, shop_units: List[ShopUnitDatabase]) -> List["PricePoint"]:
+        """
+        Применение записей по группам с одинаковой updateDate.
+        Возвращает точки статистики категорий: как и в /node/{id}/statistic,
+        точка добавляется категории, в поддереве которой элемент группы
+        был до или после обновления.
+        """
+        
+        points = []
+        for date, group in itertools.groupby(shop_units, key=lambda shop_unit: shop_unit.updateDate):
+            group = list(group)
+            
+            paths = [self.get_path_ids(shop_unit.id) for shop_unit in group]
+            for shop_unit in group:
+                self.apply(shop_unit)
+                
+            updates = dict()
+            prices = dict()
+            for shop_unit, path in zip(group, paths):
+                new_path = self.get_path_ids(shop_unit.id)
+                for id in dict.fromkeys(path + new_path):
+                    updates[id] = updates.get(id, 0) + 1
+                if shop_unit.type == "OFFER":
+                    for id in new_path:
+                        prices.setdefault(id, []).append(shop_unit.price)
+                        
+            for id, count in updates.items():
+                if self.units.get(id, (None, None, None))[1] == "CATEGORY":
+                    points.append(PricePoint(id, date, *self.get_contribution(id), count, prices.get(id, [])))
+                    
+        return points
+
+
+class PricePoint(NamedTuple):
+    """
+    Точка статистики категории на дату обновления:
+    sum и count - агрегат товаров поддерева после обновления,
+    updates - число обновленных записей, в поддереве которых категория была до или после обновления,
+    prices - цены обновленных товаров, оказавшихся в поддереве категории.
+    """
+    
+    id: str
+    date: datetime.datetime
+    sum: int
+    count: int
+    updates: int
+    prices: List[int]
+
+
+class PriceRollup(NamedTuple):
+    """
+    Сводка цен категории за корзину времени [bucket, bucket + granularity):
+    sum и count - агрегат товаров поддерева на последнюю точку статистики корзины
+    (date - ее дата; после удаления элементов может остаться дата удаленной точки),
+    updates - число обновлений, давших точки корзины,
+    min и max - наименьшая и наибольшая цена товаров поддерева среди обновлений корзины
+    (None, если в корзине обновлялись только категории).
+    """
+    
+    id: str
+    granularity: str
+    bucket: datetime.datetime
+    date: datetime.datetime
+    sum: int
+    count: int
+    updates: int
+    min: Optional[int]
+    max: Optional[int]
+    
+    @property
+    def key(self) -> Tuple[str, str, datetime.datetime]:
+        return (self.id, self.granularity, self.bucket)
+        
+    @property
+    def end(self) -> datetime.datetime:
+        return self.bucket + STATISTIC_GRANULARITIES[self.granularity]
+        
+    @property
+    def price(self) -> Optional[int]:
+        return math.floor(self.sum/self.count) if self.count > 0 else None
+
+
+def get_bucket_start(date: datetime.datetime, granularity: str) -> datetime.datetime:
+    """Начало корзины granularity, в которую попадает date"""
+    
+    if granularity == "hour":
+        return date.replace(minute=0, second=0, microsecond=0)
+    if granularity == "day":
+        return date.replace(hour=0, minute=0, second=0, microsecond=0)
+        
+    raise ValueError(f"Unknown granularity {granularity}")
+
+
+def merge_price_rollups(first: PriceRollup, second: PriceRollup) -> PriceRollup:
+    """Объединение сводок одной корзины: агрегат - по более поздней точке, обновления суммируются"""
+    
+    latest = second if second.date >= first.date else first
+    prices = [price for price in (first.min, first.max, second.min, second.max) if price is not None]
+    
+    return latest._replace(
+        updates=first.updates + second.updates,
+        min=min(prices) if len(prices) > 0 else None,
+        max=max(prices) if len(prices) > 0 else None)
+
+
+def collect_price_rollups(points: Iterable[PricePoint]) -> Dict[tuple, PriceRollup]:
+    """Сводки всех granularity по точкам статистики"""
+    
+    rollups = dict()
+    for point in points:
+        for granularity in STATISTIC_GRANULARITIES:
+            rollup = PriceRollup(
+                point.id, granularity, get_bucket_start(point.date, granularity), point.date,
+                point.sum, point.count, point.updates,
+                min(point.prices) if len(point.prices) > 0 else None,
+                max(point.prices) if len(point.prices) > 0 else None)
+            if rollup.key in rollups:
+                rollup = merge_price_rollups(rollups[rollup.key], rollup)
+            rollups[rollup.key] = rollup
+            
+    return rollups
+
+
+def collect_price_changes(
+        points: Iterable[PricePoint]) -> Tuple[Dict[str, List[PricePoint]], Dict[tuple, Tuple[int, collections.Counter]]]:
+    """
+    Точки статистики по категориям (в порядке дат) и обновления по корзинам:
+    ключ сводки -> (число обновлений, цены обновленных товаров).
+    """
+    
+    points_by_id = dict()
+    buckets = dict()
+    for point in points:
+        points_by_id.setdefault(point.id, []).append(point)
+        for granularity in STATISTIC_GRANULARITIES:
+            key = (point.id, granularity, get_bucket_start(point.date, granularity))
+            updates, prices = buckets.setdefault(key, (0, collections.Counter()))
+            prices.update(point.prices)
+            buckets[key] = (updates + point.updates, prices)
+            
+    return points_by_id, buckets
+
+
+def get_aggregate_before(points: List[PricePoint], date: datetime.datetime) -> Tuple[int, int]:
+    """Агрегат (сумма, количество) по последней точке раньше date"""
+    
+    index = bisect.bisect_left([point.date for point in points], date)
+    if index == 0:
+        return (0, 0)
+    return (points[index - 1].sum, points[index - 1].count)
+
+
+def get_ancestors_paths(
+        ids: List[str],
+        parents: Dict[str, Optional[str]],
+        paths: Dict[str, List[str]]) -> Dict[str, List[str]]:
+    """
+    Пути предков (от корня к родителю) элементов ids по словарю id -> parentId.
+    Элемент без parentId или отсутствующий в parents считается корнем.
+    paths - уже найденные пути, дополняется найденными путями.
+    """
+    
+    for id in ids:
+        chain = []
+        chain_ids = set()
+        unit_id = id
+        while unit_id not in paths:
+            parent_id = parents.get(unit_id)
+            if parent_id is None:
+                paths[unit_id] = []
+                break
+            if parent_id in chain_ids or parent_id == unit_id:
+                raise ValueError(f"Unit with id={unit_id} creates a cycle")
+            chain.append(unit_id)
+            chain_ids.add(unit_id)
+            unit_id = parent_id
+            
+        for unit_id in reversed(chain):
+            parent_id = parents[unit_id]
+            paths[unit_id] = paths[parent_id] + [parent_id]
+            
+    return {id: paths[id] for id in ids}
+
+
+def get_former_ancestors_closure(
+        shop_units: List[ShopUnitDatabase],
+        former_ancestors: Dict[str, Set[str]]) -> Dict[str, Set[str]]:
+    """
+    Бывшие предки элементов shop_units после их записи в историю по бывшим предкам
+    former_ancestors до записи (элементов и родителей записей): запись с parentId
+    добавляет к бывшим предкам элемента родителя и всех бывших предков родителя.
+    Замыкание считается и по родителям из shop_units - до неподвижной точки.
+    """
+    
+    closure = {shop_unit.id: set(former_ancestors.get(shop_unit.id, set())) for shop_unit in shop_units}
+    changed = True
+    while changed:
+        changed = False
+        for shop_unit in shop_units:
+            if shop_unit.parentId is None:
+                continue
+            added = {shop_unit.parentId}
+            added.update(closure.get(shop_unit.parentId, former_ancestors.get(shop_unit.parentId, set())))
+            added.difference_update(closure[shop_unit.id])
+            added.discard(shop_unit.id)
+            if len(added) > 0:
+                closure[shop_unit.id].update(added)
+                changed = True
+                
+    return closure
+
+
+def format_sales_date(date: datetime.datetime) -> str:
+    """Дата обновления товара в ответе /sales (с миллисекундами)"""
+    
+    return date.strftime("%Y-%m-%dT%H:%M:%S.") + f"{date.microsecond // 1000:03d}Z"
+
+
+def check_ids_types(
+        new_ids_types: Dict[str, str],
+        new_parent_ids: List[str],
+        old_ids_types: Dict[str, str]) -> None:
+    """
+    Проверка импорта по типам уже существующих элементов old_ids_types:
+    1. Новые id не совпадают с существующими id с другим type.
+    2. Элементы с существующими id и тем же type обновляются.
+    3. parentIds существуют в хранилище или в импорте и являются категориями.
+    """
+    # Выполняем 1 и 2 задачи
+    for new_id, new_type in new_ids_types.items():
+        # Если id из базы есть в списке новых id и их type не совпадает
+        if new_id in old_ids_types and old_ids_types[new_id] != new_type:
+            # Вызываем исключение
+            raise ValueError(
+                f"Unit with id={new_id} has different type with the already exist in db.")
+                
+    # Проверяем new_parent_ids
+    for new_parent_id in new_parent_ids:
+        if new_parent_id not in new_ids_types and new_parent_id not in old_ids_types:
+            raise ValueError(f"Parent element with id {new_parent_id} not exist")
+        else:
+            if new_parent_id in new_ids_types and new_ids_types[new_parent_id] == "OFFER":
+                raise ValueError(f"{new_parent_id} is 'OFFER', not 'CATEGORY'")
+            elif new_parent_id in old_ids_types and old_ids_types[new_parent_id] == "OFFER":
+                raise ValueError(f"{new_parent_id} is 'OFFER', not 'CATEGORY'")
+
+
+class StorageDriver(abc.ABC):
+    """
+    Интерфейс хранилища товаров/категорий.
+    Логика API (проверка импорта, агрегаты цен, сборка дерева, статистика)
+    реализована здесь поверх примитивов чтения и записи,
+    которые реализует каждое хранилище.
+    """
+    
+    def __init__(self) -> None:
+        """Инициализация списка подписчиков на изменения и счетчиков удалений"""
+        
+        self._change_listeners: List[Callable[[Optional[Set[str]]], None]] = []
+        # Счетчики удалений для /metrics: число удалений, удаленных элементов и суммарная длительность
+        self.deletes = 0
+        self.deleted_units = 0
+        self.delete_seconds = 0.0
+        
+    def add_change_listener(self, listener: Callable[[Optional[Set[str]]], None]) -> None:
+        """
+        Подписка на изменения хранилища. После каждой записи listener получает
+        ids элементов, ответы по которым изменились (элементы и их предки),
+        или None, если изменилось все хранилище.
+        """
+        self._change_listeners.append(listener)
+        
+    def notify_changed(self, ids: Optional[Set[str]]) -> None:
+        """Оповещение подписчиков об изменении элементов ids"""
+        
+        for listener in self._change_listeners:
+            listener(ids)
+            
+    @abc.abstractmethod
+    def clear_collection(self) -> None:
+        """Очистка хранилища"""
+        
+    @abc.abstractmethod
+    def insert_history_records(self, shop_units: List[ShopUnitDatabase], chunk_size: int, ordered: bool) -> int:
+        """Запись объектов в историю. Возвращает количество записанных объектов."""
+        
+    @abc.abstractmethod
+    def write_current_records(
+            self,
+            shop_units: List[ShopUnitDatabase],
+            records: Dict[str, ShopUnitDatabase],
+            ancestors: Dict[str, List[str]],
+            former_ancestors: Dict[str, Set[str]],
+            chunk_size: int = WRITE_CHUNK_SIZE) -> None:
+        """
+        Обновление актуальных записей элементов (records - записи до импорта)
+        вместе с путями предков ancestors (от корня к родителю)
+        и всеми бывшими предками former_ancestors (allAncestors, включают путь).
+        Элемент, перенесенный в другую категорию, оказывается
+        в конце списка дочерних элементов новой категории.
+        """
+        
+    @abc.abstractmethod
+    def update_ancestors(self, ancestors: Dict[str, List[str]], chunk_size: int = WRITE_CHUNK_SIZE) -> None:
+        """Обновление путей предков элементов, не входящих в импорт"""
+        
+    @abc.abstractmethod
+    def add_former_ancestors(self, ancestors_ids: Dict[str, Set[str]], chunk_size: int = WRITE_CHUNK_SIZE) -> None:
+        """
+        Добавление категорий ancestors_ids[id] к бывшим предкам (allAncestors)
+        элемента id и всех его бывших потомков
+        """
+        
+    @abc.abstractmethod
+    def apply_aggregates_deltas(self, deltas: Dict[str, List[int]]) -> None:
+        """Запись изменений агрегатов категорий"""
+        
+    @abc.abstractmethod
+    def delete_records(self, ids: Set[str], categories_ids: Set[str], chunk_size: int = WRITE_CHUNK_SIZE) -> None:
+        """
+        Удаление элементов ids (актуальные записи и история),
+        записей истории с parentId из categories_ids и агрегатов categories_ids.
+        """
+        
+    @abc.abstractmethod
+    def get_subtree_types(self, id: str) -> Dict[str, str]:
+        """Типы элементов поддерева id (включая сам элемент) одним запросом"""
+        
+    @abc.abstractmethod
+    def get_latest_records_shop_units(self, ids: List[str]) -> Dict[str, ShopUnitDatabase]:
+        """Получение новейших записей о товарах/категориях"""
+        
+    @abc.abstractmethod
+    def get_types_by_ids(self, ids: List[str]) -> Dict[str, str]:
+        """Возвращает type существующих элементов из ids"""
+        
+    @abc.abstractmethod
+    def get_category_aggregates(self, ids: List[str]) -> Dict[str, Tuple[int, int]]:
+        """Возвращает (суммарная стоимость, количество товаров) категорий из ids"""
+        
+    @abc.abstractmethod
+    def get_ancestors(self, ids: List[str]) -> Dict[str, List[str]]:
+        """Пути предков (от корня к родителю) существующих элементов из ids"""
+        
+    @abc.abstractmethod
+    def get_all_ancestors(self, ids: List[str]) -> Dict[str, Tuple[List[str], Set[str]]]:
+        """
+        Пути предков (от корня к родителю) и бывшие предки (allAncestors)
+        существующих элементов из ids одним запросом
+        """
+        
+    @abc.abstractmethod
+    def get_subtree_records(self, ids: List[str]) -> List[ShopUnitDatabase]:
+        """
+        Актуальные записи потомков элементов ids в порядке их добавления
+        (поддеревья ids не должны пересекаться).
+        """
+        
+    @abc.abstractmethod
+    def get_childrens(
+            self,
+            parent_ids: List[str],
+            limit: Optional[int] = None,
+            after_id: Optional[str] = None) -> Dict[str, List[ShopUnitDatabase]]:
+        """
+        Актуальные записи дочерних элементов категорий в порядке добавления:
+        не более limit на категорию и, если задан after_id, - после дочернего элемента after_id.
+        """
+        
+    @abc.abstractmethod
+    def count_childrens(self, parent_ids: List[str]) -> Dict[str, int]:
+        """Количество дочерних элементов категорий"""
+        
+    @abc.abstractmethod
+    def get_subtree_parents(self, ids: List[str]) -> Dict[str, Optional[str]]:
+        """parentId всех потомков элементов ids"""
+        
+    @abc.abstractmethod
+    def get_former_descendants_ids(self, ids: List[str]) -> Set[str]:
+        """
+        Ids элементов, когда-либо находившихся в поддеревьях ids.
+        Может содержать лишние элементы, но не пропускает ни одного.
+        """
+        
+    @abc.abstractmethod
+    def get_former_ancestors_ids(self, ids: List[str]) -> Set[str]:
+        """Ids категорий, в поддеревьях которых когда-либо находились элементы ids"""
+        
+    @abc.abstractmethod
+    def next_version(self) -> int:
+        """Следующее значение сквозного счетчика записей"""
+        
+    @abc.abstractmethod
+    def set_versions(self, ids: Set[str], version: int) -> None:
+        """Запись версии существующим элементам ids"""
+        
+    @abc.abstractmethod
+    def get_versions(self, ids: List[str]) -> Dict[str, int]:
+        """Версии существующих элементов из ids"""
+        
+    @abc.abstractmethod
+    def get_history_records(self, ids: List[str], end_date: datetime.datetime) -> List[ShopUnitDatabase]:
+        """Записи истории элементов ids до end_date (не включительно) в порядке updateDate"""
+        
+    @abc.abstractmethod
+    def get_former_descendants_history(self, ids: List[str], end_date: datetime.datetime) -> List[ShopUnitDatabase]:
+        """
+        Записи истории элементов ids и их бывших потомков до end_date (не включительно)
+        в порядке updateDate одним запросом
+        """
+        
+    @abc.abstractmethod
+    def get_updated_records(self, start_date: datetime.datetime, end_date: datetime.datetime) -> List[ShopUnitDatabase]:
+        """Записи истории всех элементов с updateDate в [start_date, end_date) в порядке updateDate"""
+        
+    @abc.abstractmethod
+    def get_records_at(self, ids: List[str], end_date: datetime.datetime) -> List[ShopUnitDatabase]:
+        """
+        Состояние элементов ids до end_date (не включительно) - последние записи истории
+        по updateDate, в порядке появления элементов в истории.
+        """
+        
+    @abc.abstractmethod
+    def get_price_rollups(
+            self,
+            ids: List[str],
+            start: datetime.datetime,
+            end: datetime.datetime,
+            granularity: Optional[str] = None) -> List[PriceRollup]:
+        """
+        Сводки цен категорий ids с началом корзины в [start, end)
+        (всех granularity, если не задана) в порядке id, granularity и начала корзины.
+        """
+        
+    @abc.abstractmethod
+    def get_latest_price_rollups(self, ids: List[str], end: datetime.datetime) -> Dict[str, PriceRollup]:
+        """Последние часовые сводки цен категорий ids с началом корзины до end"""
+        
+    @abc.abstractmethod
+    def write_price_rollups(
+            self,
+            rollups: List[PriceRollup],
+            deleted_keys: Iterable[Tuple[str, str, datetime.datetime]] = (),
+            deleted_ids: Iterable[str] = (),
+            chunk_size: int = WRITE_CHUNK_SIZE) -> None:
+        """
+        Запись сводок цен с заменой сводок тех же корзин, удаление сводок по ключам deleted_keys
+        и всех сводок категорий deleted_ids
+        """
+        
+    @abc.abstractmethod
+    def delete_price_rollups(
+            self,
+            ids: Set[str],
+            start: datetime.datetime = datetime.datetime.min,
+            end: datetime.datetime = datetime.datetime.max,
+            chunk_size: int = WRITE_CHUNK_SIZE) -> None:
+        """Удаление сводок цен категорий ids с началом корзины в [start, end)"""
+        
+    @abc.abstractmethod
+    def get_latest_updated_offers(self, start_date: datetime.datetime, end_date: datetime.datetime) -> Iterable[dict]:
+        """
+        Последние версии товаров, обновленных на интервале [start_date, end_date],
+        в порядке id. Элементы - словари полей ShopUnitStatisticUnit.
+        """
+        
+    def write_list_shop_unit_database_to_collection(
+            self,
+            shop_units: List[ShopUnitDatabase],
+            chunk_size: int = WRITE_CHUNK_SIZE,
+            ordered: bool = True) -> int:
+        """
+        Запись списка объектов ShopUnitDatabase в историю пачками по chunk_size
+        с обновлением актуальных записей и агрегатов цен категорий.
+        При ordered=False хранилище может записывать объекты пачки в историю параллельно.
+        Возвращает количество записанных в историю объектов.
+        Объект с updateDate раньше, чем у актуальной записи элемента,
+        записывается только в историю: актуальная запись и агрегаты не меняются.
+        Если импорт старше уже записанной истории, сводки цен пересчитываются по истории.
+        """
+        # Изменения считаем по состоянию базы до записи
+        records = self.get_latest_records_shop_units([shop_unit.id for shop_unit in shop_units])
+        fresh = [
+            shop_unit for shop_unit in shop_units
+            if shop_unit.id not in records or records[shop_unit.id].updateDate <= shop_unit.updateDate]
+        stale = [
+            shop_unit for shop_unit in shop_units
+            if shop_unit.id in records and records[shop_unit.id].updateDate > shop_unit.updateDate]
+            
+        tree, old_ancestors, former_ancestors, latest_date = self.load_import_tree(fresh, records, stale)
+        points = tree.apply_with_points(fresh)
+        ancestors, moved_ancestors = self.calculate_ancestors(fresh, tree, old_ancestors)
+        # Бывшие предки элементов импорта с учетом новых записей. Добавленные к ним
+        # категории получают и бывшие потомки уже существующих элементов, иначе
+        # те выпадут из статистики и чтения на момент, когда были в их поддереве
+        # (актуальные записи элементов получают бывших предков вместе с записью)
+        all_ancestors = get_former_ancestors_closure(shop_units, former_ancestors)
+        added_ancestors = dict()
+        for shop_unit in shop_units:
+            added = all_ancestors[shop_unit.id].difference(former_ancestors.get(shop_unit.id, set()))
+            if len(added) > 0 and shop_unit.id in records and (
+                    shop_unit.type == "CATEGORY" or shop_unit.id not in ancestors):
+                added_ancestors[shop_unit.id] = added
+                
+        # Импорт старше истории затронутых элементов может образовать цикл не сейчас,
+        # а на дату своих записей или позже, пока они действуют
+        if len(stale) > 0 or min(shop_unit.updateDate for shop_unit in shop_units) < latest_date:
+            self.check_history_cycles(shop_units, all_ancestors)
+            
+        inserted_count = self.insert_history_records(shop_units, chunk_size, ordered)
+        
+        self.write_current_records(fresh, records, ancestors, all_ancestors, chunk_size)
+        self.update_ancestors(moved_ancestors, chunk_size)
+        self.add_former_ancestors(added_ancestors, chunk_size)
+        self.apply_aggregates_deltas(tree.deltas)
+        # Точки посчитаны по актуальному состоянию и верны, только если импорт не старше
+        # сводок: иначе сводки пересчитываются по истории с суток самой ранней записи импорта
+        is_older = len(stale) > 0 or not self.update_price_rollups(points)
+        if is_older:
+            self.replay_price_rollups(
+                get_bucket_start(min(shop_unit.updateDate for shop_unit in shop_units), "day"))
+                
+        # Изменились импортированные элементы и их старые и новые предки
+        changed_ids = set(ancestors)
+        changed_ids.update(itertools.chain.from_iterable(old_ancestors.values()))
+        changed_ids.update(itertools.chain.from_iterable(ancestors.values()))
+        if is_older:
+            # Изменилась статистика всех категорий, в которых бывали элементы импорта
+            changed_ids.update(shop_unit.id for shop_unit in shop_units)
+            changed_ids.update(itertools.chain.from_iterable(all_ancestors.values()))
+        self.set_versions(changed_ids, self.next_version())
+        self.notify_changed(changed_ids)
+        
+        return inserted_count
+        
+    def check_history_cycles(
+            self,
+            shop_units: List[ShopUnitDatabase],
+            all_ancestors: Dict[str, Set[str]]) -> None:
+        """
+        Проверка, что записи импорта не образуют цикл в истории дерева.
+        all_ancestors - бывшие предки элементов импорта с учетом его записей:
+        в цикл на любую дату входят только они, поэтому их история (одним запросом)
+        проигрывается вместе с импортом. Цикл, в который входит элемент импорта,
+        на дату его самой ранней записи или позже - ValueError.
+        """
+        
+        ids = set(all_ancestors).union(*all_ancestors.values())
+        # Записи импорта - после записей истории с той же датой
+        records = sorted(
+            self.get_history_records(list(ids), datetime.datetime.max) + shop_units,
+            key=lambda record: record.updateDate)
+        start_date = min(shop_unit.updateDate for shop_unit in shop_units)
+        
+        parents = dict()
+        for date, group in itertools.groupby(records, key=lambda record: record.updateDate):
+            group = list(group)
+            for record in group:
+                parents[record.id] = record.parentId
+            if date < start_date:
+                continue
+                
+            # Новый цикл проходит через элемент, обновленный на эту дату
+            for record in group:
+                chain = [record.id]
+                parent_id = parents[record.id]
+                while parent_id is not None and parent_id not in chain:
+                    chain.append(parent_id)
+                    parent_id = parents.get(parent_id)
+                if parent_id is not None and any(
+                        unit_id in all_ancestors for unit_id in chain[chain.index(parent_id):]):
+                    raise ValueError(f"Unit with id={record.id} creates a cycle")
+                    
+    def update_price_rollups(self, points: List[PricePoint]) -> bool:
+        """
+        Добавление точек статистики в сводки цен: затронутые корзины
+        считываются одним запросом и записываются одной записью.
+        Если у категории уже есть точка позже ее новой точки, сводки не меняются
+        и возвращается False.
+        """
+        
+        if len(points) == 0:
+            return True
+            
+        rollups = collect_price_rollups(points)
+        first_dates = dict()
+        for point in points:
+            first_dates.setdefault(point.id, point.date)
+            
+        start = get_bucket_start(min(first_dates.values()), "day")
+        stored = self.get_price_rollups(list(first_dates), start, datetime.datetime.max)
+        if any(rollup.date > first_dates[rollup.id] for rollup in stored):
+            return False
+            
+        for rollup in stored:
+            if rollup.key in rollups:
+                rollups[rollup.key] = merge_price_rollups(rollup, rollups[rollup.key])
+                
+        self.write_price_rollups(list(rollups.values()))
+        return True
+        
+    def replay_price_rollups(
+            self,
+            start: datetime.datetime,
+            end: datetime.datetime = datetime.datetime.max) -> None:
+        """
+        Пересчет сводок цен за [start, end) (start и end - начала суток) по истории
+        для всех категорий, затронутых записями интервала.
+        Записи интервала загружаются одним запросом по updateDate, состояние на start -
+        записями на момент start элементов интервала и их бывших предков
+        и последними сводками категорий до start.
+        """
+        
+        records = self.get_updated_records(start, end)
+        if len(records) == 0:
+            return
+            
+        units_ids = {record.id for record in records}
+        units_ids.update(record.parentId for record in records if record.parentId is not None)
+        units_ids.update(self.get_former_ancestors_ids(list(units_ids)))
+        units = {
+            record.id: (record.parentId, record.type, record.price)
+            for record in self.get_records_at(list(units_ids), start)}
+            
+        rollups = self.get_latest_price_rollups(
+            [id for id, unit in units.items() if unit[1] == "CATEGORY"], start)
+        aggregates = {id: (rollup.sum, rollup.count) for id, rollup in rollups.items()}
+        
+        # Категории без записей до start не имеют сводок, но могут содержать элементы
+        # (если их записи удалены вместе с бывшей родительской категорией):
+        # их агрегаты считаются по истории бывших потомков
+        missing_ids = {unit[0] for unit in units.values() if unit[0] is not None and unit[0] not in units}
+        missing_ids.update(
+            record.id for record in records if record.type == "CATEGORY" and record.id not in units)
+        if len(missing_ids) > 0:
+            missing_tree = TreeAggregates(dict(), dict(), check_cycles=False)
+            for record in self.get_former_descendants_history(list(missing_ids), start):
+                missing_tree.apply(record)
+            for id in missing_ids:
+                aggregates[id] = tuple(missing_tree.deltas.get(id, [0, 0]))
+                
+        tree = TreeAggregates(units, aggregates, check_cycles=False)
+        
+        points = tree.apply_with_points(records)
+        
+        self.delete_price_rollups({point.id for point in points}, start, end)
+        self.write_price_rollups(list(collect_price_rollups(points).values()))
+        
+    def subtract_price_rollups(
+            self,
+            records: List[ShopUnitDatabase],
+            ids: Set[str],
+            categories_ids: Set[str]) -> None:
+        """
+        Вычитание из сводок цен вклада удаленных записей: элементов ids и записей
+        с parentId из categories_ids, вместе с удалением сводок категорий categories_ids.
+        records - история до удаления всех элементов, удаленные записи которых
+        влияли на чьи-либо точки, и категорий, в которых они бывали.
+        История проигрывается с удаленными записями и без них, разница точек
+        применяется к сводкам, начиная с суток первой удаленной записи.
+        Корзины, где удаленная цена была наименьшей или наибольшей, и новые корзины
+        пересчитываются по истории только своих категорий и их бывших потомков.
+        Все изменения сводок записываются одной записью.
+        """
+        
+        def is_deleted(record: ShopUnitDatabase) -> bool:
+            return record.id in ids or record.parentId in categories_ids
+            
+        rollups = []
+        deleted_keys = []
+        deleted_dates = [record.updateDate for record in records if is_deleted(record)]
+        if len(deleted_dates) > 0:
+            start = get_bucket_start(min(deleted_dates), "day")
+            
+            old_points, old_buckets = collect_price_changes(
+                TreeAggregates(dict(), dict(), check_cycles=False).apply_with_points(records))
+            new_points, new_buckets = collect_price_changes(
+                TreeAggregates(dict(), dict(), check_cycles=False).apply_with_points(
+                    [record for record in records if not is_deleted(record)]))
+                    
+            replayed_keys = set()
+            stored_keys = set()
+            remaining_ids = set(old_points).difference(ids)
+            stored = []
+            if len(remaining_ids) > 0:
+                stored = self.get_price_rollups(list(remaining_ids), start, datetime.datetime.max)
+            for rollup in stored:
+                stored_keys.add(rollup.key)
+                old_sum, old_count = get_aggregate_before(old_points[rollup.id], rollup.end)
+                new_sum, new_count = get_aggregate_before(new_points.get(rollup.id, []), rollup.end)
+                old_updates, old_prices = old_buckets.get(rollup.key, (0, collections.Counter()))
+                new_updates, new_prices = new_buckets.get(rollup.key, (0, collections.Counter()))
+                
+                updated = rollup._replace(
+                    sum=rollup.sum - old_sum + new_sum,
+                    count=rollup.count - old_count + new_count,
+                    updates=rollup.updates - old_updates + new_updates)
+                if updated.updates <= 0:
+                    deleted_keys.append(rollup.key)
+                    continue
+                    
+                removed = old_prices - new_prices
+                added = new_prices - old_prices
+                if len(removed) > 0 and (rollup.min is None or min(removed) <= rollup.min or max(removed) >= rollup.max):
+                    # Наименьшую и наибольшую цену без удаленной не восстановить по сводке
+                    replayed_keys.add(rollup.key)
+                    continue
+                if len(added) > 0:
+                    updated = merge_price_rollups(
+                        updated, updated._replace(updates=0, min=min(added), max=max(added)))
+                        
+                if updated != rollup:
+                    rollups.append(updated)
+                    
+            # Корзины, в которых точки появились только без удаленных записей
+            replayed_keys.update(
+                key for key in new_buckets
+                if key not in stored_keys and key[0] in remaining_ids and key[2] >= start)
+                
+            if len(replayed_keys) > 0:
+                replayed = self.replay_price_buckets(replayed_keys)
+                rollups.extend(replayed.values())
+                deleted_keys.extend(replayed_keys.difference(replayed))
+                
+        self.write_price_rollups(rollups, deleted_keys, categories_ids)
+        
+    def replay_price_buckets(self, keys: Set[Tuple[str, str, datetime.datetime]]) -> Dict[tuple, PriceRollup]:
+        """
+        Сводки корзин keys, посчитанные заново по истории их категорий и бывших потомков
+        категорий (одним запросом): на любую дату в поддереве категории находятся
+        только ее бывшие потомки, поэтому их истории достаточно для точек категории.
+        Корзины без точек в результат не попадают.
+        """
+        
+        ids = {key[0] for key in keys}
+        end = max(key[2] + STATISTIC_GRANULARITIES[key[1]] for key in keys)
+        points = TreeAggregates(dict(), dict(), check_cycles=False).apply_with_points(
+            self.get_former_descendants_history(list(ids), end))
+        rollups = collect_price_rollups(point for point in points if point.id in ids)
+        
+        return {key: rollups[key] for key in keys if key in rollups}
+        
+    def get_category_aggregate(self, id: str) -> Tuple[int, int]:
+        """Возвращает (суммарная стоимость, количество товаров) категории"""
+        
+        return self.get_category_aggregates([id]).get(id, (0, 0))
+        
+    def load_import_tree(
+            self,
+            shop_units: List[ShopUnitDatabase],
+            records: Dict[str, ShopUnitDatabase],
+            stale: List[ShopUnitDatabase]) -> Tuple[
+                TreeAggregates, Dict[str, List[str]], Dict[str, Set[str]], datetime.datetime]:
+        """
+        Загрузка состояния, затронутого импортом: импортируемые элементы,
+        их старые и новые предки (по сохраненным путям - двумя запросами)
+        и агрегаты категорий.
+        records - актуальные записи импортируемых элементов до импорта,
+        stale - записи импорта старше актуальных (только в историю).
+        Возвращает TreeAggregates до применения импорта, сохраненные пути предков
+        и бывших предков элементов и родителей всех записей импорта
+        и самую позднюю updateDate загруженных элементов.
+        """
+        
+        # Состояние затронутых элементов: id -> (parentId, type, price)
+        units = dict()
+        
+        for shop_unit in shop_units:
+            if shop_unit.id in records:
+                record = records[shop_unit.id]
+                units[shop_unit.id] = (record.parentId, record.type, record.price)
+            else:
+                units[shop_unit.id] = (None, None, None)
+                
+        # Пути предков старых положений элементов и новых родителей
+        ids = set(records)
+        ids.update(shop_unit.parentId for shop_unit in shop_units + stale if shop_unit.parentId is not None)
+        all_ancestors = self.get_all_ancestors(list(ids))
+        old_ancestors = {id: path for id, (path, _) in all_ancestors.items()}
+        former_ancestors = {id: former for id, (_, former) in all_ancestors.items()}
+        
+        ids.update(itertools.chain.from_iterable(old_ancestors.values()))
+        ids.difference_update(units)
+        parents_records = self.get_latest_records_shop_units(list(ids))
+        latest_date = max(
+            (record.updateDate for record in itertools.chain(records.values(), parents_records.values())),
+            default=datetime.datetime.min)
+        for id in ids:
+            if id in parents_records:
+                record = parents_records[id]
+                units[id] = (record.parentId, record.type, record.price)
+            else:
+                units[id] = (None, None, None)
+                
+        # Агрегаты затронутых категорий
+        tree = TreeAggregates(units, self.get_category_aggregates(
+            [id for id, unit in units.items() if unit[1] == "CATEGORY"]))
+            
+        return tree, old_ancestors, former_ancestors, latest_date
+        
+    def calculate_ancestors(
+            self,
+            shop_units: List[ShopUnitDatabase],
+            tree: TreeAggregates,
+            old_ancestors: Dict[str, List[str]]) -> Tuple[Dict[str, List[str]], Dict[str, List[str]]]:
+        """
+        Пути предков после импорта (tree - с примененным импортом).
+        Возвращает пути импортируемых элементов и новые пути потомков
+        категорий, путь которых изменился (одним запросом к хранилищу).
+        """
+        
+        parents = {id: unit[0] for id, unit in tree.units.items()}
+        paths = dict()
+        ancestors = get_ancestors_paths([shop_unit.id for shop_unit in shop_units], parents, paths)
+        
+        moved_ids = [
+            shop_unit.id for shop_unit in shop_units
+            if shop_unit.type == "CATEGORY" and shop_unit.id in old_ancestors
+            and old_ancestors[shop_unit.id] != ancestors[shop_unit.id]]
+            
+        moved_ancestors = dict()
+        if len(moved_ids) > 0:
+            descendants = self.get_subtree_parents(moved_ids)
+            for id, parent_id in descendants.items():
+                parents.setdefault(id, parent_id)
+            moved_ancestors = get_ancestors_paths(
+                [id for id in descendants if id not in ancestors], parents, paths)
+                
+        return ancestors, moved_ancestors
+        
+    def check_ids_new_shop_units(self, new_ids_types: List[dict], new_parent_ids: List[str]) -> None:
+        """
+        1. Проверка отсутствия новых id в уже существующих id с разным type.
+        2. Запись объектов с одинаковыми id и type в бд.
+        3. Проверка существования parentIds в бд или в новых ShopUnits
+        """
+        # Словарь существующих товаров и их типов.
+        # Считываем из базы только id из запроса и их parentIds
+        old_ids_types = self.get_types_by_ids(
+            list(set(new_ids_types).union(new_parent_ids)))
+            
+        check_ids_types(new_ids_types, new_parent_ids, old_ids_types)
+        
+    def import_batches(
+            self,
+            batches: List[List[ShopUnitDatabase]],
+            window_size: int = WRITE_CHUNK_SIZE) -> List[Optional[str]]:
+        """
+        Проверка и запись последовательности импортов (каждый - список элементов
+        с уникальными id) в порядке следования. Возвращает ошибку каждого импорта
+        (None - импорт записан), импорт с ошибкой пропускается целиком.
+        Подряд идущие импорты общим размером до window_size объединяются в окно:
+        состояние элементов окна считывается одним запросом, проверка выполняется
+        по нему с учетом предыдущих импортов окна, окно записывается одной записью.
+        В окно после первого импорта попадают только импорты, не меняющие
+        положение уже существующих элементов и не повторяющие id окна, -
+        тогда запись окна совпадает с последовательной записью импортов.
+        """
+        
+        errors: List[Optional[str]] = [None] * len(batches)
+        
+        start = 0
+        while start < len(batches):
+            # Кандидаты в окно: не менее одного импорта, всего не более window_size элементов
+            end = start + 1
+            size = len(batches[start])
+            while end < len(batches) and size + len(batches[end]) <= window_size:
+                size += len(batches[end])
+                end += 1
+                
+            ids = set()
+            for batch in batches[start:end]:
+                for shop_unit in batch:
+                    ids.add(shop_unit.id)
+                    if shop_unit.parentId is not None:
+                        ids.add(shop_unit.parentId)
+            records = self.get_latest_records_shop_units(list(ids))
+            
+            # Типы элементов после принятых импортов окна
+            types = {id: record.type for id, record in records.items()}
+            window: List[int] = []
+            window_ids: Set[str] = set()
+            index = start
+            while index < end:
+                batch = batches[index]
+                if len(window) > 0 and not all(
+                        shop_unit.id not in window_ids
+                        and (shop_unit.id not in records or records[shop_unit.id].parentId == shop_unit.parentId)
+                        for shop_unit in batch):
+                    break
+                    
+                new_ids_types = {shop_unit.id: shop_unit.type for shop_unit in batch}
+                new_parent_ids = list(dict.fromkeys(
+                    shop_unit.parentId for shop_unit in batch if shop_unit.parentId is not None))
+                try:
+                    check_ids_types(new_ids_types, new_parent_ids, types)
+                except ValueError as e:
+                    errors[index] = str(e)
+                else:
+                    window.append(index)
+                    window_ids.update(new_ids_types)
+                    types.update(new_ids_types)
+                index += 1
+                
+            if len(window) > 0:
+                try:
+                    self.write_list_shop_unit_database_to_collection(
+                        [shop_unit for i in window for shop_unit in batches[i]])
+                except ValueError as e:
+                    # Ошибка записи (например, цикл в дереве) до изменения хранилища:
+                    # импорты окна записываются по одному, чтобы найти ошибочный
+                    if len(window) == 1:
+                        errors[window[0]] = str(e)
+                    else:
+                        for i in window:
+                            errors[i] = self.import_batches([batches[i]], window_size)[0]
+                            
+            start = index
+            
+        return errors
+        
+    def get_ancestors_ids(self, id: str) -> List[str]:
+        """Возвращает ids предков элемента (от родителя к корню)"""
+        
+        return list(reversed(self.get_ancestors([id]).get(id, [])))
+        
+    def delete_by_id(self, id: str) -> None:
+        """
+        Удаление элемента по идентификатору.
+        При удалении категории удаляются все дочерние элементы:
+        поддерево определяется одним запросом и удаляется по множеству ids.
+        """
+        
+        start_time = time.perf_counter()
+        
+        shop_unit_database = self.get_latest_record_shop_unit(id)
+        
+        # Вклад элемента в агрегаты предков
+        if shop_unit_database.type == "CATEGORY":
+            price, count = self.get_category_aggregate(id)
+        else:
+            price, count = (shop_unit_database.price, 1)
+        ancestors = self.get_ancestors_ids(id)
+        
+        types = self.get_subtree_types(id)
+        ids = set(types)
+        categories_ids = {unit_id for unit_id, type in types.items() if type == "CATEGORY"}
+        
+        # Изменяются ответы по удаляемым элементам, их предкам, а также статистика
+        # элементов, теряющих историю, и категорий, в которых эти элементы бывали
+        changed_ids = self.get_former_descendants_ids(list(categories_ids))
+        changed_ids.update(ids)
+        changed_ids.update(self.get_former_ancestors_ids(list(changed_ids)))
+        changed_ids.update(ancestors)
+        # История до удаления для вычитания вклада удаленных записей из сводок цен
+        # (не нужна, если бывших предков вне удаляемого поддерева нет)
+        records = []
+        if not changed_ids.issubset(ids):
+            records = self.get_history_records(list(changed_ids), datetime.datetime.max)
+            
+        # Вместе с категориями удаляются и записи элементов,
+        # перенесенных из них в другие категории
+        self.delete_records(ids, categories_ids)
+        
+        self.apply_aggregates_deltas({
+            ancestor_id: [-price, -count] for ancestor_id in ancestors})
+        self.subtract_price_rollups(records, ids, categories_ids)
+        
+        self.set_versions(changed_ids.difference(ids), self.next_version())
+        self.notify_changed(changed_ids)
+        
+        self.deletes += 1
+        self.deleted_units += len(ids)
+        self.delete_seconds += time.perf_counter() - start_time
+        
+    def get_version(self, id: str) -> int:
+        """
+        Версия элемента - значение счетчика записей при последнем изменении
+        элемента или его поддерева. Меняется при каждом изменении ответов
+        /nodes/{id} и /node/{id}/statistic и не повторяется после удаления.
+        """
+        
+        versions = self.get_versions([id])
+        if id not in versions:
+            raise ValueError(f"Unit with id {id} missing in db")
+            
+        return versions[id]
+        
+    def get_latest_record_shop_unit(self, id: str) -> ShopUnitDatabase:
+        """
+        Получение новейшей записи о товаре/категории
+        """
+        
+        records = self.get_latest_records_shop_units([id])
+        if id not in records:
+            raise ValueError(f"Unit with id {id} missing in db")
+            
+        return records[id]
+        
+    def get_categories_prices(self, ids: List[str]) -> Dict[str, Optional[int]]:
+        """Средние цены товаров категорий одним запросом"""
+        
+        prices = {id: None for id in ids}
+        
+        for id, (price, count) in self.get_category_aggregates(ids).items():
+            if count > 0:
+                prices[id] = math.floor(price/count)
+                
+        return prices
+        
+    def load_subtree(self, id: str) -> Tuple[ShopUnitDatabase, Dict[str, List[ShopUnitDatabase]]]:
+        """
+        Загрузка актуальных записей всего поддерева элемента.
+        Поддерево считывается одним запросом по путям предков.
+        Возвращает корень и индекс parentId -> список дочерних элементов.
+        """
+        
+        root = self.get_latest_record_shop_unit(id)
+        
+        childrens = dict()
+        if root.type == "CATEGORY":
+            childrens[id] = []
+            for unit in self.get_subtree_records([id]):
+                if unit.type == "CATEGORY":
+                    childrens.setdefault(unit.id, [])
+                childrens.setdefault(unit.parentId, []).append(unit)
+                
+        return root, childrens
+        
+    def load_info(self, id: str) -> Tuple[ShopUnitDatabase, Dict[str, List[ShopUnitDatabase]], Dict[str, Optional[int]]]:
+        """
+        Загрузка данных для ответа /nodes/{id}:
+        корень, индекс parentId -> дочерние элементы и цены категорий поддерева.
+        """
+        
+        root, childrens = self.load_subtree(id)
+        
+        prices = self.get_categories_prices(list(childrens))
+        
+        return root, childrens, prices
+        
+    def load_infos(self, ids: List[str]) -> Tuple[
+            Dict[str, ShopUnitDatabase],
+            Dict[str, List[ShopUnitDatabase]],
+            Dict[str, Optional[int]]]:
+        """
+        Загрузка данных для ответа /nodes/batch: найденные элементы из ids,
+        общий индекс parentId -> дочерние элементы и цены категорий.
+        Поддеревья загружаются одним запросом и только для категорий,
+        не входящих в поддеревья других запрошенных категорий.
+        """
+        
+        roots = self.get_latest_records_shop_units(list(dict.fromkeys(ids)))
+        
+        categories_ids = [id for id, root in roots.items() if root.type == "CATEGORY"]
+        ancestors = self.get_ancestors(categories_ids) if len(categories_ids) > 1 else dict()
+        requested = set(categories_ids)
+        top_ids = [id for id in categories_ids if requested.isdisjoint(ancestors.get(id, []))]
+        
+        childrens = {id: [] for id in top_ids}
+        if len(top_ids) > 0:
+            for unit in self.get_subtree_records(top_ids):
+                if unit.type == "CATEGORY":
+                    childrens.setdefault(unit.id, [])
+                childrens.setdefault(unit.parentId, []).append(unit)
+                
+        prices = self.get_categories_prices(list(childrens))
+        
+        return roots, childrens, prices
+        
+    def load_info_at(self, id: str, at: str) -> Tuple[
+            ShopUnitDatabase,
+            Dict[str, List[ShopUnitDatabase]],
+            Dict[str, Optional[int]]]:
+        """
+        Загрузка данных для ответа /nodes/{id} на момент at (включительно):
+        корень, индекс parentId -> дочерние элементы и цены категорий по истории.
+        Состояние всех элементов, когда-либо входивших в поддерево (по бывшим предкам,
+        замкнутым по истории), считывается одним запросом по индексу истории (id, updateDate).
+        Дочерние элементы идут в порядке появления в истории.
+        """
+        
+        at_datetime = datetime.datetime.fromisoformat(at)
+        # Даты в MongoDB хранятся с точностью до миллисекунд
+        end_date = (
+            at_datetime.replace(microsecond=at_datetime.microsecond // 1000 * 1000)
+            + datetime.timedelta(milliseconds=1))
+        records = self.get_records_at([id] + list(self.get_former_descendants_ids([id])), end_date)
+        
+        units = {record.id: record for record in records}
+        if id not in units:
+            raise ValueError(f"Unit with id {id} missing in db at {at}")
+        root = units[id]
+        
+        childrens = dict()
+        for record in records:
+            if record.type == "CATEGORY":
+                childrens.setdefault(record.id, [])
+            if record.id != id and record.parentId in units:
+                childrens.setdefault(record.parentId, []).append(record)
+                
+        # Цены категорий поддерева: обход в глубину с суммированием товаров
+        totals = dict()
+        stack = [(root, False)]
+        while len(stack) > 0:
+            unit, visited = stack.pop()
+            if unit.type != "CATEGORY":
+                continue
+            if not visited:
+                stack.append((unit, True))
+                stack.extend((child, False) for child in childrens[unit.id])
+                continue
+            price, count = 0, 0
+            for child in childrens[unit.id]:
+                if child.type == "CATEGORY":
+                    price += totals[child.id][0]
+                    count += totals[child.id][1]
+                else:
+                    price += child.price
+                    count += 1
+            totals[unit.id] = (price, count)
+            
+        prices = {
+            category_id: math.floor(price/count) if count > 0 else None
+            for category_id, (price, count) in totals.items()}
+            
+        return root, childrens, prices
+        
+    def load_info_page(
+            self,
+            id: str,
+            depth: Optional[int] = None,
+            children_limit: Optional[int] = None,
+            cursor: Optional[str] = None) -> Tuple[
+                ShopUnitDatabase,
+                Dict[str, List[ShopUnitDatabase]],
+                Dict[str, Optional[int]],
+                Dict[str, int],
+                Optional[str]]:
+        """
+        Загрузка части поддерева для ответа /nodes/{id}: не глубже depth уровней,
+        не более children_limit дочерних элементов у каждой категории,
+        дочерние элементы корня - после элемента cursor.
+        Загрузка идет по уровням, число запросов ограничено размером ответа.
+        Возвращает корень, индекс parentId -> дочерние элементы (только для раскрытых категорий),
+        цены и количество дочерних элементов всех категорий ответа
+        и курсор следующей страницы дочерних элементов корня (или None).
+        """
+        
+        root = self.get_latest_record_shop_unit(id)
+        
+        childrens = dict()
+        next_cursor = None
+        
+        if root.type == "CATEGORY" and (depth is None or depth > 0):
+            # Запрашиваем на один элемент больше, чтобы узнать, есть ли следующая страница
+            limit = children_limit + 1 if children_limit is not None else None
+            
+            page = self.get_childrens([id], limit, cursor).get(id, [])
+            if children_limit is not None and len(page) > children_limit:
+                page = page[:children_limit]
+                next_cursor = page[-1].id
+            childrens[id] = page
+            
+            level = [unit.id for unit in page if unit.type == "CATEGORY"]
+            level_depth = 1
+            while len(level) > 0 and (depth is None or level_depth < depth):
+                pages = self.get_childrens(level, children_limit)
+                next_level = []
+                for parent_id in level:
+                    childrens[parent_id] = pages.get(parent_id, [])
+                    next_level.extend(unit.id for unit in childrens[parent_id] if unit.type == "CATEGORY")
+                level = next_level
+                level_depth += 1
+                
+        categories_ids = [
+            unit.id for unit in itertools.chain([root], *childrens.values())
+            if unit.type == "CATEGORY"]
+            
+        prices = self.get_categories_prices(categories_ids)
+        counts = self.count_childrens(categories_ids)
+        
+        return root, childrens, prices, counts, next_cursor
+        
+    def get_info(self, id: str) -> ShopUnit:
+        """Получение информации о товаре/категории"""
+        
+        root, childrens, prices = self.load_info(id)
+        
+        def build_shop_unit(shop_unit_database: ShopUnitDatabase) -> ShopUnit:
+            shop_unit_database_dict = shop_unit_database.__dict__
+            # Преобразуем дату
+            iso_date = shop_unit_database_dict["updateDate"].isoformat() + ".000Z"
+            del shop_unit_database_dict["updateDate"]
+            
+            shop_unit = ShopUnit(
+                **shop_unit_database_dict,
+                date=iso_date)
+                
+            if shop_unit.type == "CATEGORY":
+                shop_unit.children = [
+                    build_shop_unit(child) for child in childrens[shop_unit.id]]
+                shop_unit.price = prices[shop_unit.id]
+                
+            return shop_unit
+            
+        return build_shop_unit(root)
+        
+    def get_statistic(self, id: str, start_date: str, end_date: str) -> ShopUnitStatisticResponse:
+        """
+        Получение статистики товара/категории за определенный промежуток времени.
+        История всех элементов, когда-либо входивших в поддерево, загружается один раз
+        и проигрывается по времени с пересчетом агрегатов категорий.
+        Точка статистики добавляется на каждую дату обновления элементов поддерева.
+        """
+        
+        start_datetime = datetime.datetime.fromisoformat(start_date)
+        end_datetime = datetime.datetime.fromisoformat(end_date)
+        
+        # Элементы, когда-либо входившие в поддерево
+        ids = self.get_former_descendants_ids([id])
+        ids.add(id)
+        
+        records = self.get_history_records(list(ids), end_datetime)
+        
+        if all(record.id != id for record in records):
+            raise ValueError(f"Unit with id {id} missing in db")
+            
+        # Удаление категорий переписывает историю и может оставить в ней циклы
+        tree = TreeAggregates(dict(), dict(), check_cycles=False)
+        # Запись элемента на момент текущего события
+        shop_unit_database = None
+        
+        items = []
+        for date, group in itertools.groupby(records, key=lambda record: record.updateDate):
+            group = list(group)
+            
+            # Событие относится к поддереву, если элемент был в нем до или после обновления
+            is_updated = any(tree.is_in_subtree(record.id, id) for record in group)
+            for record in group:
+                tree.apply(record)
+                if record.id == id:
+                    shop_unit_database = record
+            is_updated = is_updated or any(tree.is_in_subtree(record.id, id) for record in group)
+            
+            if not is_updated or shop_unit_database is None or date < start_datetime:
+                continue
+                
+            shop_unit_statistic_unit = ShopUnitStatisticUnit(
+                id=shop_unit_database.id,
+                name=shop_unit_database.name,
+                parentId=shop_unit_database.parentId,
+                type=shop_unit_database.type,
+                price=shop_unit_database.price,
+                date=date.isoformat() + ".000Z")
+                
+            if shop_unit_database.type == "CATEGORY":
+                price, count = tree.get_contribution(id)
+                if count > 0:
+                    shop_unit_statistic_unit.price = math.floor(price/count)
+                    
+            items.append(shop_unit_statistic_unit)
+            
+        shop_unit_statistic_response = ShopUnitStatisticResponse(items=items)
+        
+        return shop_unit_statistic_response
+        
+    def get_statistic_buckets(
+            self,
+            id: str,
+            start_date: str,
+            end_date: str,
+            granularity: str) -> ShopUnitStatisticBucketResponse:
+        """
+        Статистика товара/категории по корзинам granularity, пересекающим [start_date, end_date).
+        Для категории читаются сводки цен (по документу на корзину),
+        для товара корзины собираются по его истории.
+        Цена корзины - на последнюю точку статистики в ней, minPrice и maxPrice - наименьшая
+        и наибольшая цена товаров, обновленных в корзине (для категории - товаров поддерева).
+        """
+        
+        shop_unit_database = self.get_latest_record_shop_unit(id)
+        
+        start = get_bucket_start(datetime.datetime.fromisoformat(start_date), granularity)
+        end = datetime.datetime.fromisoformat(end_date)
+        
+        if shop_unit_database.type == "CATEGORY":
+            rollups = self.get_price_rollups([id], start, end, granularity)
+        else:
+            # История до конца корзины, в которую попадает end_date
+            records = self.get_history_records(
+                [id], get_bucket_start(end, granularity) + STATISTIC_GRANULARITIES[granularity])
+            rollups = [
+                rollup for rollup in collect_price_rollups(
+                    PricePoint(record.id, record.updateDate, record.price, 1, 1, [record.price])
+                    for record in records).values()
+                if rollup.granularity == granularity and start <= rollup.bucket < end]
+                
+        items = [
+            ShopUnitStatisticBucket(
+                id=shop_unit_database.id,
+                name=shop_unit_database.name,
+                parentId=shop_unit_database.parentId,
+                type=shop_unit_database.type,
+                price=rollup.price,
+                minPrice=rollup.min,
+                maxPrice=rollup.max,
+                date=rollup.bucket.isoformat() + ".000Z")
+            for rollup in rollups]
+            
+        return ShopUnitStatisticBucketResponse(items=items)
+        
+    def get_sales(self, date: str) -> Iterable[dict]:
+        """
+        Функция для получения обновленных товаров за сутки от date.
+        Выбор последней версии каждого товара выполняется в хранилище,
+        результат читается по мере отправки ответа.
+        """
+        
+        _datetime = datetime.datetime.fromisoformat(date)
+        start_date = _datetime - datetime.timedelta(days=1)
+        end_date = _datetime
+        
+        return self.get_latest_updated_offers(start_date, end_date)
+
+
+def create_driver() -> StorageDriver:
+    """
+    Создание хранилища по настройке STORAGE_BACKEND
+    (переменная окружения или /src/.env): "mongo" или "memory".
+    """
+    
+    config = dotenv_values("/src/.env")
+    
+    backend = os.environ.get("STORAGE_BACKEND", config.get("STORAGE_BACKEND", "mongo"))
+    
+    if backend == "mongo":
+        from .database import DatabaseDriver
+        return DatabaseDriver()
+    if backend == "memory":
+        from .memory import MemoryDriver
+        return MemoryDriver()
+        
+    raise ValueError(f"Unknown storage backend {backend}")
@@ -0,0 +1,109 @@
+import json
+
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from fastapi.responses import StreamingResponse
+
+from .storage import ShopUnitDatabase
+
+# Минимальный размер части потокового ответа в символах
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def dumps(value) -> str:
+    """Кодирование JSON так же, как в JSONResponse"""
+    return json.dumps(value, ensure_ascii=False, allow_nan=False, separators=(",", ":"))
+    
+def iterate_json_items(items: Iterable[dict]) -> Iterator[bytes]:
+    """Кодирование {"items": [...]} по частям - по одному элементу за раз"""
+    
+    yield b'{"items":['
+    separator = b""
+    for item in items:
+        yield separator + dumps(item).encode("utf-8")
+        separator = b","
+    yield b"]}"
+    
+def items_response(items: Iterable[dict]) -> StreamingResponse:
+    """
+    Потоковый JSON-ответ со списком items.
+    Синхронный итератор (например, курсор MongoDB) читается в пуле потоков.
+    """
+    
+    return StreamingResponse(iterate_json_items(items), media_type="application/json")
+    
+def iterate_json_tree(
+        root: ShopUnitDatabase,
+        childrens: Dict[str, List[ShopUnitDatabase]],
+        prices: Dict[str, Optional[int]],
+        counts: Optional[Dict[str, int]] = None,
+        chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Кодирование дерева ShopUnit обходом в глубину без построения вложенных моделей.
+    Результат совпадает побайтно с JSONResponse(ShopUnit), размер части - от chunk_size символов.
+    Если заданы counts (частичное дерево), категории получают поле childrenCount,
+    а у категорий, отсутствующих в childrens, children равно null.
+    """
+    
+    parts = []
+    size = 0
+    # Стек открытых списков: [итератор по элементам, записан ли уже элемент]
+    stack = [[iter([root]), False]]
+    
+    while len(stack) > 0:
+        unit = next(stack[-1][0], None)
+        
+        if unit is None:
+            stack.pop()
+            # Корень закрывается без "]}" - у него нет открытого списка
+            part = "]}" if len(stack) > 0 else ""
+        else:
+            # Запятая перед всеми элементами списка, кроме первого
+            separator = "," if stack[-1][1] else ""
+            stack[-1][1] = True
+            part = separator + dumps({
+                "id": unit.id,
+                "name": unit.name,
+                "date": unit.updateDate.isoformat() + ".000Z",
+                "parentId": unit.parentId,
+                "type": unit.type,
+                "price": prices[unit.id] if unit.type == "CATEGORY" else unit.price})[:-1]
+            if unit.type == "CATEGORY" and counts is not None:
+                part += f',"childrenCount":{counts.get(unit.id, 0)}'
+            if unit.type == "CATEGORY" and unit.id in childrens:
+                part += ',"children":['
+                stack.append([iter(childrens[unit.id]), False])
+            else:
+                part += ',"children":null}'
+                
+        parts.append(part)
+        size += len(part)
+        if size >= chunk_size:
+            yield "".join(parts).encode("utf-8")
+            parts = []
+            size = 0
+            
+    yield "".join(parts).encode("utf-8")
+    
+def iterate_json_nodes(
+        ids: List[str],
+        roots: Dict[str, ShopUnitDatabase],
+        childrens: Dict[str, List[ShopUnitDatabase]],
+        prices: Dict[str, Optional[int]],
+        chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Кодирование ответа /nodes/batch: {"items": [...]} с элементом на каждый id из ids -
+    {"id": ..., "node": ShopUnit} или {"id": ..., "error": Error} для отсутствующих элементов.
+    """
+    
+    yield b'{"items":['
+    separator = b""
+    for id in ids:
+        if id in roots:
+            yield separator + b'{"id":' + dumps(id).encode("utf-8") + b',"node":'
+            yield from iterate_json_tree(roots[id], childrens, prices, chunk_size=chunk_size)
+            yield b"}"
+        else:
+            yield separator + dumps({"id": id, "error": {"code": 404, "message": "Item not found"}}).encode("utf-8")
+        separator = b","
+    yield b"]}"
@@ -0,0 +1,94 @@
+import asyncio
+import os
+
+from typing import List, Optional, Tuple
+
+from dotenv import dotenv_values
+
+from .async_database import AsyncDatabaseDriver
+from .storage import ShopUnitDatabase
+
+# Время (мс), в течение которого импорты собираются в группу перед записью
+IMPORT_QUEUE_WINDOW_MS = 5
+
+
+class ImportQueue:
+    """
+    Очередь записи импортов с групповой фиксацией.
+    Импорты, пришедшие в течение window секунд (а также пока записывается
+    предыдущая группа), проверяются и записываются вместе через
+    StorageDriver.import_batches - в порядке поступления и с ошибкой
+    на каждый импорт отдельно. Каждый вызов submit завершается после записи своей группы.
+    Очередь работает в event loop сервера.
+    """
+    
+    def __init__(self, database: AsyncDatabaseDriver, window: float = IMPORT_QUEUE_WINDOW_MS / 1000) -> None:
+        """Инициализация пустой очереди"""
+        
+        self.window = window
+        self.groups = 0
+        self.imports = 0
+        self._database = database
+        self._pending: List[Tuple[List[ShopUnitDatabase], asyncio.Future]] = []
+        self._writer: Optional[asyncio.Task] = None
+        
+    async def submit(self, shop_units: List[ShopUnitDatabase]) -> None:
+        """
+        Проверка и запись импорта (элементы с уникальными id) в составе группы.
+        ValueError - импорт не прошел проверку и не записан.
+        """
+        
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((shop_units, future))
+        if self._writer is None:
+            self._writer = asyncio.ensure_future(self._write_pending())
+            
+        error = await future
+        if error is not None:
+            raise ValueError(error)
+            
+    async def _write_pending(self) -> None:
+        """Запись групп, пока очередь не опустеет"""
+        
+        group = []
+        try:
+            if self.window > 0:
+                await asyncio.sleep(self.window)
+                
+            # Импорты, пришедшие во время записи группы, образуют следующую группу
+            while len(self._pending) > 0:
+                group, self._pending = self._pending, []
+                try:
+                    errors = await self._database.import_batches([shop_units for shop_units, _ in group])
+                except Exception as e:
+                    for _, future in group:
+                        if not future.done():
+                            future.set_exception(e)
+                else:
+                    for (_, future), error in zip(group, errors):
+                        if not future.done():
+                            future.set_result(error)
+                self.groups += 1
+                self.imports += len(group)
+        finally:
+            # При отмене записи ожидающие импорты завершаются ошибкой
+            self._writer = None
+            for _, future in group + self._pending:
+                if not future.done():
+                    future.set_exception(RuntimeError("Import queue stopped"))
+            self._pending = []
+
+
+def create_import_queue(database: AsyncDatabaseDriver) -> ImportQueue:
+    """
+    Создание очереди импортов по настройке IMPORT_QUEUE_WINDOW_MS
+    (переменная окружения или /src/.env; 0 - без ожидания,
+    в группу попадают только импорты, пришедшие во время записи предыдущей).
+    """
+    
+    config = dotenv_values("/src/.env")
+    
+    window = float(os.environ.get(
+        "IMPORT_QUEUE_WINDOW_MS", config.get("IMPORT_QUEUE_WINDOW_MS", IMPORT_QUEUE_WINDOW_MS)))
+        
+    return ImportQueue(database, window / 1000)
@@ -0,0 +1,122 @@
+import datetime
+import random
+import uuid
+
+from typing import Dict, List, NamedTuple
+
+# Дата первого импорта синтетического каталога
+START_DATE = datetime.datetime(2022, 2, 1, 12, 0, 0)
+
+
+class CatalogShape(NamedTuple):
+    """
+    Форма синтетического каталога:
+    depth - число уровней категорий, fan_out - подкатегорий у каждой категории,
+    offers - товаров в каталоге (распределяются по категориям нижнего уровня),
+    updates - число импортов с обновлением цен после первичной загрузки,
+    updated_offers - доля товаров, обновляемых в каждом таком импорте.
+    """
+    
+    name: str
+    depth: int
+    fan_out: int
+    offers: int
+    updates: int
+    updated_offers: float = 0.1
+
+
+# Формы каталогов для набора бенчмарков по умолчанию
+SHAPES = {
+    shape.name: shape for shape in [
+        CatalogShape("small", depth=2, fan_out=3, offers=50, updates=5),
+        CatalogShape("wide", depth=1, fan_out=50, offers=500, updates=5),
+        CatalogShape("deep", depth=8, fan_out=1, offers=200, updates=5),
+        CatalogShape("long_history", depth=2, fan_out=4, offers=100, updates=50),
+        CatalogShape("large", depth=3, fan_out=6, offers=2000, updates=10),
+    ]}
+
+
+class Catalog(NamedTuple):
+    """
+    Синтетический каталог: запросы импорта в порядке отправки
+    и ids элементов для запросов чтения и удаления.
+    """
+    
+    shape: CatalogShape
+    imports: List[dict]
+    root_id: str
+    categories_ids: List[List[str]]
+    offers_ids: List[str]
+    
+    @property
+    def first_date(self) -> datetime.datetime:
+        return START_DATE
+        
+    @property
+    def last_date(self) -> datetime.datetime:
+        return START_DATE + datetime.timedelta(hours=self.shape.updates)
+
+
+def format_date(date: datetime.datetime) -> str:
+    """Дата в формате запросов API"""
+    
+    return date.isoformat(timespec="milliseconds") + "Z"
+
+
+def generate_catalog(shape: CatalogShape, seed: int = 0) -> Catalog:
+    """
+    Генерация каталога формы shape.
+    Первый импорт содержит все дерево, каждый следующий (через час после предыдущего)
+    меняет цены случайной доли товаров. При одинаковом seed каталог тот же.
+    """
+    
+    rng = random.Random(seed)
+    
+    def new_id() -> str:
+        return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+        
+    root_id = new_id()
+    items = [{"id": root_id, "name": "Каталог", "parentId": None, "type": "CATEGORY", "price": None}]
+    
+    # Категории по уровням: categories_ids[0] - корень
+    categories_ids = [[root_id]]
+    for level in range(shape.depth):
+        level_ids = []
+        for parent_id in categories_ids[-1]:
+            for _ in range(shape.fan_out):
+                id = new_id()
+                items.append({
+                    "id": id,
+                    "name": f"Категория {level + 1}.{len(level_ids)}",
+                    "parentId": parent_id,
+                    "type": "CATEGORY",
+                    "price": None})
+                level_ids.append(id)
+        categories_ids.append(level_ids)
+        
+    offers: Dict[str, dict] = dict()
+    leaves = categories_ids[-1]
+    for number in range(shape.offers):
+        id = new_id()
+        offers[id] = {
+            "id": id,
+            "name": f"Товар {number}",
+            "parentId": leaves[number % len(leaves)],
+            "type": "OFFER",
+            "price": rng.randint(1, 100000)}
+    items.extend(offers.values())
+    
+    imports = [{"items": items, "updateDate": format_date(START_DATE)}]
+    
+    offers_ids = list(offers)
+    count = max(1, int(len(offers_ids) * shape.updated_offers)) if len(offers_ids) > 0 else 0
+    for update in range(1, shape.updates + 1):
+        updated = []
+        for id in rng.sample(offers_ids, count):
+            offers[id] = dict(offers[id], price=rng.randint(1, 100000))
+            updated.append(offers[id])
+        imports.append({
+            "items": updated,
+            "updateDate": format_date(START_DATE + datetime.timedelta(hours=update))})
+            
+    return Catalog(shape, imports, root_id, categories_ids, offers_ids)
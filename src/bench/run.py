@@ -0,0 +1,234 @@
+import argparse
+import datetime
+import json
+import math
+import platform
+import statistics
+import subprocess
+import time
+
+from typing import Callable, Dict, List, Optional
+from unittest import mock
+
+from app.datatypes import ShopUnitImportRequest
+from app.parsers import parse_shop_unit_import_request
+from app.storage import StorageDriver
+from app.streaming import iterate_json_tree
+
+from .catalog import SHAPES, Catalog, CatalogShape, format_date, generate_catalog
+
+# Хранилища, на которых запускаются бенчмарки
+BACKENDS = ["mongomock", "memory", "mongo"]
+
+
+def create_bench_driver(backend: str) -> StorageDriver:
+    """
+    Создание хранилища для бенчмарков:
+    mongomock - DatabaseDriver поверх MongoDB в памяти процесса (пакет mongomock),
+    memory - MemoryDriver, mongo - DatabaseDriver с MongoDB из docker-compose
+    (тестовые коллекции очищаются).
+    """
+    
+    if backend == "memory":
+        from app.memory import MemoryDriver
+        return MemoryDriver()
+        
+    from app.database import DatabaseDriver
+    if backend == "mongo":
+        return DatabaseDriver()
+    if backend == "mongomock":
+        import mongomock
+        with mock.patch("pymongo.MongoClient", mongomock.MongoClient):
+            return DatabaseDriver()
+            
+    raise ValueError(f"Unknown storage backend {backend}")
+
+
+def summarize(timings: List[float]) -> Dict[str, float]:
+    """Статистика времен выполнения операции (в миллисекундах)"""
+    
+    timings = sorted(timing * 1000 for timing in timings)
+    return {
+        "count": len(timings),
+        "min_ms": timings[0],
+        "median_ms": statistics.median(timings),
+        "p95_ms": timings[min(len(timings) - 1, math.ceil(len(timings) * 0.95) - 1)],
+        "max_ms": timings[-1],
+        "total_ms": sum(timings)}
+
+
+def measure(function: Callable[[], object], repeat: int) -> List[float]:
+    """Времена repeat запусков function (результат итерируемых ответов читается полностью)"""
+    
+    timings = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        result = function()
+        if isinstance(result, (list, tuple)) or hasattr(result, "__next__"):
+            for _ in result:
+                pass
+        timings.append(time.perf_counter() - start_time)
+        
+    return timings
+
+
+def import_catalog(database: StorageDriver, request: dict) -> float:
+    """
+    Импорт запроса так же, как в POST /imports (проверка и запись через import_batches).
+    Возвращает время проверки и записи (разбор запроса не учитывается).
+    """
+    
+    parsed_input = parse_shop_unit_import_request(ShopUnitImportRequest(**request))
+    
+    errors = []
+    timing = measure(lambda: errors.extend(database.import_batches([parsed_input])), 1)[0]
+    if errors != [None]:
+        raise ValueError(f"Import failed: {errors[0]}")
+        
+    return timing
+
+
+def run_shape(database: StorageDriver, catalog: Catalog, repeat: int) -> Dict[str, Dict[str, float]]:
+    """
+    Бенчмарки операций хранилища на каталоге в том виде, в каком их выполняют обработчики API:
+    импорт (import_batches), чтение дерева (load_info и кодирование ответа iterate_json_tree),
+    get_sales, get_statistic, delete_by_id.
+    Удаления выполняются последними и опустошают каталог.
+    """
+    
+    results = dict()
+    database.clear_collection()
+    
+    # Импорт: первичная загрузка и обновления цен
+    for stage, requests in [("initial", catalog.imports[:1]), ("update", catalog.imports[1:])]:
+        if len(requests) > 0:
+            results[f"import_batches.{stage}"] = summarize([import_catalog(database, request) for request in requests])
+            
+    leaf_id = catalog.categories_ids[-1][0]
+    offer_id = catalog.offers_ids[0] if len(catalog.offers_ids) > 0 else None
+    
+    # Чтение дерева (как GET /nodes/{id}): весь каталог, категория нижнего уровня, товар
+    def read_nodes(id: str):
+        return iterate_json_tree(*database.load_info(id))
+        
+    results["nodes.root"] = summarize(measure(lambda: read_nodes(catalog.root_id), repeat))
+    results["nodes.leaf_category"] = summarize(measure(lambda: read_nodes(leaf_id), repeat))
+    if offer_id is not None:
+        results["nodes.offer"] = summarize(measure(lambda: read_nodes(offer_id), repeat))
+        
+    sales_date = format_date(catalog.last_date)[:-1]
+    results["get_sales"] = summarize(measure(lambda: database.get_sales(sales_date), repeat))
+    
+    # Статистика за всю историю каталога
+    start_date = format_date(catalog.first_date)[:-1]
+    end_date = format_date(catalog.last_date + datetime.timedelta(seconds=1))[:-1]
+    results["get_statistic.root"] = summarize(measure(
+        lambda: database.get_statistic(catalog.root_id, start_date, end_date), repeat))
+    if offer_id is not None:
+        results["get_statistic.offer"] = summarize(measure(
+            lambda: database.get_statistic(offer_id, start_date, end_date), repeat))
+            
+    # Удаление: товары, категории нижнего уровня (с товарами), весь каталог
+    deleted_offers = catalog.offers_ids[:repeat]
+    if len(deleted_offers) > 0:
+        results["delete_by_id.offer"] = summarize(
+            [measure(lambda: database.delete_by_id(id), 1)[0] for id in deleted_offers])
+    if catalog.shape.depth > 0:
+        deleted_categories = catalog.categories_ids[-1][:repeat]
+        results["delete_by_id.leaf_category"] = summarize(
+            [measure(lambda: database.delete_by_id(id), 1)[0] for id in deleted_categories])
+    results["delete_by_id.root"] = summarize(measure(lambda: database.delete_by_id(catalog.root_id), 1))
+    
+    return results
+
+
+def get_commit() -> Optional[str]:
+    """Текущий коммит git (если запуск из репозитория)"""
+    
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(backend: str, shapes: List[CatalogShape], repeat: int = 5, seed: int = 0) -> dict:
+    """Запуск бенчмарков на каталогах shapes, результат - словарь для сохранения в JSON"""
+    
+    database = create_bench_driver(backend)
+    
+    results = dict()
+    for shape in shapes:
+        results[shape.name] = {
+            "shape": shape._asdict(),
+            "operations": run_shape(database, generate_catalog(shape, seed), repeat)}
+            
+    database.clear_collection()
+    
+    return {
+        "commit": get_commit(),
+        "backend": backend,
+        "python": platform.python_version(),
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "repeat": repeat,
+        "seed": seed,
+        "shapes": results}
+
+
+def compare(results: dict, baseline: dict) -> List[str]:
+    """Сравнение медиан операций с результатами другого запуска"""
+    
+    lines = []
+    for shape_name, shape_results in results["shapes"].items():
+        baseline_operations = baseline["shapes"].get(shape_name, dict()).get("operations", dict())
+        for operation, summary in shape_results["operations"].items():
+            if operation not in baseline_operations:
+                continue
+            old = baseline_operations[operation]["median_ms"]
+            new = summary["median_ms"]
+            ratio = new / old if old > 0 else float("inf")
+            lines.append(f"{shape_name:<14} {operation:<52} {old:>10.2f} {new:>10.2f} {ratio:>7.2f}x")
+            
+    return lines
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Бенчмарки операций хранилища на синтетических каталогах")
+    parser.add_argument("--backend", choices=BACKENDS, default="mongomock")
+    parser.add_argument("--shape", action="append", choices=list(SHAPES),
+        help="каталоги из набора (по умолчанию - все)")
+    parser.add_argument("--depth", type=int, help="свой каталог: число уровней категорий")
+    parser.add_argument("--fan-out", type=int, default=2)
+    parser.add_argument("--offers", type=int, default=100)
+    parser.add_argument("--updates", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", help="JSON предыдущего запуска для сравнения медиан")
+    args = parser.parse_args(argv)
+    
+    if args.depth is not None:
+        shapes = [CatalogShape("custom", args.depth, args.fan_out, args.offers, args.updates)]
+    else:
+        shapes = [SHAPES[name] for name in (args.shape or SHAPES)]
+        
+    results = run(args.backend, shapes, args.repeat, args.seed)
+    
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=2, ensure_ascii=False)
+        
+    for shape_name, shape_results in results["shapes"].items():
+        for operation, summary in shape_results["operations"].items():
+            print(f"{shape_name:<14} {operation:<52} {summary['median_ms']:>10.2f} ms")
+            
+    if args.compare is not None:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        print(f"\n{'shape':<14} {'operation':<52} {'old, ms':>10} {'new, ms':>10} {'ratio':>8}")
+        for line in compare(results, baseline):
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
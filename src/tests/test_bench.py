@@ -0,0 +1,29 @@
+from bench.catalog import CatalogShape, generate_catalog
+from bench.run import run
+
+
+def test_generate_catalog():
+    """Каталог заданной формы, одинаковый при одинаковом seed"""
+    
+    shape = CatalogShape("test", depth=2, fan_out=3, offers=20, updates=4, updated_offers=0.25)
+    catalog = generate_catalog(shape, seed=1)
+    
+    assert catalog == generate_catalog(shape, seed=1)
+    assert [len(level) for level in catalog.categories_ids] == [1, 3, 9]
+    assert len(catalog.offers_ids) == 20
+    assert len(catalog.imports) == 5
+    assert len(catalog.imports[0]["items"]) == 1 + 3 + 9 + 20
+    assert all(len(request["items"]) == 5 for request in catalog.imports[1:])
+    
+def test_run_memory():
+    """Бенчмарки проходят все операции на хранилище в памяти"""
+    
+    shape = CatalogShape("test", depth=2, fan_out=2, offers=10, updates=2)
+    results = run("memory", [shape], repeat=2)
+    
+    operations = results["shapes"]["test"]["operations"]
+    for operation in [
+            "import_batches.initial", "import_batches.update",
+            "nodes.root", "get_sales", "get_statistic.root", "delete_by_id.root"]:
+        assert operations[operation]["count"] >= 1
+    assert operations["nodes.root"]["count"] == 2
@@ -0,0 +1,47 @@
+from app.cache import ResponseCache
+
+
+def test_lru_eviction():
+    """Вытесняются давно не читавшиеся ответы при превышении числа записей или размера"""
+    
+    cache = ResponseCache(max_entries=2, max_bytes=10)
+    cache.put("a", 1, b"aaa")
+    cache.put("b", 1, b"bbb")
+    assert cache.get("a", 1) == b"aaa"
+    
+    cache.put("c", 1, b"ccc")
+    assert cache.get("b", 1) is None
+    assert cache.get("a", 1) == b"aaa"
+    
+    cache.put("d", 1, b"dddddddd")
+    assert cache.get("a", 1) is None
+    assert cache.get("c", 1) is None
+    assert cache.stats()["evictions"] == 3
+    assert cache.stats()["bytes"] == 8
+    
+def test_version_and_invalidate():
+    """Ответ отдается только для своей версии, сбрасываются только указанные ключи"""
+    
+    cache = ResponseCache()
+    cache.put("a", 1, b"a")
+    cache.put("b", 1, b"b")
+    assert cache.get("a", 2) is None
+    
+    cache.invalidate({"a", "c"})
+    assert cache.get("a", 1) is None
+    assert cache.get("b", 1) == b"b"
+    
+    cache.invalidate()
+    assert cache.get("b", 1) is None
+    assert cache.stats()["invalidations"] == 2
+    
+def test_iterate_and_put():
+    """Ответ сохраняется после передачи всех частей"""
+    
+    cache = ResponseCache()
+    chunks = cache.iterate_and_put("a", 1, iter([b"{", b"}"]))
+    assert cache.get("a", 1) is None
+    assert b"".join(chunks) == b"{}"
+    assert cache.get("a", 1) == b"{}"
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
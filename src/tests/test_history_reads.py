@@ -0,0 +1,186 @@
+import datetime
+import math
+import random
+import uuid
+
+from app.main import database
+from app.storage import ShopUnitDatabase
+
+first_date = datetime.datetime(2022, 2, 1)
+
+
+def replay(history, end_date):
+    """Состояние элементов (parentId, type, price) по записям истории до end_date (не включительно)"""
+    
+    units = dict()
+    for record in history:
+        if record.updateDate < end_date:
+            units[record.id] = (record.parentId, record.type, record.price)
+    return units
+    
+def is_in_subtree(units, id, root_id):
+    """Элемент id в поддереве root_id (включая сам root_id)"""
+    
+    while id in units:
+        if id == root_id:
+            return True
+        id = units[id][0]
+    return False
+    
+def get_price(units, id):
+    """Цена элемента: у категории - среднее товаров поддерева"""
+    
+    if units[id][1] == "OFFER":
+        return units[id][2]
+    prices = [
+        unit[2] for unit_id, unit in units.items()
+        if unit[1] == "OFFER" and is_in_subtree(units, unit_id, id)]
+    return math.floor(sum(prices)/len(prices)) if len(prices) > 0 else None
+    
+def has_cycle(history):
+    """Есть ли цикл в дереве на дату какой-либо записи истории"""
+    
+    for date in {record.updateDate for record in history}:
+        units = replay(history, date + datetime.timedelta(seconds=1))
+        for id in units:
+            visited = set()
+            while id in units and id not in visited:
+                visited.add(id)
+                id = units[id][0]
+            if id in visited:
+                return True
+    return False
+    
+def expected_statistic(history, id):
+    """Статистика элемента за все время простым проигрыванием истории"""
+    
+    items = []
+    units = dict()
+    dates = sorted({record.updateDate for record in history})
+    for date in dates:
+        group = [record for record in history if record.updateDate == date]
+        before = dict(units)
+        units = replay(history, date + datetime.timedelta(seconds=1))
+        if id not in units:
+            continue
+        if any(is_in_subtree(before, record.id, id) or is_in_subtree(units, record.id, id) for record in group):
+            items.append((date, get_price(units, id)))
+    return items
+    
+def expected_at(history, id, at):
+    """Элементы поддерева и цены категорий на момент at простым проигрыванием истории"""
+    
+    units = replay(history, at + datetime.timedelta(seconds=1))
+    subtree = {unit_id for unit_id in units if is_in_subtree(units, unit_id, id)}
+    return subtree, {unit_id: get_price(units, unit_id) for unit_id in subtree if units[unit_id][1] == "CATEGORY"}
+    
+def check_reads(history, rng):
+    """get_statistic и load_info_at совпадают с простым проигрыванием истории"""
+    
+    units = replay(history, datetime.datetime.max)
+    start_date = min(record.updateDate for record in history)
+    end_date = max(record.updateDate for record in history) + datetime.timedelta(hours=1)
+    for id in rng.sample(sorted(units), min(len(units), 6)):
+        statistic = database.get_statistic(id, start_date.isoformat(), end_date.isoformat())
+        items = [
+            (datetime.datetime.fromisoformat(item.date[:-5]), item.price) for item in statistic.items]
+        assert items == expected_statistic(history, id), id
+        
+        dates = sorted({record.updateDate for record in history})
+        for at in rng.sample(dates, min(len(dates), 3)):
+            if id not in replay(history, at + datetime.timedelta(seconds=1)):
+                continue
+            root, childrens, prices = database.load_info_at(id, at.isoformat())
+            subtree = {root.id}
+            level = [root.id]
+            while len(level) > 0:
+                level = [child.id for unit_id in level for child in childrens.get(unit_id, [])]
+                subtree.update(level)
+            assert (subtree, {unit_id: prices[unit_id] for unit_id in subtree if unit_id in prices}) == \
+                expected_at(history, id, at), (id, at)
+                
+def make_id(rng):
+    return str(uuid.UUID(int=rng.getrandbits(128)))
+    
+def test_history_reads_match_replay():
+    """
+    Статистика и чтение на момент даты совпадают с проигрыванием всей истории
+    после случайных импортов (в том числе старше истории), переносов категорий и удалений
+    """
+    
+    for seed in range(6):
+        rng = random.Random(seed)
+        database.clear_collection()
+        history = []
+        date = first_date
+        
+        for step in range(60):
+            date += datetime.timedelta(minutes=rng.choice([10, 40, 90]))
+            units = replay(history, datetime.datetime.max)
+            categories = sorted(id for id, unit in units.items() if unit[1] == "CATEGORY")
+            offers = sorted(id for id, unit in units.items() if unit[1] == "OFFER")
+            
+            batch = []
+            if rng.random() < 0.5 and len(categories) > 0:
+                # Импорт старше истории: товары, переносы и цепочки новых категорий
+                update_date = date - datetime.timedelta(minutes=rng.choice([20, 100, 300]))
+                parent_id = rng.choice(categories)
+                for _ in range(rng.randint(1, 3)):
+                    action = rng.random()
+                    if action < 0.2:
+                        id = rng.choice(categories)
+                        batch.append(ShopUnitDatabase(
+                            id=id, name="c", type="CATEGORY",
+                            parentId=parent_id if parent_id != id else None, updateDate=update_date))
+                    elif action < 0.6:
+                        batch.append(ShopUnitDatabase(
+                            id=make_id(rng), name="c", type="CATEGORY", parentId=parent_id, updateDate=update_date))
+                        parent_id = batch[-1].id
+                    else:
+                        id = rng.choice(offers) if len(offers) > 0 and rng.random() < 0.5 else make_id(rng)
+                        batch.append(ShopUnitDatabase(
+                            id=id, name="o", type="OFFER", parentId=parent_id,
+                            price=rng.randint(1, 100), updateDate=update_date))
+            else:
+                for _ in range(rng.randint(1, 3)):
+                    action = rng.random()
+                    if action < 0.3 or len(categories) == 0:
+                        parent_id = rng.choice(categories) if len(categories) > 0 and rng.random() < 0.8 else None
+                        batch.append(ShopUnitDatabase(
+                            id=make_id(rng), name="c", type="CATEGORY", parentId=parent_id, updateDate=date))
+                    elif action < 0.6:
+                        id = rng.choice(offers) if len(offers) > 0 and rng.random() < 0.5 else make_id(rng)
+                        batch.append(ShopUnitDatabase(
+                            id=id, name="o", type="OFFER", parentId=rng.choice(categories),
+                            price=rng.randint(1, 100), updateDate=date))
+                    else:
+                        # Перенос категории
+                        id, parent_id = rng.choice(categories), rng.choice(categories)
+                        batch.append(ShopUnitDatabase(
+                            id=id, name="c", type="CATEGORY",
+                            parentId=parent_id if parent_id != id else None, updateDate=date))
+                            
+            if len({shop_unit.id for shop_unit in batch}) == len(batch):
+                if database.import_batches([batch]) == [None]:
+                    history.extend(batch)
+                    history.sort(key=lambda record: record.updateDate)
+                    # Импорт, образующий цикл на какую-либо дату, отклоняется
+                    assert not has_cycle(history)
+                    
+            if step % 15 == 14:
+                # Удаление, после которого в оставшейся истории нет циклов
+                units = replay(history, datetime.datetime.max)
+                for id in rng.sample(sorted(units), len(units)):
+                    subtree = {unit_id for unit_id in units if is_in_subtree(units, unit_id, id)}
+                    remaining = [
+                        record for record in history
+                        if record.id not in subtree and record.parentId not in subtree]
+                    if not has_cycle(remaining):
+                        database.delete_by_id(id)
+                        history = remaining
+                        break
+                        
+            if step % 10 == 9 and len(history) > 0:
+                check_reads(history, rng)
+                
+    database.clear_collection()
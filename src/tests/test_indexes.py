@@ -0,0 +1,191 @@
+import copy
+import datetime
+
+import pytest
+
+from pymongo import monitoring
+
+from app.main import database
+from app.database import DatabaseDriver
+from app.datatypes import ShopUnitImportRequest
+from app.indexes import HISTORY_INDEXES, ensure_indexes
+from app.parsers import parse_shop_unit_import_request
+from bench.catalog import CatalogShape, format_date, generate_catalog
+
+pytestmark = pytest.mark.skipif(
+    not isinstance(database, DatabaseDriver),
+    reason="Индексы есть только в хранилище MongoDB")
+    
+# Команды, план которых можно получить через explain
+EXPLAINED_COMMANDS = {"find", "aggregate", "distinct", "count", "findAndModify", "update", "delete"}
+
+# Поля команды, относящиеся к сессии и подключению, а не к запросу
+SESSION_FIELDS = {"lsid", "txnNumber", "writeConcern", "readConcern", "autocommit", "startTransaction"}
+
+shape = CatalogShape("indexes", depth=2, fan_out=2, offers=12, updates=2, updated_offers=0.5)
+
+
+class CommandRecorder(monitoring.CommandListener):
+    """Запись команд, отправленных драйвером, пока recording = True"""
+    
+    def __init__(self) -> None:
+        self.recording = False
+        self.commands = []
+        
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        if self.recording and event.command_name in EXPLAINED_COMMANDS:
+            self.commands.append((event.database_name, event.command_name, copy.deepcopy(dict(event.command))))
+            
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        pass
+        
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        pass
+
+
+def run_scenario(driver: DatabaseDriver) -> None:
+    """Запросы API к хранилищу: импорты, перенос, чтения всех видов, удаления"""
+    
+    catalog = generate_catalog(shape)
+    batches = [
+        parse_shop_unit_import_request(ShopUnitImportRequest(**request))
+        for request in catalog.imports]
+    assert driver.import_batches(batches[:1]) == [None]
+    assert driver.import_batches(batches[1:]) == [None] * (len(batches) - 1)
+    
+    # Перенос товара в другую категорию
+    leaves = catalog.categories_ids[-1]
+    moved = dict(catalog.imports[0]["items"][-1], parentId=leaves[0])
+    date = catalog.last_date + datetime.timedelta(hours=1)
+    driver.import_batches([parse_shop_unit_import_request(
+        ShopUnitImportRequest(items=[moved], updateDate=format_date(date)))])
+        
+    root_id = catalog.root_id
+    offer_id = catalog.offers_ids[0]
+    start_date = format_date(catalog.first_date)[:-1]
+    end_date = format_date(date + datetime.timedelta(seconds=1))[:-1]
+    
+    driver.load_info(root_id)
+    driver.load_info(offer_id)
+    driver.load_infos([root_id, offer_id] + leaves)
+    driver.load_info_page(root_id, depth=1, children_limit=2)
+    driver.load_info_page(root_id, children_limit=1000)
+    _, _, _, _, cursor = driver.load_info_page(root_id, depth=1, children_limit=1)
+    driver.load_info_page(root_id, depth=1, children_limit=1, cursor=cursor)
+    driver.load_info_at(root_id, start_date)
+    driver.get_version(root_id)
+    driver.get_statistic(root_id, start_date, end_date)
+    driver.get_statistic(offer_id, start_date, end_date)
+    for granularity in ["hour", "day"]:
+        driver.get_statistic_buckets(root_id, start_date, end_date, granularity)
+        driver.get_statistic_buckets(offer_id, start_date, end_date, granularity)
+    list(driver.get_sales(end_date))
+    
+    driver.delete_by_id(offer_id)
+    driver.delete_by_id(leaves[-1])
+    
+def get_shape(value):
+    """Форма фильтра: поля и операторы без значений (для отбора одинаковых запросов)"""
+    
+    if isinstance(value, dict):
+        return tuple((key, get_shape(item)) for key, item in value.items())
+    if isinstance(value, list):
+        # Стадии конвейера различаются, значения $in - нет
+        documents = all(isinstance(item, dict) for item in value)
+        return tuple(get_shape(item) for item in (value if documents else value[:1]))
+    return type(value).__name__
+    
+def get_explained_commands(commands: list) -> list:
+    """
+    Команды для explain: без полей сессии, пакеты update/delete - по одному оператору
+    (explain принимает один), без запросов с пустым фильтром (очистка коллекций),
+    по одной команде каждой формы.
+    """
+    
+    explained = dict()
+    for database_name, command_name, command in commands:
+        command = {
+            key: value for key, value in command.items()
+            if not key.startswith("$") and key not in SESSION_FIELDS}
+            
+        if command_name in ("update", "delete"):
+            statements_field = "updates" if command_name == "update" else "deletes"
+            statements = command.pop(statements_field)
+            split = [
+                {**command, statements_field: [statement]}
+                for statement in statements if statement["q"] != {}]
+        else:
+            split = [command]
+            
+        for command in split:
+            key = (database_name, command_name, get_shape(command))
+            explained.setdefault(key, (database_name, command_name, command))
+            
+    return list(explained.values())
+    
+def has_collscan(plan) -> bool:
+    """Поиск полного сканирования коллекции в выбранном плане запроса"""
+    
+    if isinstance(plan, dict):
+        if plan.get("stage") == "COLLSCAN":
+            return True
+        return any(
+            has_collscan(value) for key, value in plan.items()
+            if key not in ("rejectedPlans", "allPlansExecution"))
+    if isinstance(plan, list):
+        return any(has_collscan(value) for value in plan)
+    return False
+    
+@pytest.fixture(scope="module")
+def recorded():
+    """
+    Команды, которые драйвер отправил при выполнении сценария.
+    Слушатель команд подключается к новому клиенту, поэтому создается отдельный драйвер
+    (на тех же коллекциях), запись начинается после проверок при его создании.
+    """
+    
+    recorder = CommandRecorder()
+    monitoring.register(recorder)
+    driver = DatabaseDriver()
+    driver.clear_collection()
+    
+    recorder.recording = True
+    try:
+        run_scenario(driver)
+    finally:
+        recorder.recording = False
+        driver.clear_collection()
+        
+    if len(recorder.commands) == 0:
+        pytest.skip("Клиент MongoDB не сообщает о командах")
+        
+    yield driver, get_explained_commands(recorder.commands)
+    
+def test_driver_queries_use_indexes(recorded):
+    """Запросы драйвера (фильтры и конвейеры агрегации) не сканируют всю коллекцию"""
+    
+    driver, commands = recorded
+    
+    collscans = []
+    for database_name, command_name, command in commands:
+        plan = driver._client[database_name].command("explain", command, verbosity="queryPlanner")
+        if has_collscan(plan):
+            collscans.append(command)
+            
+    assert collscans == []
+    
+def test_scenario_covers_collections(recorded):
+    """Сценарий затрагивает запросами все коллекции драйвера"""
+    
+    driver, commands = recorded
+    
+    collections = {command[command_name] for _, command_name, command in commands}
+    for collection in [driver._history, driver._current, driver._aggregates, driver._rollups]:
+        assert collection.name in collections
+        
+def test_ensure_indexes_is_idempotent():
+    """Повторное создание индексов при старте не падает и не дублирует их"""
+    
+    indexes = set(database._history.index_information())
+    ensure_indexes(database._history, HISTORY_INDEXES)
+    assert set(database._history.index_information()) == indexes
@@ -0,0 +1,74 @@
+import asyncio
+import json
+
+from fastapi.testclient import TestClient
+
+from app.jobs import ImportJob, read_batches, spool_body
+from app.main import app, database
+
+client = TestClient(app)
+
+category_id = "3fa85f64-5717-4562-b3fc-2c963f66a101"
+offer_id = "3fa85f64-5717-4562-b3fc-2c963f66a102"
+missing_id = "3fa85f64-5717-4562-b3fc-2c963f66a103"
+
+
+def test_import_job():
+    """Запросы NDJSON записываются по порядку, строки с ошибками пропускаются"""
+    
+    database.clear_collection()
+    lines = [
+        {"items": [{"id": category_id, "name": "Категория", "parentId": None, "type": "CATEGORY"}],
+         "updateDate": "2022-02-01T12:00:00.000Z"},
+        "not json",
+        {"items": [{"id": offer_id, "name": "Товар", "parentId": category_id, "type": "OFFER", "price": 100}],
+         "updateDate": "2022-02-01T13:00:00.000Z"},
+        {"items": [{"id": missing_id, "name": "Товар", "parentId": offer_id, "type": "OFFER", "price": 1}],
+         "updateDate": "2022-02-01T14:00:00.000Z"},
+        {"items": [{"id": offer_id, "name": "Товар", "parentId": category_id, "type": "OFFER", "price": 300}],
+         "updateDate": "2022-02-01T15:00:00.000Z"},
+    ]
+    body = "\n".join(line if isinstance(line, str) else json.dumps(line) for line in lines) + "\n"
+    
+    response = client.post("/imports/jobs", data=body.encode(), headers={"Content-Type": "application/x-ndjson"})
+    assert response.status_code == 202
+    # Ответ - до разбора тела
+    assert (response.json()["status"], response.json()["batches"]) == ("queued", 0)
+    job_id = response.json()["id"]
+    assert response.headers["Location"] == f"/imports/jobs/{job_id}"
+    
+    # Задание выполняется после ответа (TestClient дожидается фоновых задач)
+    status = client.get(f"/imports/jobs/{job_id}").json()
+    assert status["status"] == "completed"
+    assert (status["batches"], status["processed"], status["succeeded"], status["failed"]) == (5, 5, 3, 2)
+    assert [error["line"] for error in status["errors"]] == [2, 4]
+    
+    category = client.get(f"/nodes/{category_id}").json()
+    assert category["price"] == 300
+    assert [child["date"] for child in category["children"]] == ["2022-02-01T15:00:00.000Z"]
+    
+    assert client.get("/imports/jobs/3fa85f64-5717-4562-b3fc-2c963f66a104").status_code == 404
+    database.clear_collection()
+    
+def test_read_batches_from_spooled_body():
+    """Тело больше порога хранится во временном файле и разбирается группами по числу элементов"""
+    
+    lines = [
+        json.dumps({
+            "items": [{"id": id, "name": "Категория", "parentId": None, "type": "CATEGORY"}],
+            "updateDate": "2022-02-01T12:00:00.000Z"})
+        for id in [category_id, offer_id, missing_id]]
+    body = ("\n".join(lines[:2]) + "\n\nnot json\n" + lines[2]).encode()
+    
+    async def chunks():
+        for i in range(0, len(body), 100):
+            yield body[i:i + 100]
+            
+    file = asyncio.run(spool_body(chunks(), max_size=100))
+    assert file._rolled
+    
+    job = ImportJob()
+    groups = list(read_batches(job, file, chunk_size=2))
+    assert [[line_number for line_number, _ in group] for group in groups] == [[1, 2], [5]]
+    assert (job.batches, job.failed, job.errors[0]["line"]) == (4, 1, 4)
+    file.close()
@@ -1,5 +1,7 @@
 import json
 
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
 from fastapi.testclient import TestClient
 
 from app.main import app, database
@@ -15,7 +17,7 @@ with open("/src/tests/data_input.json") as file:
     
 with open("/src/tests/data_output.json") as file:
     data_output = json.load(file)
-
+    
 def test_wrong_input():
     """Тест ошибочного ввода (отсутствует parent в базе)"""
     
@@ -45,6 +47,94 @@ def test_shop_1():
     # 3. Считывание товара, каталога, всего магазина
     read_data(client, data_output)
     
+def test_nodes_stream():
+    """Потоковый ответ /nodes/{id} совпадает побайтно с сериализацией ShopUnit"""
+    
+    for id in ["3fa85f64-5717-4562-b3fc-2c963f66a001", "3fa85f64-5717-4562-b3fc-2c963f66a015"]:
+        response = client.get(f"/nodes/{id}")
+        assert response.status_code == 200
+        assert response.content == JSONResponse(jsonable_encoder(database.get_info(id))).body
+        
+def test_conditional_get():
+    """Ответ с совпадающим If-None-Match - 304 без тела"""
+    
+    id = "3fa85f64-5717-4562-b3fc-2c963f66a001"
+    
+    for url, params in [
+            (f"/nodes/{id}", None),
+            (f"/node/{id}/statistic", {"start_date": "2022-05-28T00:00:00.000Z", "end_date": "2022-05-29T00:00:00.000Z"})]:
+        response = client.get(url, params=params)
+        assert response.status_code == 200
+        etag = response.headers["ETag"]
+        
+        response = client.get(url, params=params, headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.headers["ETag"] == etag
+        assert response.content == b""
+        
+        response = client.get(url, params=params, headers={"If-None-Match": '"0"'})
+        assert response.status_code == 200
+        
+def test_nodes_depth_and_pages():
+    """Ограничение глубины и постраничный вывод дочерних элементов"""
+    
+    id = "3fa85f64-5717-4562-b3fc-2c963f66a001"
+    full = client.get(f"/nodes/{id}").json()
+    
+    response = client.get(f"/nodes/{id}", params={"depth": 0})
+    assert response.status_code == 200
+    assert response.json()["price"] == full["price"]
+    assert response.json()["childrenCount"] == len(full["children"])
+    assert response.json()["children"] is None
+    
+    response = client.get(f"/nodes/{id}", params={"depth": 1})
+    for child, full_child in zip(response.json()["children"], full["children"]):
+        assert child["price"] == full_child["price"]
+        assert child["childrenCount"] == len(full_child["children"])
+        assert child["children"] is None
+        
+    # Страницы по одному дочернему элементу
+    ids = []
+    params = {"children_limit": 1}
+    while True:
+        response = client.get(f"/nodes/{id}", params=params)
+        assert response.status_code == 200
+        assert len(response.json()["children"]) <= 1
+        ids.extend(child["id"] for child in response.json()["children"])
+        if "X-Next-Cursor" not in response.headers:
+            break
+        params["cursor"] = response.headers["X-Next-Cursor"]
+    assert ids == [child["id"] for child in full["children"]]
+    
+    response = client.get(f"/nodes/{id}", params={"depth": -1})
+    assert response.status_code == 400
+    
+def test_nodes_batch():
+    """Несколько элементов одним запросом, в том числе с пересекающимися поддеревьями"""
+    
+    ids = [
+        "3fa85f64-5717-4562-b3fc-2c963f66a003",
+        "3fa85f64-5717-4562-b3fc-2c963f66a001",
+        "3fa85f64-5717-4562-b3fc-2c963f66afff",
+        "3fa85f64-5717-4562-b3fc-2c963f66a008",
+        "3fa85f64-5717-4562-b3fc-2c963f66a003",
+        "3fa85f64-5717-4562-b3fc-2c963f66a004",
+    ]
+    response = client.post("/nodes/batch", json={"ids": ids})
+    assert response.status_code == 200
+    
+    items = response.json()["items"]
+    assert [item["id"] for item in items] == ids
+    for item in items:
+        nodes_response = client.get(f"/nodes/{item['id']}")
+        if nodes_response.status_code == 200:
+            assert item["node"] == nodes_response.json()
+        else:
+            assert item["error"] == {"code": 404, "message": "Item not found"}
+            
+    response = client.post("/nodes/batch", json={"ids": ["not uuid"]})
+    assert response.status_code == 400
+    
 def test_shop_2():
     """
     Вторая часть теста на примере магазина с товарами:
@@ -59,6 +149,66 @@ def test_shop_2():
     # 3. Проверяем обновления товаров за 24 часа
     read_sales(client, data_output)
     
+def test_nodes_at():
+    """Дерево на момент в прошлом собирается по истории"""
+    
+    id = "3fa85f64-5717-4562-b3fc-2c963f66a001"
+    
+    # До обновлений цен - как после первичной загрузки
+    response = client.get(f"/nodes/{id}", params={"at": "2022-05-28T13:00:00.000Z"})
+    assert response.status_code == 200
+    assert response.json() == data_output["test_3_output_3"]
+    
+    response = client.get(f"/nodes/{id}", params={"at": "2022-06-30T00:00:00.000Z"})
+    assert response.json() == client.get(f"/nodes/{id}").json()
+    
+    # До создания элемента
+    response = client.get(f"/nodes/{id}", params={"at": "2022-05-28T09:00:00.000Z"})
+    assert response.status_code == 400
+    response = client.get(f"/nodes/{id}", params={"at": "2022-05-28T13:00:00.000Z", "depth": 1})
+    assert response.status_code == 400
+    
+def test_statistic_granularity():
+    """
+    Статистика по корзинам совпадает с точками статистики, сгруппированными по корзинам:
+    цена - по последней точке корзины, minPrice и maxPrice - по ценам товаров поддерева,
+    обновленных в корзине.
+    """
+    
+    def get_offers_ids(node: dict) -> list:
+        if node["type"] == "OFFER":
+            return [node["id"]]
+        return [id for child in node["children"] for id in get_offers_ids(child)]
+        
+    params = {"start_date": "2022-05-28T00:00:00.000Z", "end_date": "2022-06-30T00:00:00.000Z"}
+    for id in ["3fa85f64-5717-4562-b3fc-2c963f66a001", "3fa85f64-5717-4562-b3fc-2c963f66a021"]:
+        points = client.get(f"/node/{id}/statistic", params=params).json()["items"]
+        assert len(points) > 1
+        offers_points = [
+            point for offer_id in get_offers_ids(client.get(f"/nodes/{id}").json())
+            for point in client.get(f"/node/{offer_id}/statistic", params=params).json()["items"]]
+            
+        for granularity, get_bucket in [
+                ("hour", lambda date: date[:13] + ":00:00.000Z"),
+                ("day", lambda date: date[:10] + "T00:00:00.000Z")]:
+            buckets = dict()
+            for point in points:
+                buckets.setdefault(get_bucket(point["date"]), [None, []])[0] = point["price"]
+            for point in offers_points:
+                buckets[get_bucket(point["date"])][1].append(point["price"])
+                
+            response = client.get(f"/node/{id}/statistic", params={**params, "granularity": granularity})
+            assert response.status_code == 200
+            assert [
+                (item["date"], item["price"], item["minPrice"], item["maxPrice"])
+                for item in response.json()["items"]] == [
+                (bucket, price, min(prices) if len(prices) > 0 else None, max(prices) if len(prices) > 0 else None)
+                for bucket, (price, prices) in sorted(buckets.items())]
+                
+    response = client.get(
+        "/node/3fa85f64-5717-4562-b3fc-2c963f66a001/statistic", params={**params, "granularity": "week"})
+    assert response.status_code == 400
+    
 def test_shop_3():
     """
     Третья часть теста на примере магазина с товарами:
@@ -73,4 +223,139 @@ def test_shop_3():
     
     # Очищаем коллекцию
     database.clear_collection()
-    
\ No newline at end of file
+    
+def test_older_import():
+    """Импорт с более ранней датой попадает только в историю, не заменяя актуальную запись"""
+    
+    first_id = "3fa85f64-5717-4562-b3fc-2c963f66a101"
+    second_id = "3fa85f64-5717-4562-b3fc-2c963f66a102"
+    offer_id = "3fa85f64-5717-4562-b3fc-2c963f66a103"
+    
+    def post(date: str, items: list) -> None:
+        response = client.post("/imports", json={"items": items, "updateDate": date})
+        assert response.status_code == 200
+        
+    def offer(parent_id: str, price: int) -> dict:
+        return {"id": offer_id, "name": "Товар", "parentId": parent_id, "type": "OFFER", "price": price}
+        
+    post("2022-01-31T12:00:00.000Z", [
+        {"id": first_id, "name": "Первая", "parentId": None, "type": "CATEGORY"},
+        {"id": second_id, "name": "Вторая", "parentId": None, "type": "CATEGORY"}])
+    post("2022-02-02T12:00:00.000Z", [offer(first_id, 100)])
+    post("2022-02-01T12:00:00.000Z", [offer(second_id, 50)])
+    
+    response = client.get(f"/nodes/{offer_id}").json()
+    assert (response["parentId"], response["price"], response["date"]) == (first_id, 100, "2022-02-02T12:00:00.000Z")
+    assert client.get(f"/nodes/{first_id}").json()["price"] == 100
+    assert client.get(f"/nodes/{second_id}").json()["children"] == []
+    
+    # Старая запись видна в истории категории, где товар тогда находился
+    response = client.get(f"/nodes/{second_id}", params={"at": "2022-02-01T13:00:00.000Z"}).json()
+    assert (response["price"], [child["id"] for child in response["children"]]) == (50, [offer_id])
+    params = {"start_date": "2022-01-31T00:00:00.000Z", "end_date": "2022-02-03T00:00:00.000Z"}
+    items = client.get(f"/node/{second_id}/statistic", params=params).json()["items"]
+    assert [item["price"] for item in items] == [None, 50, None]
+    
+    # Сводки по корзинам пересчитываются с суток старого импорта
+    response = client.get(f"/node/{second_id}/statistic", params={**params, "granularity": "day"})
+    assert [
+        (item["date"], item["price"], item["minPrice"], item["maxPrice"])
+        for item in response.json()["items"]] == [
+        ("2022-01-31T00:00:00.000Z", None, None, None),
+        ("2022-02-01T00:00:00.000Z", 50, 50, 50),
+        ("2022-02-02T00:00:00.000Z", None, None, None)]
+        
+    database.clear_collection()
+    
+def test_older_import_cycle():
+    """Импорт старше истории, образующий цикл на дату своей записи, отклоняется"""
+    
+    first_id = "3fa85f64-5717-4562-b3fc-2c963f66a111"
+    second_id = "3fa85f64-5717-4562-b3fc-2c963f66a112"
+    
+    def post(date: str, items: list) -> int:
+        return client.post("/imports", json={"items": items, "updateDate": date}).status_code
+        
+    def category(id: str, parent_id) -> dict:
+        return {"id": id, "name": "Категория", "parentId": parent_id, "type": "CATEGORY"}
+        
+    assert post("2022-02-01T01:00:00.000Z", [category(first_id, None), category(second_id, None)]) == 200
+    assert post("2022-02-01T03:00:00.000Z", [category(second_id, first_id)]) == 200
+    assert post("2022-02-01T04:00:00.000Z", [category(first_id, None)]) == 200
+    # С 02:00 до 04:00 первая категория была бы во второй, а с 03:00 вторая - в первой
+    assert post("2022-02-01T02:00:00.000Z", [category(first_id, second_id)]) == 400
+    
+    params = {"start_date": "2022-02-01T00:00:00.000Z", "end_date": "2022-02-02T00:00:00.000Z"}
+    response = client.get(f"/node/{first_id}/statistic", params=params)
+    assert response.status_code == 200
+    assert len(response.json()["items"]) == 3
+    
+    database.clear_collection()
+    
+def test_older_import_under_former_descendant():
+    """Старая запись категории в бывшем потомке видна в его дереве на момент даты"""
+    
+    first_id = "3fa85f64-5717-4562-b3fc-2c963f66a121"
+    second_id = "3fa85f64-5717-4562-b3fc-2c963f66a122"
+    offer_id = "3fa85f64-5717-4562-b3fc-2c963f66a123"
+    
+    def post(date: str, items: list) -> None:
+        response = client.post("/imports", json={"items": items, "updateDate": date})
+        assert response.status_code == 200
+        
+    def category(id: str, parent_id) -> dict:
+        return {"id": id, "name": "Категория", "parentId": parent_id, "type": "CATEGORY"}
+        
+    post("2022-02-01T01:00:00.000Z", [
+        category(first_id, None),
+        category(second_id, first_id),
+        {"id": offer_id, "name": "Товар", "parentId": first_id, "type": "OFFER", "price": 100}])
+    post("2022-02-01T03:00:00.000Z", [category(second_id, None)])
+    post("2022-02-01T05:00:00.000Z", [category(first_id, None)])
+    # Первая категория, в которой раньше была вторая, на 04:00 оказывается во второй
+    post("2022-02-01T04:00:00.000Z", [category(first_id, second_id)])
+    
+    response = client.get(f"/nodes/{second_id}", params={"at": "2022-02-01T04:30:00.000Z"}).json()
+    assert response["price"] == 100
+    assert [child["id"] for child in response["children"]] == [first_id]
+    assert [child["id"] for child in response["children"][0]["children"]] == [offer_id]
+    
+    database.clear_collection()
+    
+def test_nodes_at_after_category_move():
+    """
+    Товар, покинувший категорию до ее переноса, виден в дереве нового предка
+    на момент, когда был в категории (история переписана удалением)
+    """
+    
+    parent_id = "3fa85f64-5717-4562-b3fc-2c963f66a131"
+    deleted_id = "3fa85f64-5717-4562-b3fc-2c963f66a132"
+    category_id = "3fa85f64-5717-4562-b3fc-2c963f66a133"
+    offer_id = "3fa85f64-5717-4562-b3fc-2c963f66a134"
+    
+    def post(date: str, items: list) -> None:
+        response = client.post("/imports", json={"items": items, "updateDate": date})
+        assert response.status_code == 200
+        
+    def category(id: str, parent_id) -> dict:
+        return {"id": id, "name": "Категория", "parentId": parent_id, "type": "CATEGORY"}
+        
+    post("2022-02-01T00:00:00.000Z", [
+        category(parent_id, None), category(deleted_id, None), category(category_id, parent_id)])
+    post("2022-02-01T01:00:00.000Z", [
+        category(category_id, deleted_id),
+        {"id": offer_id, "name": "Товар", "parentId": category_id, "type": "OFFER", "price": 100}])
+    post("2022-02-01T02:00:00.000Z", [
+        {"id": offer_id, "name": "Товар", "parentId": None, "type": "OFFER", "price": 100}])
+    post("2022-02-01T03:00:00.000Z", [category(category_id, parent_id)])
+    # Без записи 01:00 категория была в parent_id с 00:00, а товар в ней - с 01:00 до 02:00
+    assert client.delete(f"/delete/{deleted_id}").status_code == 200
+    
+    params = {"at": "2022-02-01T01:30:00.000Z"}
+    response = client.get(f"/nodes/{parent_id}", params=params).json()
+    assert [child["id"] for child in response["children"]] == [category_id]
+    assert [child["id"] for child in response["children"][0]["children"]] == [offer_id]
+    assert response["price"] == response["children"][0]["price"] == 100
+    assert client.get(f"/nodes/{category_id}", params=params).json() == response["children"][0]
+    
+    database.clear_collection()
@@ -0,0 +1,61 @@
+import types
+
+from fastapi.testclient import TestClient
+
+from app.main import app, database
+from app.metrics import Metrics, MongoCommandListener, RequestStats, current_request
+
+client = TestClient(app)
+
+
+def test_mongo_commands_per_request():
+    """Команды MongoDB учитываются в общих счетчиках и в статистике текущего запроса"""
+    
+    metrics = Metrics()
+    listener = MongoCommandListener(metrics)
+    event = types.SimpleNamespace(command_name="find", duration_micros=2000)
+    
+    listener.succeeded(event)
+    stats = RequestStats()
+    token = current_request.set(stats)
+    listener.succeeded(event)
+    listener.failed(event)
+    current_request.reset(token)
+    
+    assert stats.commands == 2
+    assert abs(stats.duration - 0.004) < 1e-9
+    assert metrics.mongo_commands.get(("find", "succeeded")) == 2
+    assert metrics.mongo_commands.get(("find", "failed")) == 1
+    assert metrics.mongo_command_duration.get_count(("find",)) == 3
+    
+def test_metrics_endpoint():
+    """/metrics отдает длительность запросов по шаблону маршрута и статусу"""
+    
+    client.get("/nodes/not-uuid")
+    response = client.get("/metrics")
+    
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'http_request_duration_seconds_count{method="GET",route="/nodes/{id}",status="400"}' in response.text
+    assert 'http_request_mongo_commands_bucket{method="GET",route="/nodes/{id}",le="+Inf"}' in response.text
+    assert "nodes_cache_hits_total" in response.text
+    
+def test_delete_metrics():
+    """Удаления учитываются в счетчиках /metrics вместе с числом удаленных элементов"""
+    
+    category_id = "3fa85f64-5717-4562-b3fc-2c963f66a301"
+    offer_id = "3fa85f64-5717-4562-b3fc-2c963f66a302"
+    response = client.post("/imports", json={
+        "items": [
+            {"id": category_id, "name": "Категория", "parentId": None, "type": "CATEGORY"},
+            {"id": offer_id, "name": "Товар", "parentId": category_id, "type": "OFFER", "price": 1}],
+        "updateDate": "2022-02-01T12:00:00.000Z"})
+    assert response.status_code == 200
+    
+    deletes, deleted_units = database.deletes, database.deleted_units
+    assert client.delete(f"/delete/{category_id}").status_code == 200
+    assert (database.deletes, database.deleted_units) == (deletes + 1, deleted_units + 2)
+    
+    response = client.get("/metrics")
+    assert f"storage_deletes_total {database.deletes}" in response.text
+    assert "storage_delete_seconds_total" in response.text
@@ -0,0 +1,110 @@
+import datetime
+
+import pytest
+
+from fastapi.testclient import TestClient
+
+from app.main import app, database, metrics
+from bench.catalog import CatalogShape, format_date, generate_catalog
+
+client = TestClient(app)
+
+# Команды продолжения курсора: их число зависит от объема ответа, а не от числа запросов
+CURSOR_COMMANDS = {"getMore", "killCursors", "endSessions"}
+
+# Каталоги растущего размера: 10, 100 и 1000 элементов
+SHAPES = [
+    CatalogShape("10", depth=1, fan_out=2, offers=7, updates=2, updated_offers=0.3),
+    CatalogShape("100", depth=2, fan_out=3, offers=87, updates=2),
+    CatalogShape("1000", depth=3, fan_out=4, offers=915, updates=2),
+]
+
+# Наибольшее число обращений к MongoDB на запрос (не зависит от размера каталога).
+# Увеличение бюджета должно быть осознанным: запрос на каждый элемент его превысит
+BUDGETS = {
+    "POST /imports (initial)": 12,
+    "POST /imports (update)": 12,
+    "GET /nodes/{id} (root)": 4,
+    "GET /nodes/{id} (offer)": 3,
+    "GET /nodes/{id}?depth=1&children_limit=10": 5,
+    # Запрос на уровень дерева: бюджет рассчитан на глубину каталогов SHAPES (до 3 уровней категорий)
+    "GET /nodes/{id}?children_limit=1000": 8,
+    "POST /nodes/batch": 4,
+    "GET /nodes/{id}?at": 4,
+    "GET /sales": 1,
+    "GET /node/{id}/statistic (root)": 3,
+    "GET /node/{id}/statistic (offer)": 3,
+    # Вместе с пересчетом по истории бывших потомков сводок, где удаленная цена была наименьшей или наибольшей
+    "DELETE /delete/{id} (category)": 18,
+    "DELETE /delete/{id} (root)": 12,
+}
+
+
+def count_round_trips(send) -> int:
+    """Число команд MongoDB (без продолжения курсоров), выполненных при запросе send"""
+    
+    def total() -> float:
+        return sum(
+            count for (command, _), count in metrics.mongo_commands.items()
+            if command not in CURSOR_COMMANDS)
+            
+    before = total()
+    response = send()
+    assert response.status_code == 200
+    return int(total() - before)
+    
+@pytest.fixture(scope="module", autouse=True)
+def mongo_events():
+    """Тесты выполняются, только если клиент MongoDB сообщает о командах"""
+    
+    database.clear_collection()
+    if count_round_trips(lambda: client.get("/sales", params={"date": "2022-02-01T12:00:00.000Z"})) == 0:
+        pytest.skip("Хранилище не сообщает о командах MongoDB")
+    yield
+    database.clear_collection()
+    
+@pytest.mark.parametrize("shape", SHAPES, ids=[shape.name for shape in SHAPES])
+def test_round_trips(shape):
+    """Число обращений к MongoDB на каждый запрос API не растет с размером каталога"""
+    
+    database.clear_collection()
+    catalog = generate_catalog(shape)
+    root_id = catalog.root_id
+    offer_id = catalog.offers_ids[0]
+    start_date = format_date(catalog.first_date)
+    end_date = format_date(catalog.last_date + datetime.timedelta(seconds=1))
+    
+    round_trips = dict()
+    round_trips["POST /imports (initial)"] = count_round_trips(
+        lambda: client.post("/imports", json=catalog.imports[0]))
+    round_trips["POST /imports (update)"] = max(
+        count_round_trips(lambda: client.post("/imports", json=request))
+        for request in catalog.imports[1:])
+    round_trips["GET /nodes/{id} (root)"] = count_round_trips(
+        lambda: client.get(f"/nodes/{root_id}"))
+    round_trips["GET /nodes/{id} (offer)"] = count_round_trips(
+        lambda: client.get(f"/nodes/{offer_id}"))
+    round_trips["GET /nodes/{id}?depth=1&children_limit=10"] = count_round_trips(
+        lambda: client.get(f"/nodes/{root_id}", params={"depth": 1, "children_limit": 10}))
+    round_trips["GET /nodes/{id}?children_limit=1000"] = count_round_trips(
+        lambda: client.get(f"/nodes/{root_id}", params={"children_limit": 1000}))
+    batch_ids = [root_id, offer_id] + catalog.categories_ids[1] + catalog.categories_ids[-1][:10]
+    round_trips["POST /nodes/batch"] = count_round_trips(
+        lambda: client.post("/nodes/batch", json={"ids": batch_ids}))
+    round_trips["GET /nodes/{id}?at"] = count_round_trips(
+        lambda: client.get(f"/nodes/{root_id}", params={"at": format_date(catalog.first_date)}))
+    round_trips["GET /sales"] = count_round_trips(
+        lambda: client.get("/sales", params={"date": format_date(catalog.last_date)}))
+    round_trips["GET /node/{id}/statistic (root)"] = count_round_trips(
+        lambda: client.get(f"/node/{root_id}/statistic", params={"start_date": start_date, "end_date": end_date}))
+    round_trips["GET /node/{id}/statistic (offer)"] = count_round_trips(
+        lambda: client.get(f"/node/{offer_id}/statistic", params={"start_date": start_date, "end_date": end_date}))
+    round_trips["DELETE /delete/{id} (category)"] = count_round_trips(
+        lambda: client.delete(f"/delete/{catalog.categories_ids[-1][0]}"))
+    round_trips["DELETE /delete/{id} (root)"] = count_round_trips(
+        lambda: client.delete(f"/delete/{root_id}"))
+        
+    exceeded = {
+        request: (count, BUDGETS[request])
+        for request, count in round_trips.items() if count > BUDGETS[request]}
+    assert exceeded == dict()
@@ -0,0 +1,96 @@
+import asyncio
+import datetime
+import threading
+
+import pytest
+
+from app.async_database import AsyncDatabaseDriver
+from app.memory import MemoryDriver
+from app.storage import ShopUnitDatabase
+from app.write_queue import ImportQueue
+
+category_id = "3fa85f64-5717-4562-b3fc-2c963f66a201"
+offer_id = "3fa85f64-5717-4562-b3fc-2c963f66a202"
+
+
+class BlockingDriver(MemoryDriver):
+    """Хранилище в памяти, запись групп в котором ждет разрешения теста"""
+    
+    def __init__(self) -> None:
+        super().__init__()
+        self.started = threading.Event()
+        self.released = threading.Event()
+        self.groups = []
+        
+    def import_batches(self, batches):
+        self.groups.append(len(batches))
+        self.started.set()
+        self.released.wait()
+        return super().import_batches(batches)
+
+
+class FailingDriver(MemoryDriver):
+    """Хранилище в памяти, недоступное для записи"""
+    
+    def import_batches(self, batches):
+        raise ConnectionError("Storage unavailable")
+
+
+def make_offer(price: int, hour: int) -> ShopUnitDatabase:
+    return ShopUnitDatabase(
+        id=offer_id, name="Товар", type="OFFER", parentId=category_id, price=price,
+        updateDate=datetime.datetime(2022, 2, 1, hour))
+        
+def make_category(hour: int) -> ShopUnitDatabase:
+    return ShopUnitDatabase(
+        id=category_id, name="Категория", type="CATEGORY", parentId=None, price=None,
+        updateDate=datetime.datetime(2022, 2, 1, hour))
+        
+def test_window_flushes_while_group_in_flight():
+    """Импорты, пришедшие во время записи группы, записываются следующей группой после нее"""
+    
+    driver = BlockingDriver()
+    queue = ImportQueue(AsyncDatabaseDriver(driver), window=0.01)
+    
+    async def submit_during_write():
+        first = asyncio.ensure_future(queue.submit([make_category(12)]))
+        # Окно первой группы истекло, группа записывается
+        await asyncio.get_running_loop().run_in_executor(None, driver.started.wait)
+        
+        later = [
+            asyncio.ensure_future(queue.submit([make_offer(100, 13)])),
+            asyncio.ensure_future(queue.submit([make_offer(300, 14)]))]
+        await asyncio.sleep(0.05)
+        assert not first.done()
+        assert (driver.groups, queue.groups) == ([1], 0)
+        
+        driver.released.set()
+        return await asyncio.gather(first, *later)
+        
+    assert asyncio.run(submit_during_write()) == [None, None, None]
+    assert driver.groups == [1, 2]
+    assert (queue.groups, queue.imports) == (2, 3)
+    assert driver.get_info(category_id).price == 300
+    
+def test_storage_error_reaches_every_caller_in_group():
+    """Ошибку хранилища при записи группы получают все импорты группы"""
+    
+    queue = ImportQueue(AsyncDatabaseDriver(FailingDriver()), window=0.01)
+    
+    async def submit_all():
+        return await asyncio.gather(
+            queue.submit([make_category(12)]),
+            queue.submit([make_offer(100, 13)]),
+            queue.submit([make_offer(300, 14)]),
+            return_exceptions=True)
+            
+    results = asyncio.run(submit_all())
+    
+    assert [type(result) for result in results] == [ConnectionError] * 3
+    assert len({id(result) for result in results}) == 1
+    assert (queue.groups, queue.imports) == (1, 3)
+    
+    # Очередь после ошибки принимает новые импорты
+    with pytest.raises(ConnectionError):
+        asyncio.run(queue.submit([make_category(15)]))
+    assert queue.groups == 2